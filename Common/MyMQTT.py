@@ -0,0 +1,345 @@
+import collections
+import json
+import queue
+import threading
+import time
+import paho.mqtt.client as PahoMQTT
+
+from senml import BinarySenMLCodec
+
+
+class JSONCodec:
+    """Encodes messages as UTF-8 JSON, the format every service speaks."""
+    name = "json"
+
+    def encode(self, msg):
+        return json.dumps(msg, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+# Codecs by name, for settings ("PAYLOAD_FORMAT"); every client decodes all of them.
+CODECS = {codec.name: codec for codec in (JSONCodec, BinarySenMLCodec)}
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown payload format {name!r}, expected one of {sorted(CODECS)}")
+
+
+def unit_key(topic):
+    """
+    Dispatch key of a topic: "<main>/<kind>/<house>/<floor>/<unit>/..." maps
+    to "<house>/<floor>/<unit>"; any other topic is its own key.
+    """
+    parts = topic.split("/", 5)
+    return "/".join(parts[2:5]) if len(parts) >= 5 else topic
+
+
+def new_paho_client(clientID, clean_session):
+    """
+    paho-mqtt 2.x wants the callback API version; VERSION2 callbacks take
+    extra (reason code, properties) arguments, which the MyMQTT callbacks
+    accept as optional, so the same client works on paho 1.x and 2.x.
+    """
+    if hasattr(PahoMQTT, "CallbackAPIVersion"):
+        return PahoMQTT.Client(PahoMQTT.CallbackAPIVersion.VERSION2, client_id=clientID, clean_session=clean_session)
+    return PahoMQTT.Client(client_id=clientID, clean_session=clean_session)
+
+
+class MyMQTT:
+    """
+    MQTT client shared by every service.
+
+    - Publishing: myPublish() only queues the message; a sender thread
+      encodes it with the codec and publishes it with the QoS of its topic
+      class (see QOS_RULES). A full queue drops its oldest message.
+    - Receiving: messages are handed off paho's network thread to a pool of
+      `workers` threads, each with a bounded queue. A message goes to the
+      worker of its dispatch key (by default the house/floor/unit of the
+      topic), so messages of one unit are handled in order while different
+      units are handled in parallel. The worker decodes the payload once
+      with the codec and calls notifier.notify(topic, payload). A full
+      queue blocks the network thread, which pushes back on the broker.
+      workers=0 handles messages on the network thread.
+    - Payload formats: a client publishes with its codec (JSON by default,
+      see CODECS) but decodes any format: payloads that start with a binary
+      codec's magic byte go to that codec, everything else to self.codec.
+    - Connection: connects asynchronously and reconnects with exponential
+      backoff (min_backoff..max_backoff seconds); every subscription is
+      renewed on each (re)connect.
+    - publish_stats(), dispatch_stats() and message_stats() report the
+      pipelines' back-pressure and per-topic message counters.
+    """
+
+    # QoS per topic class, first matching filter wins: commands keep exactly-once
+    # delivery, telemetry (every other topic) is superseded by the next reading.
+    QOS_RULES = (("+/commands/#", 2),)
+    DEFAULT_QOS = 1
+
+    def __init__(self, clientID, broker, port, notifier, clean_session=True, codec=None,
+                 qos_rules=None, default_qos=None, subscribe_qos=2, queue_size=1000,
+                 min_backoff=1, max_backoff=60, workers=4, dispatch_queue_size=1000, dispatch_key=unit_key,
+                 verbose=False):
+        self.broker = broker
+        self.port = port
+        self.notifier = notifier  # Object that handles notifications (e.g., your main controller class)
+        self.clientID = clientID
+        self.codec = codec or JSONCodec()
+        # Binary payloads announce their codec with their first byte; the rest is decoded by self.codec.
+        self._decoders = {BinarySenMLCodec.magic: BinarySenMLCodec()}
+        self.qos_rules = self.QOS_RULES if qos_rules is None else qos_rules
+        self.default_qos = self.DEFAULT_QOS if default_qos is None else default_qos
+        self.subscribe_qos = subscribe_qos
+        self.verbose = verbose
+        self._topic = []  # subscriptions, renewed on every connect
+        self._isSubscriber = False
+        self.connected = False
+
+        # Publish pipeline: myPublish() only enqueues, a sender thread encodes and publishes.
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._sender = None
+        self._qos_cache = {}
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0, "published": 0, "dropped": 0, "failed": 0,
+            "queue_high_water": 0, "max_wait_ms": 0.0, "total_wait_ms": 0.0,
+            "received": 0, "decode_errors": 0, "handler_errors": 0, "reconnects": 0,
+        }
+        # Dispatch pool: one bounded queue per worker, chosen by dispatch_key(topic).
+        self.dispatch_key = dispatch_key
+        self._dispatch_queues = [queue.Queue(maxsize=dispatch_queue_size) for _ in range(workers)]
+        self._workers = []
+        self.dispatch = {"dispatched": 0, "waits": 0, "queue_high_water": 0}
+        self.published_by_topic = collections.Counter()
+        self.received_by_topic = collections.Counter()
+
+        self._paho_mqtt = new_paho_client(clientID, clean_session)
+        self._paho_mqtt.reconnect_delay_set(min_delay=min_backoff, max_delay=max_backoff)
+
+        # Register the callback methods
+        self._paho_mqtt.on_connect = self.myOnConnect
+        self._paho_mqtt.on_disconnect = self.myOnDisconnect
+        self._paho_mqtt.on_message = self.myOnMessageReceived
+
+    def myOnConnect(self, paho_mqtt, userdata, flags, rc, properties=None):
+        print(f"Connected to {self.broker} with result code: {rc}")
+        if rc != 0:
+            return
+        if self.connected is None:
+            self._count("reconnects")
+        self.connected = True
+        for topic in list(self._topic):
+            paho_mqtt.subscribe(topic, qos=self.subscribe_qos)
+
+    def myOnDisconnect(self, paho_mqtt, userdata, *args):
+        # paho 1.x passes (rc), 2.x (flags, reason_code, properties).
+        rc = args[0] if len(args) == 1 else args[1]
+        if self.connected:
+            print(f"Disconnected from {self.broker} ({rc}), reconnecting")
+            self.connected = None  # paho reconnects with backoff; myOnConnect renews the subscriptions
+
+    def myOnMessageReceived(self, paho_mqtt, userdata, msg):
+        """
+        A new message is received on a subscribed topic.
+        Queue it for the worker of its dispatch key (or handle it here, without workers).
+        """
+        with self._stats_lock:
+            self.stats["received"] += 1
+            self.received_by_topic[msg.topic] += 1
+        if not self._workers:
+            self.handle_message(msg.topic, msg.payload)
+            return
+        worker = self._dispatch_queues[hash(self.dispatch_key(msg.topic)) % len(self._dispatch_queues)]
+        try:
+            worker.put_nowait((msg.topic, msg.payload))
+        except queue.Full:
+            with self._stats_lock:
+                self.dispatch["waits"] += 1
+            worker.put((msg.topic, msg.payload))
+        with self._stats_lock:
+            self.dispatch["dispatched"] += 1
+            self.dispatch["queue_high_water"] = max(self.dispatch["queue_high_water"], worker.qsize())
+
+    def handle_message(self, topic, payload):
+        """
+        Decodes a payload and forwards the topic and payload to the notifier for further handling.
+        """
+        try:
+            payload = self._decoders.get(payload[:1], self.codec).decode(payload)
+        except ValueError as e:
+            self._count("decode_errors")
+            print(f"Failed to decode message on topic {topic}: {e}")
+            return
+        try:
+            self.notifier.notify(topic, payload)
+        except Exception as e:
+            self._count("handler_errors")
+            print(f"Error processing message on topic {topic}: {e}")
+
+    def _work_loop(self, messages):
+        while True:
+            item = messages.get()
+            if item is None:
+                return
+            self.handle_message(*item)
+
+    def dispatch_stats(self):
+        """Queue depth of every dispatch worker, plus dispatched messages and waits on a full queue."""
+        with self._stats_lock:
+            stats = dict(self.dispatch)
+        stats["depths"] = [messages.qsize() for messages in self._dispatch_queues]
+        stats["queued"] = sum(stats["depths"])
+        return stats
+
+    def myPublish(self, topic, msg):
+        """
+        Queue a message for a specific topic; it is encoded and published
+        by the sender thread. Never blocks: when the queue is full the oldest
+        queued message is dropped (and counted) to make room. msg must not
+        be modified after the call.
+        """
+        item = (topic, msg, time.monotonic())
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self._count("dropped")
+                except queue.Empty:
+                    pass
+        with self._stats_lock:
+            self.stats["enqueued"] += 1
+            self.stats["queue_high_water"] = max(self.stats["queue_high_water"], self._queue.qsize())
+
+    def qos_for(self, topic):
+        qos = self._qos_cache.get(topic)
+        if qos is None:
+            qos = next((q for pattern, q in self.qos_rules if PahoMQTT.topic_matches_sub(pattern, topic)),
+                       self.default_qos)
+            self._qos_cache[topic] = qos
+        return qos
+
+    def publish_stats(self):
+        """Back-pressure metrics of the publish pipeline."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queued"] = self._queue.qsize()
+        sent = stats["published"] + stats["failed"]
+        stats["avg_wait_ms"] = stats["total_wait_ms"] / sent if sent else 0.0
+        return stats
+
+    def message_stats(self):
+        """Messages published and received so far, per topic."""
+        with self._stats_lock:
+            return {"published": dict(self.published_by_topic), "received": dict(self.received_by_topic)}
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _send_loop(self):
+        failing = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            topic, msg, queued_at = item
+            wait_ms = (time.monotonic() - queued_at) * 1000
+            try:
+                info = self._paho_mqtt.publish(topic, self.codec.encode(msg), qos=self.qos_for(topic))
+                ok, error = info.rc == PahoMQTT.MQTT_ERR_SUCCESS, PahoMQTT.error_string(info.rc)
+            except Exception as e:
+                ok, error = False, e
+            if ok and self.verbose:
+                print(f"Published message to {topic}: {msg}")
+            # Report failures once per outage, not once per message.
+            if not ok and not failing:
+                print(f"Failed to publish message to {topic}: {error}")
+            elif ok and failing:
+                print(f"Publishing to {self.broker} again after {failing} failed message(s)")
+            failing = 0 if ok else failing + 1
+            with self._stats_lock:
+                self.stats["published" if ok else "failed"] += 1
+                self.stats["total_wait_ms"] += wait_ms
+                self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+                if ok:
+                    self.published_by_topic[topic] += 1
+
+    def mySubscribe(self, topic):
+        """
+        Subscribe to a topic. The subscription is renewed on every reconnect.
+        """
+        if topic not in self._topic:
+            self._topic.append(topic)
+        self._isSubscriber = True
+        try:
+            if self.connected:
+                self._paho_mqtt.subscribe(topic, qos=self.subscribe_qos)
+            print(f"Subscribed to topic: {topic}")
+        except Exception as e:
+            print(f"Failed to subscribe to {topic}: {e}")
+
+    def start(self):
+        """
+        Start the MQTT client and connect to the broker. The connection is
+        made in the background and retried with backoff until it succeeds.
+        """
+        if self._sender is None:
+            self._sender = threading.Thread(target=self._send_loop, name=f"mqtt-publish-{self.clientID}", daemon=True)
+            self._sender.start()
+        if not self._workers:
+            for i, messages in enumerate(self._dispatch_queues):
+                worker = threading.Thread(target=self._work_loop, args=(messages,),
+                                          name=f"mqtt-dispatch-{self.clientID}-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        try:
+            self._paho_mqtt.connect_async(self.broker, self.port)
+            self._paho_mqtt.loop_start()
+            print("MQTT client started.")
+        except Exception as e:
+            print(f"Failed to start MQTT client: {e}")
+
+    def unsubscribe(self, topic):
+        """
+        Unsubscribe from a specific topic.
+        """
+        try:
+            if topic in self._topic:
+                self._topic.remove(topic)
+                self._paho_mqtt.unsubscribe(topic)
+                print(f"Unsubscribed from topic: {topic}")
+        except Exception as e:
+            print(f"Failed to unsubscribe from {topic}: {e}")
+
+    def stop(self):
+        """
+        Stop the MQTT client and disconnect from the broker.
+        """
+        try:
+            if self._sender is not None:
+                # Publish what is already queued before disconnecting.
+                self._queue.put(None)
+                self._sender.join(timeout=5)
+                self._sender = None
+            if self._isSubscriber and self.connected:
+                for topic in self._topic:
+                    self._paho_mqtt.unsubscribe(topic)
+            self.connected = False
+            self._paho_mqtt.disconnect()
+            self._paho_mqtt.loop_stop()
+            # Let the workers finish the messages already received.
+            for messages in self._dispatch_queues:
+                messages.put(None)
+            for worker in self._workers:
+                worker.join(timeout=5)
+            self._workers = []
+            print("MQTT client stopped.")
+        except Exception as e:
+            print(f"Failed to stop MQTT client: {e}")
@@ -0,0 +1,279 @@
+import json
+import threading
+import time
+import requests
+
+from MyMQTT import new_paho_client
+
+
+_bootstrap_cache = {}  # (catalog_url, units) -> (expires, bootstrap)
+_bootstrap_lock = threading.Lock()
+
+
+def get_bootstrap(catalog_url, units=None, ttl=None, timeout=10):
+    """
+    Returns the registry's /bootstrap payload (broker, topic, revision and the
+    assignments of the given "houseID-floorID-unitID" units), cached in this
+    process for the TTL the registry sends (or `ttl` seconds).
+
+    Services started together in one process share the cache, so only the
+    first one pays for the broker and topic lookups.
+    """
+    catalog_url = catalog_url.rstrip('/')
+    units = tuple(units or ())
+    now = time.time()
+    with _bootstrap_lock:
+        cached = _bootstrap_cache.get((catalog_url, units))
+        if cached and cached[0] > now:
+            return cached[1]
+    params = {"units": ",".join(units)} if units else {}
+    response = requests.get(f"{catalog_url}/bootstrap", params=params, timeout=timeout)
+    response.raise_for_status()
+    bootstrap = response.json()
+    expires = now + (ttl if ttl is not None else bootstrap.get("ttl", 300))
+    with _bootstrap_lock:
+        _bootstrap_cache[(catalog_url, units)] = (expires, bootstrap)
+        # The unit-independent part serves callers that only need broker and topic.
+        if _bootstrap_cache.get((catalog_url, ()), (0,))[0] <= now:
+            _bootstrap_cache[(catalog_url, ())] = (expires, bootstrap)
+    return bootstrap
+
+
+def get_broker(catalog_url, **kwargs):
+    """Returns (IP, port) of the MQTT broker, from the cached bootstrap."""
+    broker = get_bootstrap(catalog_url, **kwargs)["broker"]
+    return broker["IP"], int(broker["port"])
+
+
+def upsert_devices(catalog_url, devices, method="PUT", timeout=10):
+    """
+    Sends device records to the registry's /devices/bulk in one request
+    (devices is a list or an object with a devicesList). Returns the
+    response body and the deviceIDs the registry accepted: from then on
+    those only need heartbeats, not full records.
+    Raises requests.exceptions.RequestException if the request fails.
+    """
+    response = requests.request(method, f"{catalog_url.rstrip('/')}/devices/bulk", json=devices, timeout=timeout)
+    response.raise_for_status()
+    result = response.json()
+    accepted = [item["deviceID"] for item in result.get("results", []) if "status" in item]
+    return result, accepted
+
+
+class CatalogReplica():
+    """
+    Local copy of the catalog's housesList, kept in sync with the registry
+    by revision instead of downloading every house on each poll.
+
+    The first sync() downloads /houses and remembers the revision from its
+    ETag. Later syncs ask /changes?since=<revision> for the houses and
+    devices changed in between and patch the local copy; if the registry
+    restarted or no longer holds those changes, the full list is downloaded
+    again (a conditional GET, so an unchanged catalog costs a 304).
+
+    With follow(), the replica also subscribes to the registry's MQTT change
+    feed and applies changes as they are published; a gap in the revisions
+    falls back to sync(). Changes are applied copy-on-write: only the
+    house/floor/unit path they touch is copied and self.houses is swapped
+    in one assignment, so readers never see a half-applied change.
+    """
+
+    def __init__(self, catalog_url, timeout=10):
+        self.catalog_url = catalog_url.rstrip('/')
+        self.timeout = timeout
+        self.houses = []
+        self.epoch = None
+        self.revision = None
+        self.etag = None
+        self.on_change = None
+        self._partial = False
+        self._lock = threading.RLock()
+        self._paho_mqtt = None
+
+    def sync(self):
+        """
+        Brings the replica up to date. Returns True if anything changed.
+        Raises requests.exceptions.RequestException if the registry is unreachable.
+        """
+        with self._lock:
+            return self._sync()
+
+    def _sync(self):
+        self._partial = False
+        if self.revision is None:
+            return self.reload()
+        response = requests.get(
+            f"{self.catalog_url}/changes",
+            params={"since": self.revision, "epoch": self.epoch},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        body = response.json()
+        if body.get("reset"):
+            return self.reload()
+        changes = body.get("changes", [])
+        if changes:
+            houses = self.houses
+            for change in changes:
+                houses = self.apply_change(houses, change)
+            self.houses = houses
+        self.revision = body["revision"]
+        self.etag = f'"{self.epoch}.{self.revision}"'
+        return bool(changes)
+
+    def reload(self):
+        """Downloads the whole housesList unless the registry answers 304 Not Modified."""
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        response = requests.get(f"{self.catalog_url}/houses", headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+        self.houses = response.json()
+        self._read_etag(response.headers.get("ETag"))
+        return True
+
+    def units(self, with_devices=False):
+        """
+        Yields (houseID, floorID, unitID, unit) for every unit, optionally
+        only for units that have devices.
+        """
+        for house in self.houses:
+            for floor in house.get("floors", []):
+                for unit in floor.get("units", []):
+                    if with_devices and not unit.get("devicesList"):
+                        continue
+                    yield house["houseID"], floor["floorID"], unit["unitID"], unit
+
+    @staticmethod
+    def apply_change(houses, change):
+        """
+        Returns a new housesList with one /changes entry applied. The input
+        list is not modified; untouched houses, floors and units are shared.
+        """
+        houses = list(houses)
+        if change["kind"] == "house":
+            for position, house in enumerate(houses):
+                if str(house["houseID"]) == change["houseID"]:
+                    houses[position] = change["house"]
+                    break
+            else:
+                houses.append(change["house"])
+            return houses
+
+        if change.get("deleted"):
+            locations = change["locations"]
+        else:
+            # The registry stores a device once: an upsert also removes it from where it was before.
+            locations = change.get("removedFrom", []) + [change["location"]]
+        for location in locations:
+            unit = CatalogReplica._copy_unit_path(houses, location)
+            if unit is None:
+                continue
+            devices = [d for d in unit.get("devicesList", []) if str(d["deviceID"]) != change["deviceID"]]
+            if not change.get("deleted") and location == change["location"]:
+                for position, device in enumerate(unit.get("devicesList", [])):
+                    if str(device["deviceID"]) == change["deviceID"]:
+                        devices.insert(position, change["device"])
+                        break
+                else:
+                    devices.append(change["device"])
+            unit["devicesList"] = devices
+        return houses
+
+    @staticmethod
+    def _copy_unit_path(houses, location):
+        """
+        Replaces the house, floor and unit at location with shallow copies
+        (in houses, which must already be a copy) and returns the unit copy.
+        """
+        houseID, floorID, unitID = (str(part) for part in location)
+        for h, house in enumerate(houses):
+            if str(house["houseID"]) != houseID:
+                continue
+            floors = house.get("floors", [])
+            for f, floor in enumerate(floors):
+                if str(floor["floorID"]) != floorID:
+                    continue
+                units = floor.get("units", [])
+                for u, unit in enumerate(units):
+                    if str(unit["unitID"]) != unitID:
+                        continue
+                    unit = dict(unit)
+                    units = units[:u] + [unit] + units[u + 1:]
+                    floors = floors[:f] + [dict(floor, units=units)] + floors[f + 1:]
+                    houses[h] = dict(house, floors=floors)
+                    return unit
+        return None
+
+    # ---- MQTT change feed -------------------------------------------------
+
+    def follow(self, broker, port, main_topic, on_change=None):
+        """
+        Subscribes to the registry's change feed. on_change() is called
+        (from the MQTT thread) after every change applied to the replica.
+        """
+        self.on_change = on_change
+        self.feed_root = f"{main_topic}/catalog"
+        try:
+            self._paho_mqtt = new_paho_client("", True)
+            self._paho_mqtt.on_connect = self._on_connect
+            self._paho_mqtt.on_message = self._on_message
+            self._paho_mqtt.connect(broker, port)
+            self._paho_mqtt.loop_start()
+        except Exception as e:
+            self._paho_mqtt = None
+            print(f"Catalog change feed unavailable, polling only: {e}")
+
+    def unfollow(self):
+        if self._paho_mqtt is not None:
+            self._paho_mqtt.loop_stop()
+            self._paho_mqtt.disconnect()
+            self._paho_mqtt = None
+
+    def _on_connect(self, paho_mqtt, userdata, flags, rc, properties=None):
+        # (Re)subscribing replays the retained topics; changes at or below our revision are skipped.
+        paho_mqtt.subscribe(f"{self.feed_root}/changes/#", qos=1)
+        paho_mqtt.subscribe(f"{self.feed_root}/revision", qos=1)
+
+    def _on_message(self, paho_mqtt, userdata, msg):
+        if not msg.payload:
+            return  # a deleted device's retained topic being cleared
+        try:
+            if self.handle_event(msg.topic, json.loads(msg.payload.decode('utf-8'))) and self.on_change:
+                self.on_change()
+        except Exception as e:
+            print(f"Error applying catalog change from {msg.topic}: {e}")
+
+    def handle_event(self, topic, event):
+        """Applies one feed message. Returns True if the replica changed."""
+        with self._lock:
+            if self.revision is None:
+                return self._sync()
+            if topic == f"{self.feed_root}/revision":
+                self._partial = False
+                if event.get("reset") or event["epoch"] != self.epoch or event["revision"] > self.revision:
+                    return self._sync()
+                return False
+            if event["epoch"] != self.epoch:
+                return False  # retained state of an earlier registry run, covered by the revision message
+            revision = event["rev"]
+            if revision > self.revision + 1:
+                return self._sync()  # missed something: fetch the gap from /changes
+            if revision < self.revision or (revision == self.revision and not self._partial):
+                return False
+            self.houses = self.apply_change(self.houses, event)
+            # One revision may carry several changes (bulk upserts): keep accepting
+            # it until its revision message says it is complete.
+            self._partial = True
+            self.revision = revision
+            self.etag = f'"{self.epoch}.{self.revision}"'
+            return True
+
+    def _read_etag(self, etag):
+        self.etag = etag
+        try:
+            self.epoch, revision = etag.strip('"').rsplit(".", 1)
+            self.revision = int(revision)
+        except (AttributeError, ValueError):
+            # Registry without revisions: keep downloading the full list.
+            self.epoch, self.revision = None, None
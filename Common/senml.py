@@ -0,0 +1,206 @@
+import json
+import struct
+
+
+def readings(topic, msg):
+    """
+    Yields (sensor, record) for every entry of a SenML message, in order,
+    with the record's time resolved against the pack's base time (bt).
+
+    A single reading is published on its sensor's topic
+    (".../<house>/<floor>/<unit>/light_sensor"), which names the sensor.
+    A pack is published on the unit topic and names the sensor in each
+    entry, so that bn + n is the sensor's topic.
+    """
+    parts = topic.split("/")
+    base_time = msg.get("bt")
+    for record in msg.get("e") or ():
+        sensor = parts[5] if len(parts) > 5 else record.get("n")
+        if base_time is not None:
+            record = dict(record, t=base_time + record.get("t", 0))
+        yield sensor, record
+
+
+class BinarySenMLCodec:
+    """
+    Compact binary encoding of SenML packs ({"bn", "bt", "e": [{"n", "u", "t", "v"}]}),
+    the shape of every sensor reading and command.
+
+    Layout (big endian):
+        magic (1 byte) | version (1) | pack flags (1) | [bn] | [bt: float64] | count (uint16) | records
+        record = flags (1) | [n] | [u] | [t: float64] | [v]
+        string = index into STRINGS (1 byte), or 0xFF + uint16 length + UTF-8 bytes
+
+    The magic byte is never the first byte of a JSON document, so it works
+    as the payload's content type: MyMQTT decodes payloads that start with
+    it with this codec and everything else as JSON, whatever codec the
+    receiving client publishes with. Messages that are not plain SenML packs
+    (other keys, nested values, non-numeric timestamps) are sent as JSON.
+    Timestamps (t, bt) decode as floats.
+    """
+    name = "senml-binary"
+    magic = b"\xb5"
+    VERSION = 1
+
+    # Strings every pack repeats, sent as their index. Append only: the index is the wire format.
+    STRINGS = (
+        "light", "motion", "lux", "status", "Detected", "No Motion",
+        "ON", "OFF", "actuator", "command", "light_switch",
+        "light_sensor", "motion_sensor",
+    )
+
+    # Pack flags
+    HAS_BN, HAS_BT = 0x01, 0x02
+    # Record flags: which of n, u, t are present; bits 4-6 hold the kind of v
+    HAS_N, HAS_U, HAS_T = 0x01, 0x02, 0x04
+    V_ABSENT, V_NULL, V_FLOAT, V_INT, V_STR, V_TRUE, V_FALSE = range(7)
+
+    _header = struct.Struct("!cBB")
+    _double = struct.Struct("!d")
+    _int = struct.Struct("!q")
+    _ushort = struct.Struct("!H")
+    _pack_keys = {"bn", "bt", "e"}
+    _record_keys = {"n", "u", "t", "v"}
+
+    def __init__(self):
+        self._string_index = {s: i for i, s in enumerate(self.STRINGS)}
+
+    def encode(self, msg):
+        try:
+            return self.encode_pack(msg)
+        except (TypeError, ValueError, KeyError, AttributeError, struct.error):
+            return json.dumps(msg, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, payload):
+        if payload[:1] != self.magic:
+            return json.loads(payload)
+        try:
+            return self.decode_pack(payload)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"Malformed binary SenML payload: {e}")
+
+    def encode_pack(self, msg):
+        """Binary form of a SenML pack; raises ValueError/TypeError if msg is not one."""
+        if not msg.keys() <= self._pack_keys or not isinstance(msg["e"], list):
+            raise ValueError("not a SenML pack")
+        flags = 0
+        out = bytearray()
+        if msg.get("bn") is not None:
+            flags |= self.HAS_BN
+            self._put_string(out, msg["bn"])
+        if msg.get("bt") is not None:
+            flags |= self.HAS_BT
+            out += self._double.pack(self._timestamp(msg["bt"]))
+        out += self._ushort.pack(len(msg["e"]))
+        for record in msg["e"]:
+            self._put_record(out, record)
+        return self._header.pack(self.magic, self.VERSION, flags) + bytes(out)
+
+    def decode_pack(self, payload):
+        _, version, flags = self._header.unpack_from(payload, 0)
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported binary SenML version {version}")
+        pos = self._header.size
+        msg = {}
+        if flags & self.HAS_BN:
+            msg["bn"], pos = self._get_string(payload, pos)
+        if flags & self.HAS_BT:
+            msg["bt"], = self._double.unpack_from(payload, pos)
+            pos += 8
+        count, = self._ushort.unpack_from(payload, pos)
+        pos += 2
+        records = []
+        for _ in range(count):
+            record, pos = self._get_record(payload, pos)
+            records.append(record)
+        msg["e"] = records
+        return msg
+
+    def _put_record(self, out, record):
+        if not record.keys() <= self._record_keys:
+            raise ValueError("not a SenML record")
+        flags = 0
+        body = bytearray()
+        for key, bit in (("n", self.HAS_N), ("u", self.HAS_U)):
+            if record.get(key) is not None:
+                flags |= bit
+                self._put_string(body, record[key])
+        if record.get("t") is not None:
+            flags |= self.HAS_T
+            body += self._double.pack(self._timestamp(record["t"]))
+        if "v" not in record:
+            kind = self.V_ABSENT
+        else:
+            value = record["v"]
+            if value is None:
+                kind = self.V_NULL
+            elif value is True or value is False:
+                kind = self.V_TRUE if value else self.V_FALSE
+            elif isinstance(value, int):
+                kind = self.V_INT
+                body += self._int.pack(value)
+            elif isinstance(value, float):
+                kind = self.V_FLOAT
+                body += self._double.pack(value)
+            elif isinstance(value, str):
+                kind = self.V_STR
+                self._put_string(body, value)
+            else:
+                raise TypeError("unsupported SenML value")
+        out.append(flags | kind << 4)
+        out += body
+
+    def _get_record(self, payload, pos):
+        flags = payload[pos]
+        pos += 1
+        record = {}
+        if flags & self.HAS_N:
+            record["n"], pos = self._get_string(payload, pos)
+        if flags & self.HAS_U:
+            record["u"], pos = self._get_string(payload, pos)
+        if flags & self.HAS_T:
+            record["t"], = self._double.unpack_from(payload, pos)
+            pos += 8
+        kind = flags >> 4
+        if kind == self.V_FLOAT:
+            record["v"], = self._double.unpack_from(payload, pos)
+            pos += 8
+        elif kind == self.V_STR:
+            record["v"], pos = self._get_string(payload, pos)
+        elif kind == self.V_INT:
+            record["v"], = self._int.unpack_from(payload, pos)
+            pos += 8
+        elif kind == self.V_TRUE or kind == self.V_FALSE:
+            record["v"] = kind == self.V_TRUE
+        elif kind == self.V_NULL:
+            record["v"] = None
+        elif kind != self.V_ABSENT:
+            raise ValueError(f"Unknown SenML value kind {kind}")
+        return record, pos
+
+    def _put_string(self, out, value):
+        index = self._string_index.get(value)
+        if index is not None:
+            out.append(index)
+            return
+        data = value.encode('utf-8')
+        out.append(0xFF)
+        out += self._ushort.pack(len(data))
+        out += data
+
+    def _get_string(self, payload, pos):
+        tag = payload[pos]
+        if tag != 0xFF:
+            return self.STRINGS[tag], pos + 1
+        length, = self._ushort.unpack_from(payload, pos + 1)
+        start = pos + 3
+        if start + length > len(payload):
+            raise IndexError("string runs past the end of the payload")
+        return bytes(payload[start:start + length]).decode('utf-8'), start + length
+
+    @staticmethod
+    def _timestamp(value):
+        # Numbers only: a timestamp sent as a string stays JSON, so it decodes as it was sent.
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError("SenML timestamp must be a number")
+        return float(value)
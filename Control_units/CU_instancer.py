@@ -5,12 +5,24 @@ import json
 import math
 import copy
 import threading
-from control_unit import Controler  
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from catalog_client import CatalogReplica, get_bootstrap
+from control_unit import Controler
 
 class CU_instancer():
     def __init__(self, catalogAddress):
         self.catalogAddress = catalogAddress
         self.availableUnitsList = []
+        self.catalog = CatalogReplica(catalogAddress)
+        try:
+            broker, port = self.get_broker()
+            # One feed client and replica for every controller of this process.
+            self.catalog.follow(broker, port, self.get_main_topic(), on_change=self.refresh_unit_list)
+        except Exception as e:
+            print(f"[WARN] catalog change feed not available: {e}")
         self.PERIODIC_UPDATE_INTERVAL = 60  # seconds
         self.NUM_UNITS_PER_CONTROLLER = 5   # number of units each controller manages
 
@@ -38,7 +50,7 @@ class CU_instancer():
         needed_controllers = math.ceil(len(self.availableUnitsList) / self.NUM_UNITS_PER_CONTROLLER)
         for i in range(needed_controllers):
             name = f"controller_{i}"
-            controller = Controler(self.catalogAddress)
+            controller = Controler(self.catalogAddress, catalog=self.catalog)
             # Keep the reference to the controller in the client for notifications
             controller.client.notifier = controller
             print(f"[INIT] {name} initialized")
@@ -53,22 +65,32 @@ class CU_instancer():
 
     def update_unit_list(self):
         try:
-            resp = requests.get(f"{self.catalogAddress}houses")
-            houses = resp.json()
-            self.availableUnitsList = []
-            for house in houses:
-                for floor in house.get("floors", []):
-                    for unit in floor.get("units", []):
-                        if unit.get("devicesList"):
-                            uid = f"{house['houseID']}-{floor['floorID']}-{unit['unitID']}"
-                            if uid not in self.availableUnitsList:
-                                self.availableUnitsList.append(uid)
-                                print(f"[UNIT] Added {uid}")
-            self.availableUnitsList.sort()
-            print(f"[UPDATE] Unit list refreshed. Total: {len(self.availableUnitsList)}")
+            if not self.catalog.sync() and self.availableUnitsList:
+                print(f"[UPDATE] Unit list unchanged. Total: {len(self.availableUnitsList)}")
+                return
+            self.refresh_unit_list()
         except Exception as e:
             print(f"[ERROR] Failed to update unit list: {e}")
 
+    def refresh_unit_list(self):
+        availableUnitsList = []
+        for houseID, floorID, unitID, _ in self.catalog.units(with_devices=True):
+            uid = f"{houseID}-{floorID}-{unitID}"
+            if uid not in availableUnitsList:
+                availableUnitsList.append(uid)
+                if uid not in self.availableUnitsList:
+                    print(f"[UNIT] Added {uid}")
+        availableUnitsList.sort()
+        self.availableUnitsList = availableUnitsList
+        print(f"[UPDATE] Unit list refreshed. Total: {len(self.availableUnitsList)}")
+
+    def get_broker(self):
+        b = get_bootstrap(self.catalogAddress)["broker"]
+        return b.get("IP"), int(b.get("port"))
+
+    def get_main_topic(self):
+        return get_bootstrap(self.catalogAddress)["topic"]
+
     def periodic_unit_list_update(self):
         self.update_unit_list()
         self.scheduler.enter(self.PERIODIC_UPDATE_INTERVAL, 1, self.periodic_unit_list_update, ())
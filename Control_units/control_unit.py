@@ -5,8 +5,14 @@ import sched
 import requests
 import copy
 import os
+import sys
+import threading
 from datetime import datetime
-from MyMQTT2 import MyMQTT
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from catalog_client import CatalogReplica, get_bootstrap
+from MyMQTT import MyMQTT, get_codec
+from senml import readings
 
 # Mapping from (houseID, floorID, unitID) to deviceID for light_switch
 DEVICE_ID_MAPPING = {
@@ -19,32 +25,40 @@ DEVICE_ID_MAPPING = {
 }
 
 class Controler():
-    def __init__(self, catalogAddress):
+    def __init__(self, catalogAddress, payload_format="json", catalog=None):
+        """
+        catalog: a CatalogReplica shared with other controllers. Its owner
+        keeps it in sync and assigns the controller its units with
+        subscribe_to_topics(). Without one, the controller keeps and follows
+        its own replica and subscribes to every unit of the catalog.
+        """
         self.catalogAddress = catalogAddress.rstrip('/')
         self.clientID = "ThiefDetector_Controller"
         self.main_topic = self.get_main_topic()  # From catalog
         self.sensor_topics = [f"{self.main_topic}/sensors/", f"{self.main_topic.lower()}/sensors/"]
         self.hierarchy = []
+        self._hierarchy_lock = threading.Lock()  # the change feed and the scheduler both update it
+        self.own_catalog = catalog is None
+        self.catalog = CatalogReplica(self.catalogAddress) if self.own_catalog else catalog
         self.PERIODIC_UPDATE_INTERVAL = 60
         self.device_status_cache = {}  # cache to prevent redundant catalog updates
         self.last_motion_time = {}  # (h, f, u) -> timestamp
         self.latest_light_level = {}  # (h, f, u) -> float
 
-        if not os.path.exists("deduplication_done.flag"):
-            self.clean_duplicate_devices()
-            with open("deduplication_done.flag", "w") as f:
-                f.write("done")
-
         try:
             broker, port = self.get_broker()
-            self.client = MyMQTT(self.clientID, broker, port, self)
+            self.client = MyMQTT(self.clientID, broker, port, self, codec=get_codec(payload_format))
             self.client.start()
+            if self.own_catalog:
+                # Pick up new units as soon as the catalog publishes them, not on the next poll.
+                self.catalog.follow(broker, port, self.main_topic, on_change=self.on_catalog_change)
         except Exception as e:
             print(f"Failed to initialize MQTT client: {e}")
             return
 
         self.scheduler = sched.scheduler(time.time, time.sleep)
-        self.scheduler.enter(0, 1, self.periodic_hierarchy_update, ())
+        if self.own_catalog:
+            self.scheduler.enter(0, 1, self.periodic_hierarchy_update, ())
         self.scheduler.enter(10, 2, self.check_lights_off, ())
         self.scheduler.run(blocking=False)
 
@@ -62,28 +76,29 @@ class Controler():
         if "e" not in msg or not msg["e"]:
             print("[WARN] missing 'e' in message")
             return
-        event = msg["e"][0]
-        sensor_val = event.get("v")
-        sensor_time = event.get("t")
-        try:
-            ts = float(sensor_time)
-            readable = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
-        except:
-            readable = sensor_time
         parts = topic.split("/")
-        if len(parts) < 6:
+        if len(parts) < 5:
             print(f"[WARN] unexpected topic format: {topic}")
             return
-        _, _, houseID, floorID, unitID, sensorType = parts[:6]
+        _, _, houseID, floorID, unitID = parts[:5]
         try:
             h, f, u = int(houseID), int(floorID), int(unitID)
         except ValueError:
             print("[ERROR] non-int IDs in topic")
             return
-        if sensorType == "motion_sensor":
-            self.process_motion(h, f, u, sensor_val, readable)
-        elif sensorType == "light_sensor":
-            self.process_light(h, f, u, sensor_val)
+        # One reading per message, or a pack with every sensor of the unit.
+        for sensorType, event in readings(topic, msg):
+            sensor_val = event.get("v")
+            sensor_time = event.get("t")
+            try:
+                ts = float(sensor_time)
+                readable = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+            except:
+                readable = sensor_time
+            if sensorType == "motion_sensor":
+                self.process_motion(h, f, u, sensor_val, readable)
+            elif sensorType == "light_sensor":
+                self.process_light(h, f, u, sensor_val)
 
     def process_motion(self, houseID, floorID, unitID, motion_detected, readable_time):
         key = (houseID, floorID, unitID)
@@ -99,7 +114,8 @@ class Controler():
 
     def check_lights_off(self):
         now = time.time()
-        for key, last_motion in self.last_motion_time.items():
+        # MQTT workers update last_motion_time concurrently: iterate over a copy.
+        for key, last_motion in list(self.last_motion_time.items()):
             if now - last_motion > 30:
                 light_level = self.latest_light_level.get(key, 0)
                 if light_level > 400:
@@ -114,7 +130,7 @@ class Controler():
         topic = f"{base}/commands/{houseID}/{floorID}/{unitID}/{device_name}"
         msg = copy.deepcopy(self.msg)
         msg["bn"] = topic
-        msg["e"][0]["t"] = str(time.time())
+        msg["e"][0]["t"] = time.time()
         msg["e"][0]["v"] = command
         self.client.myPublish(topic, msg)
         print(f"[CMD] {command} -> {topic}")
@@ -157,37 +173,42 @@ class Controler():
         except Exception as e:
             print(f"[ERROR] updating catalog: {e}")
 
+    # Broker and topic come from the catalog's /bootstrap, cached and shared by
+    # every controller in this process.
     def get_broker(self):
-        r = requests.get(f"{self.catalogAddress}/broker")
-        b = r.json()
+        b = get_bootstrap(self.catalogAddress)["broker"]
         return b.get("IP"), int(b.get("port"))
 
     def get_main_topic(self):
         try:
-            r = requests.get(f"{self.catalogAddress}/topic")
-            return r.text.strip('"')
+            return get_bootstrap(self.catalogAddress)["topic"]
         except:
             return "ThiefDetector"
 
     def periodic_hierarchy_update(self):
         try:
-            resp = requests.get(f"{self.catalogAddress}/houses")
-            houses = resp.json()
-            new = [(int(h["houseID"]), int(f["floorID"]), int(u["unitID"]))
-                   for h in houses for f in h.get("floors", []) for u in f.get("units", [])]
-            self.subscribe_main_topic(new)
+            if self.catalog.sync() or not self.hierarchy:
+                new = [(int(h), int(f), int(u)) for h, f, u, _ in self.catalog.units()]
+                self.subscribe_main_topic(new)
         except Exception as e:
             print(f"[ERROR] hierarchy update: {e}")
         finally:
             self.scheduler.enter(self.PERIODIC_UPDATE_INTERVAL, 1, self.periodic_hierarchy_update, ())
 
+    def on_catalog_change(self):
+        self.subscribe_main_topic([(int(h), int(f), int(u)) for h, f, u, _ in self.catalog.units()])
+
     def subscribe_main_topic(self, new_hierarchy):
-        new = set(new_hierarchy)
-        for add in new:
-            for base in self.sensor_topics:
-                sub = f"{base}{add[0]}/{add[1]}/{add[2]}/#"
-                self.client.mySubscribe(sub)
-        self.hierarchy = list(new_hierarchy)
+        # Only the difference: subscribe to the units that appeared, drop the ones that are gone.
+        with self._hierarchy_lock:
+            new, old = set(new_hierarchy), set(self.hierarchy)
+            for add in new - old:
+                for base in self.sensor_topics:
+                    self.client.mySubscribe(f"{base}{add[0]}/{add[1]}/{add[2]}/#")
+            for remove in old - new:
+                for base in self.sensor_topics:
+                    self.client.unsubscribe(f"{base}{remove[0]}/{remove[1]}/{remove[2]}/#")
+            self.hierarchy = list(new_hierarchy)
 
     def subscribe_to_topics(self, units):
         tuples = []
@@ -199,20 +220,6 @@ class Controler():
                 print(f"[WARN] bad unit format: {token}")
         self.subscribe_main_topic(tuples)
 
-    def clean_duplicate_devices(self):
-        try:
-            devs = requests.get(f"{self.catalogAddress}/devices").json()
-            latest = {}
-            for d in devs:
-                id, ts = d["deviceID"], datetime.strptime(d.get("lastUpdate"), "%Y-%m-%d %H:%M:%S")
-                if id not in latest or ts > latest[id][1]:
-                    latest[id] = (d, ts)
-            for d in devs:
-                if d["deviceID"] in latest and d != latest[d["deviceID"]][0]:
-                    requests.delete(f"{self.catalogAddress}/devices?deviceID={d['deviceID']}")
-        except Exception as e:
-            print(f"[ERROR] cleanup duplicates: {e}")
-
 if __name__ == "__main__":
     ctl = Controler("http://127.0.0.1:8080")
     try:
@@ -1,7 +1,8 @@
 import cherrypy
 import json
-import time
 from device_connector import Device_connector
+from connector_scheduler import ConnectorScheduler
+from sensor_engine import SensorFleet
 import os
 
 # Updated file path for sensor settings
@@ -53,16 +54,21 @@ if __name__ == "__main__":
         cherrypy.tree.mount(DC, f'/{DC_name}', conf)
     cherrypy.engine.start()
 
-    import threading
-    threads = []
-    for DC in deviceConnectors.values():
-        t = threading.Thread(target=DC.send_data, daemon=True)
-        threads.append(t)
-        t.start()
+    # One scheduler thread drives every connector at fixed deadlines (no thread per connector);
+    # starts are spread over the first second so the units do not all publish at once.
+    scheduler = ConnectorScheduler()
+    engine = setting.get("sensorEngine")
+    if engine is not None:
+        # One SensorFleet (NumPy) simulates every unit's sensors a window at a time: {"seed": 42} for repeatable runs.
+        connectors = [DC for DC in deviceConnectors.values() if hasattr(DC, "senPublisher")]
+        fleet = SensorFleet([f"{DC.houseID}-{DC.floorID}-{DC.unitID}" for DC in connectors], seed=engine.get("seed"))
+        scheduler.add_fleet(connectors, fleet)
+    else:
+        for i, DC in enumerate(deviceConnectors.values()):
+            scheduler.add(DC, delay=i / len(deviceConnectors))
 
     try:
-        while True:
-            time.sleep(1)
+        scheduler.run()
     except KeyboardInterrupt:
         print("Keyboard interrupt detected. Shutting down...")
         cherrypy.engine.stop()
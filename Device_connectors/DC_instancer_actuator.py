@@ -52,10 +52,13 @@ if __name__ == "__main__":
     try:
         t = 0
         while t < 600:  # run for 600 iterations (10 minutes)
-            # Every 100 seconds, register devices
+            # Register the devices once, then renew their leases every 100 seconds
             if t % 100 == 0:
                 for DC_name, DC in deviceConnectorsAct.items():
-                    DC.registerer()  # register the devices for this actuator connector
+                    if t == 0:
+                        DC.registerer()  # register the devices for this actuator connector
+                    else:
+                        DC.heartbeat()
                     time.sleep(1)
 
                     # Mount the device in CherryPy only on the first iteration
@@ -0,0 +1,120 @@
+import logging
+import sched
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectorScheduler():
+    """
+    Drives any number of Device_connectors from one thread, instead of a
+    send_data thread per connector.
+
+    Every connector runs the same cycle as send_data: a sample every second
+    for DATA_AVG_INTERVAL seconds, then its readings published
+    DATA_SENDING_INTERVAL apart and the catalog synced after another
+    DATA_SENDING_INTERVAL. Deadlines are computed from the cycle's start,
+    not from when the previous step ran, so cadences do not drift and a
+    late step does not delay the next ones. Catalog syncs are HTTP round
+    trips, so they run on a small thread pool instead of the loop.
+
+    Connectors added together with add_fleet() take their readings from a
+    SensorFleet instead: one vectorized window per cycle for all of them,
+    rather than a sample event per connector and second.
+    """
+
+    def __init__(self, catalog_workers=4):
+        self.scheduler = sched.scheduler(time.monotonic, time.sleep)
+        self.catalog_pool = ThreadPoolExecutor(max_workers=catalog_workers, thread_name_prefix="dc-catalog")
+        self.connectors = []
+        self.max_lag = 0.0  # seconds a step has run after its deadline, at most
+
+    def add(self, connector, delay=0.0):
+        """Starts the connector's first cycle after delay seconds."""
+        if not hasattr(connector, "senPublisher"):
+            logger.warning(f"{connector.clientID} has no MQTT publisher, not scheduling it.")
+            return
+        self.connectors.append(connector)
+        self.schedule_cycle(connector, time.monotonic() + delay)
+
+    def schedule_cycle(self, connector, start):
+        for second in range(connector.DATA_AVG_INTERVAL):
+            self.at(start + second, connector.sample)
+        publish_at = start + connector.DATA_AVG_INTERVAL
+        self.at(publish_at, self.publish, connector, publish_at)
+
+    def add_fleet(self, connectors, fleet, delay=0.0):
+        """
+        Starts connectors whose readings come from fleet (a SensorFleet over
+        the same units, in the same order). They share one cycle, so they
+        must share DATA_AVG_INTERVAL and DATA_SENDING_INTERVAL; within it,
+        their publishes are spread over one second, as with add().
+        """
+        if len(connectors) != len(fleet.units):
+            raise ValueError(f"{len(connectors)} connectors for a fleet of {len(fleet.units)} units")
+        if not connectors:
+            return
+        if len({(c.DATA_AVG_INTERVAL, c.DATA_SENDING_INTERVAL) for c in connectors}) > 1:
+            raise ValueError("Connectors of a fleet must share DATA_AVG_INTERVAL and DATA_SENDING_INTERVAL")
+        self.connectors.extend(connectors)
+        start = time.monotonic() + delay
+        self.at(start + connectors[0].DATA_AVG_INTERVAL, self.publish_fleet, connectors, fleet,
+                start + connectors[0].DATA_AVG_INTERVAL)
+
+    def publish(self, connector, publish_at):
+        # Schedule the rest of the cycle first: a failing publish must not stop the connector.
+        self.schedule_cycle(connector, self.end_cycle(connector, publish_at))
+        self.publish_readings(connector, publish_at, *connector.averaged_messages())
+
+    def publish_fleet(self, connectors, fleet, publish_at):
+        window = connectors[0].DATA_AVG_INTERVAL
+        end = publish_at + 2 * connectors[0].DATA_SENDING_INTERVAL
+        self.at(end + window, self.publish_fleet, connectors, fleet, end + window)
+
+        avg_light, detected = fleet.window(time.time() - window, window)
+        for i, (connector, light, motion) in enumerate(zip(connectors, avg_light.tolist(), detected.tolist())):
+            # Staggered like add(): the units do not all publish in the same instant
+            connector_at = publish_at + i / len(connectors)
+            self.end_cycle(connector, connector_at)
+            self.at(connector_at, self.publish_averages, connector, connector_at, light, motion)
+
+    def publish_averages(self, connector, publish_at, avg_light, motion_detected):
+        self.publish_readings(connector, publish_at, *connector.readings_messages(avg_light, motion_detected))
+
+    def end_cycle(self, connector, publish_at):
+        """Schedules the catalog sync that ends the cycle; returns the cycle's end."""
+        end = publish_at + 2 * connector.DATA_SENDING_INTERVAL
+        self.at(end, self.sync_catalog, connector)
+        return end
+
+    def publish_readings(self, connector, publish_at, msg_light, msg_motion):
+        if connector.BATCH_READINGS:
+            connector.publish_readings(msg_light, msg_motion)
+        else:
+            connector.publish_readings(msg_light)
+            self.at(publish_at + connector.DATA_SENDING_INTERVAL, connector.publish_readings, msg_motion)
+
+    def sync_catalog(self, connector):
+        self.catalog_pool.submit(connector.update_catalog, connector.catalog_records())
+
+    def at(self, deadline, action, *args):
+        self.scheduler.enterabs(deadline, 1, self.run_step, (deadline, action) + args)
+
+    def run_step(self, deadline, action, *args):
+        self.max_lag = max(self.max_lag, time.monotonic() - deadline)
+        try:
+            action(*args)
+        except Exception as e:
+            logger.error(f"Error in {action.__name__}: {e}")
+
+    def run(self):
+        """Runs every connector until interrupted, then stops their MQTT publishers."""
+        logger.info(f"Scheduling {len(self.connectors)} device connector(s) from one thread...")
+        try:
+            self.scheduler.run()
+        finally:
+            self.catalog_pool.shutdown(wait=False)
+            for connector in self.connectors:
+                connector.senPublisher.stop()
+            logger.info("MQTT publishers stopped.")
@@ -4,18 +4,23 @@ import json
 import copy
 import cherrypy
 import logging
+import os
+import sys
 
-from MyMQTT import MyMQTT
 from sensors import LightSensor, MotionSensor
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from catalog_client import get_bootstrap, upsert_devices
+from MyMQTT import MyMQTT, get_codec
+
 last_motion_times = {}
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 class senPublisher():
-    def __init__(self, clientID, broker, port):
-        self.client = MyMQTT(clientID, broker, port, None)
+    def __init__(self, clientID, broker, port, codec=None):
+        self.client = MyMQTT(clientID, broker, port, None, codec=codec, workers=0)  # publish only
         self.start()
 
     def start(self):
@@ -25,7 +30,6 @@ class senPublisher():
         self.client.stop()
 
     def publish(self, topic, msg):
-        print(f"[PUBLISH] Topic: {topic}, Message: {msg}")
         self.client.myPublish(topic, msg)
 
 class Device_connector():
@@ -41,19 +45,27 @@ class Device_connector():
         self.clientID = f"{baseClientID}_{houseID}_{floorID}_{unitID}_DCS"
         self.DATA_AVG_INTERVAL = self.DCConfiguration.get("DATA_AVG_INTERVAL", 10)
         self.DATA_SENDING_INTERVAL = self.DCConfiguration.get("DATA_SENDING_INTERVAL", 30)  # Increased interval
+        # "json" or "senml-binary" (half the size); subscribers decode either
+        self.PAYLOAD_FORMAT = self.DCConfiguration.get("PAYLOAD_FORMAT", "json")
+        # Send every reading of a cycle as one SenML pack on the unit topic instead of one message per sensor
+        self.BATCH_READINGS = self.DCConfiguration.get("BATCH_READINGS", False)
+        self.registered_ids = set()  # deviceIDs the catalog already holds; these only need a heartbeat
+        self.light_readings = []  # current averaging window
+        self.motion_readings = []
 
         try:
-            broker, port = self.get_broker()
+            broker, port, main_topic = self.get_bootstrap()
         except Exception as e:
             logger.error(f"Failed to get broker info: {e}")
             return
 
-        self.senPublisher = senPublisher(self.clientID, broker, port)
+        self.senPublisher = senPublisher(self.clientID, broker, port, get_codec(self.PAYLOAD_FORMAT))
         self.light_sensor = LightSensor(f"{houseID}_{floorID}_{unitID}_light")
         self.motion_sensor = MotionSensor(f"{houseID}_{floorID}_{unitID}_motion")
 
+        self.base_name = f"{main_topic}/sensors/{houseID}/{floorID}/{unitID}/"
         self.msg_template = {
-            "bn": f"ThiefDetector/sensors/{houseID}/{floorID}/{unitID}/",
+            "bn": self.base_name,
             "e": [
                 {
                     "n": "sensorKind",
@@ -76,76 +88,27 @@ class Device_connector():
         return "Go to /devices to see the device configuration"
 
     def send_data(self):
+        """Runs this connector's cycle on the calling thread (see ConnectorScheduler for many connectors)."""
         logger.info("Started publishing sensor data...")
         try:
             while True:
                 msg_light, msg_motion = self.get_sen_data()
 
-                # === 1. Update and publish light sensor ===
-                device_payload = copy.deepcopy(self.DCConfiguration["devicesList"][0])
-                device_payload["deviceStatus"] = "ON"
-                device_payload["lastUpdate"] = time.strftime("%Y-%m-%d %H:%M:%S")
-
-                try:
-                    requests.put(f"{self.catalog_url}devices", json=device_payload)
-                    print(f"[CATALOG] Light sensor {device_payload['deviceID']} updated.")
-                except Exception as e:
-                    print(f"[ERROR] Could not update light sensor in catalog: {e}")
-                self.senPublisher.publish(msg_light["bn"], msg_light)
-                logger.info(f"Published light data: {msg_light['e'][0]['v']} to topic: {msg_light['bn']}")
-                time.sleep(self.DATA_SENDING_INTERVAL)
-
-                # === 2. Update and publish motion sensor ===
-                self.senPublisher.publish(msg_motion["bn"], msg_motion)
-                logger.info(f"Published motion data: {msg_motion['e'][0]['v']} to topic: {msg_motion['bn']}")
-                time.sleep(self.DATA_SENDING_INTERVAL)
-
-                # === 3. Register motion sensor for each unit ===
-                for config in self.DCConfiguration["devicesList"]:
-                    unit_id = config["deviceLocation"]["unitID"]
-                    floor_id = config["deviceLocation"]["floorID"]
-                    house_id = config["deviceLocation"]["houseID"]
-                    device_id = config["deviceID"]
-
-                    topic = f"ThiefDetector/sensors/{house_id}/{floor_id}/{unit_id}/motion_sensor"
-                    msg_motion = {
-                        "bn": topic,
-                        "e": [{
-                            "n": "motion",
-                            "u": "status",
-                            "t": str(time.time()),
-                            "v": "Detected"
-                        }]
-                    }
-
-                    motion_payload = {
-                        "deviceID": device_id + 1000,
-                        "deviceName": "motion_sensor",
-                        "deviceStatus": "Detected",
-                        "availableStatuses": ["Detected", "No Motion"],
-                        "deviceLocation": {
-                            "houseID": house_id,
-                            "floorID": floor_id,
-                            "unitID": unit_id
-                        },
-                        "measureType": ["motion"],
-                        "availableServices": ["MQTT"],
-                        "servicesDetails": [{
-                            "serviceType": "MQTT",
-                            "topic": [topic]
-                        }],
-                        "lastUpdate": time.strftime("%Y-%m-%d %H:%M:%S")
-                    }
-
-                    try:
-                        requests.put(f"{self.catalog_url}devices", json=motion_payload)
-                        print(f"[CATALOG] Motion sensor updated for {unit_id}")
-                    except Exception as e:
-                        print(f"[ERROR] Could not update motion sensor for {unit_id}: {e}")
-
-                    # ✅ Safely append to devicesList if not already present
-                    if not any(dev["deviceID"] == motion_payload["deviceID"] for dev in self.DCConfiguration["devicesList"]):
-                        self.DCConfiguration["devicesList"].append(motion_payload)
+                if self.BATCH_READINGS:
+                    # === 1+2. Publish both readings in one pack, same cadence ===
+                    self.publish_readings(msg_light, msg_motion)
+                    time.sleep(2 * self.DATA_SENDING_INTERVAL)
+                else:
+                    # === 1. Publish light sensor ===
+                    self.publish_readings(msg_light)
+                    time.sleep(self.DATA_SENDING_INTERVAL)
+
+                    # === 2. Update and publish motion sensor ===
+                    self.publish_readings(msg_motion)
+                    time.sleep(self.DATA_SENDING_INTERVAL)
+
+                # === 3+4. Sync every record with the catalog in one round trip ===
+                self.update_catalog(self.catalog_records())
 
         except KeyboardInterrupt:
             logger.info("send_data loop stopped by user.")
@@ -155,36 +118,114 @@ class Device_connector():
             self.senPublisher.stop()
             logger.info("MQTT publisher stopped.")
 
+    def publish_readings(self, *messages):
+        """
+        Publishes readings: one pack on the unit topic with BATCH_READINGS,
+        otherwise every message on its sensor's topic.
+        """
+        if self.BATCH_READINGS:
+            pack = self.make_pack(*messages)
+            topic = self.base_name.rstrip("/")
+            self.senPublisher.publish(topic, pack)
+            logger.info(f"Published {len(pack['e'])} readings to topic: {topic}")
+            return
+        for msg in messages:
+            self.senPublisher.publish(msg["bn"], msg)
+            logger.info(f"Published {msg['e'][0]['n']} data: {msg['e'][0]['v']} to topic: {msg['bn']}")
+
+    def catalog_records(self):
+        """Records to sync with the catalog: the light sensor and a motion sensor record per unit."""
+        device_payload = copy.deepcopy(self.DCConfiguration["devicesList"][0])
+        device_payload["deviceStatus"] = "ON"
+        device_payload["lastUpdate"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        catalog_updates = [device_payload]
+
+        # === 3. Collect motion sensor records for each unit ===
+        # (over the other devices only: the loop appends the motion records to devicesList)
+        sensors = [dev for dev in self.DCConfiguration["devicesList"] if dev["deviceName"] != "motion_sensor"]
+        for config in sensors:
+            unit_id = config["deviceLocation"]["unitID"]
+            floor_id = config["deviceLocation"]["floorID"]
+            house_id = config["deviceLocation"]["houseID"]
+            device_id = config["deviceID"]
+
+            topic = f"{self.base_name}motion_sensor"
+            msg_motion = {
+                "bn": topic,
+                "e": [{
+                    "n": "motion",
+                    "u": "status",
+                    "t": time.time(),
+                    "v": "Detected"
+                }]
+            }
+
+            motion_payload = {
+                "deviceID": device_id + 1000,
+                "deviceName": "motion_sensor",
+                "deviceStatus": "Detected",
+                "availableStatuses": ["Detected", "No Motion"],
+                "deviceLocation": {
+                    "houseID": house_id,
+                    "floorID": floor_id,
+                    "unitID": unit_id
+                },
+                "measureType": ["motion"],
+                "availableServices": ["MQTT"],
+                "servicesDetails": [{
+                    "serviceType": "MQTT",
+                    "topic": [topic]
+                }],
+                "lastUpdate": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+            catalog_updates.append(motion_payload)
+
+            # ✅ Safely append to devicesList if not already present
+            if not any(dev["deviceID"] == motion_payload["deviceID"] for dev in self.DCConfiguration["devicesList"]):
+                self.DCConfiguration["devicesList"].append(motion_payload)
+
+        return catalog_updates
 
     def get_sen_data(self):
-        light_readings = []
-        motion_readings = []
+        for _ in range(self.DATA_AVG_INTERVAL):
+            self.sample()
+            time.sleep(1)
+        return self.averaged_messages()
+
+    def sample(self):
+        """Takes one light and one motion reading into the current averaging window."""
         unit_key = f"{self.houseID}-{self.floorID}-{self.unitID}"
+        light_val = self.light_sensor.generate_data()
+        motion_val = self.motion_sensor.generate_data()
 
-        for _ in range(self.DATA_AVG_INTERVAL):
-            light_val = self.light_sensor.generate_data()
-            motion_val = self.motion_sensor.generate_data()
+        self.light_readings.append(light_val)
 
-            light_readings.append(light_val)
+        now = time.time()
+        if motion_val and (unit_key not in last_motion_times or now - last_motion_times[unit_key] > 30):
+            self.motion_readings.append(True)
+            last_motion_times[unit_key] = now
+        else:
+            self.motion_readings.append(False)
 
-            now = time.time()
-            if motion_val and (unit_key not in last_motion_times or now - last_motion_times[unit_key] > 30):
-                motion_readings.append(True)
-                last_motion_times[unit_key] = now
-            else:
-                motion_readings.append(False)
+    def averaged_messages(self):
+        """Averages the window's readings into a light and a motion message and starts a new window."""
+        light_readings, motion_readings = self.light_readings, self.motion_readings
+        self.light_readings, self.motion_readings = [], []
 
-            time.sleep(1)
+        return self.readings_messages(sum(light_readings) / len(light_readings), any(motion_readings))
 
-        avg_light = round(sum(light_readings) / len(light_readings), 2)
-        avg_motion = "Detected" if any(motion_readings) else "No Motion"
+    def readings_messages(self, avg_light, motion_detected):
+        """Light and motion messages for a window's average light level and motion flag."""
+        avg_light = round(avg_light, 2)
+        avg_motion = "Detected" if motion_detected else "No Motion"
 
         msg_light = copy.deepcopy(self.msg_template)
         msg_light["bn"] += "light_sensor"
         msg_light["e"][0].update({
             "n": "light",
             "u": "lux",
-            "t": str(time.time()),
+            "t": time.time(),
             "v": avg_light
         })
 
@@ -193,33 +234,77 @@ class Device_connector():
         msg_motion["e"][0].update({
             "n": "motion",
             "u": "status",
-            "t": str(time.time()),
+            "t": time.time(),
             "v": avg_motion
         })
 
         return msg_light, msg_motion
 
-    def get_broker(self):
+    def make_pack(self, *messages):
+        """
+        Packs single readings into one SenML pack for the unit topic: the
+        unit's base name and the earliest reading's time as base time, each
+        entry named after its sensor (bn + n is the sensor's topic).
+        """
+        base_time = min(msg["e"][0]["t"] for msg in messages)
+        entries = []
+        for msg in messages:
+            event = msg["e"][0]
+            entries.append({
+                "n": msg["bn"][len(self.base_name):],
+                "u": event["u"],
+                "t": event["t"] - base_time,
+                "v": event["v"]
+            })
+        return {"bn": self.base_name, "bt": base_time, "e": entries}
+
+    def update_catalog(self, devices):
+        """
+        Sends full records only for devices the catalog does not hold yet;
+        the others just get their lease renewed with a heartbeat.
+        """
+        new_devices = [d for d in devices if d["deviceID"] not in self.registered_ids]
+        known_ids = [d["deviceID"] for d in devices if d["deviceID"] in self.registered_ids]
+
+        if new_devices:
+            try:
+                result, accepted = upsert_devices(self.catalog_url, new_devices)
+                self.registered_ids.update(accepted)
+                print(f"[CATALOG] {result.get('accepted', 0)} device(s) updated, {result.get('rejected', 0)} rejected.")
+            except Exception as e:
+                print(f"[ERROR] Could not update devices in catalog: {e}")
+
+        if known_ids:
+            try:
+                response = requests.post(f"{self.catalog_url}heartbeat", json={"deviceIDs": known_ids})
+                # Devices the catalog dropped are sent in full on the next cycle.
+                self.registered_ids.difference_update(response.json().get("unknown", []))
+            except Exception as e:
+                print(f"[ERROR] Could not send heartbeat to catalog: {e}")
+
+    def get_bootstrap(self):
+        """
+        Fetches broker, main topic and this unit's devices from the catalog in
+        one (cached) request. Devices the catalog already holds only need heartbeats.
+        """
+        unit = f"{self.houseID}-{self.floorID}-{self.unitID}"
         try:
-            response = requests.get(self.catalog_url + "broker")
-            broker_info = response.json()
+            bootstrap = get_bootstrap(self.catalog_url, units=[unit])
             logger.info("Broker info fetched successfully.")
-            return broker_info["IP"], int(broker_info["port"])
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching broker info: {e}")
             raise
+        self.registered_ids.update(bootstrap.get("assignments", {}).get(unit, {}).get("deviceIDs", []))
+        broker_info = bootstrap["broker"]
+        return broker_info["IP"], int(broker_info["port"]), bootstrap["topic"]
 
     def registerer(self):
         try:
-            response = requests.post(self.catalog_url + "devices", json=self.DCConfiguration)
-            if response.status_code in [200, 201]:
-                logger.info("Device(s) registered successfully with the catalog.")
-            elif response.status_code == 202:
-                logger.info("Device(s) already exist, possibly updating them.")
-                requests.put(self.catalog_url + "devices", json=self.DCConfiguration)
-            else:
-                logger.warning(f"Unexpected response from catalog: {response.text}")
-        except requests.exceptions.RequestException as e:
+            result, accepted = upsert_devices(self.catalog_url, self.DCConfiguration, method="POST")
+            self.registered_ids.update(accepted)
+            logger.info(f"{result.get('accepted', 0)} device(s) registered with the catalog, "
+                        f"{result.get('rejected', 0)} rejected.")
+        except (requests.exceptions.RequestException, ValueError) as e:
             logger.error(f"Error registering device(s) with the catalog: {e}")
 
 if __name__ == "__main__":
@@ -1,9 +1,14 @@
-from MyMQTT import MyMQTT
 import requests
 import time
 import json
 import copy
 import cherrypy
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from catalog_client import get_bootstrap, upsert_devices
+from MyMQTT import MyMQTT
 
 
 class Device_connector_act():
@@ -20,6 +25,7 @@ class Device_connector_act():
         self.DCConfiguration = DCConfiguration
         self.clientID = f"{baseClientID}_{DCID}_DCA"
         self.devices = self.DCConfiguration.get("devicesList", [])
+        self.registered_ids = set()  # deviceIDs the catalog already holds; these only need a heartbeat
 
         # Attempt to parse DCID in the format "houseID-floorID-unitID"
         try:
@@ -30,7 +36,7 @@ class Device_connector_act():
 
         # Request broker info from the catalog
         try:
-            broker, port = self.get_broker()
+            broker, port, main_topic = self.get_broker()
         except (TypeError, ValueError, requests.exceptions.RequestException, json.JSONDecodeError) as e:
             print(f"Failed to get the broker's information. Possibly server is down. Error: {e}")
             return
@@ -41,7 +47,7 @@ class Device_connector_act():
         print(f"MQTT client '{self.clientID}' started.")
 
         # Subscribe to the ThiefDetector commands topic for this house/floor/unit
-        self.topic = f"ThiefDetector/commands/{self.houseID}/{self.floorID}/{self.unitID}/#"
+        self.topic = f"{main_topic}/commands/{self.houseID}/{self.floorID}/{self.unitID}/#"
         self.client.mySubscribe(self.topic)
         print(f"Subscribed to topic: {self.topic}")
 
@@ -96,11 +102,12 @@ class Device_connector_act():
     def notify(self, topic, payload):
         """
         Called whenever a message arrives on our subscribed topics.
-        We parse the JSON, figure out which device it references,
+        MyMQTT has already decoded the payload (JSON or binary SenML); we
+        figure out which device it references,
         and update that device's status accordingly.
         """
         try:
-            msg = json.loads(payload)
+            msg = payload if isinstance(payload, dict) else json.loads(payload)
             # e.g., msg might look like:
             # {
             #   "bn": "...",
@@ -149,15 +156,15 @@ class Device_connector_act():
     ########################################################
     def get_broker(self):
         """
-        Retrieves broker info from the catalog at e.g.:
-          GET <catalog_url>/broker => { "IP": "...", "port": ... }
+        Retrieves broker info and the main topic from the catalog at e.g.:
+          GET <catalog_url>/bootstrap => { "broker": { "IP": "...", "port": ... }, "topic": "...", ... }
+        The answer is cached, so connectors started together share one request.
         """
         try:
-            req_b = requests.get(self.catalog_url + "broker")
-            broker_json = req_b.json()
-            broker, port = broker_json["IP"], int(broker_json["port"])
+            bootstrap = get_bootstrap(self.catalog_url)
+            broker, port = bootstrap["broker"]["IP"], int(bootstrap["broker"]["port"])
             print("Broker info received.\n")
-            return broker, port
+            return broker, port, bootstrap["topic"]
         except requests.exceptions.RequestException as e:
             print(f"Error fetching broker info: {e}")
             raise
@@ -165,21 +172,43 @@ class Device_connector_act():
     ########################################################
     # registerer (optional: if you want to register the devices in the catalog)
     ########################################################
-    def registerer(self):
+    def registerer(self, devices=None):
         """
-        If needed, you can call this method to register each device
-        from self.devices into the ThiefDetector catalog.
+        If needed, you can call this method to register every device
+        from self.devices (or the given ones) into the ThiefDetector catalog
+        in one request.
         """
-        for device in self.devices:
+        devices = self.devices if devices is None else devices
+        for device in devices:
             device["lastUpdate"] = time.strftime("%Y-%m-%d %H:%M:%S")
-            try:
-                response = requests.post(self.catalog_url + "devices", json=device)
-                if response.status_code in [200, 201]:
-                    print(f"Device {device['deviceName']} registered successfully.")
-                elif response.status_code == 202:
-                    print(f"Device {device['deviceName']} already registered; trying to update.")
-                    requests.put(self.catalog_url + "devices", json=device)
+        try:
+            result, accepted = upsert_devices(self.catalog_url, devices, method="POST")
+            self.registered_ids.update(accepted)
+            for item in result.get("results", []):
+                deviceName = devices[item["index"]]["deviceName"]
+                if "errors" in item:
+                    print(f"Device {deviceName} rejected: {item['errors']}")
                 else:
-                    print(f"Unexpected response for {device['deviceName']}: {response.text}")
-            except requests.exceptions.RequestException as e:
-                print(f"Error registering device {device['deviceName']}: {e}")
+                    print(f"Device {deviceName} {item['status']} in the catalog.")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error registering devices: {e}")
+
+    ########################################################
+    # heartbeat (renew the catalog leases of the devices)
+    ########################################################
+    def heartbeat(self):
+        """
+        Renews the catalog leases of the registered devices without
+        re-sending the full records. Devices the catalog does not hold (not
+        registered yet, or dropped since) are registered again.
+        """
+        known_ids = [device["deviceID"] for device in self.devices if device["deviceID"] in self.registered_ids]
+        if known_ids:
+            try:
+                response = requests.post(self.catalog_url + "heartbeat", json={"deviceIDs": known_ids})
+                self.registered_ids.difference_update(response.json().get("unknown", []))
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"Error sending heartbeat: {e}")
+        missing = [device for device in self.devices if device["deviceID"] not in self.registered_ids]
+        if missing:
+            self.registerer(missing)
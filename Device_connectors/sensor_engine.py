@@ -0,0 +1,95 @@
+import argparse
+import math
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional: only the batched simulation needs it
+    np = None
+
+
+class SensorFleet():
+    """
+    Simulates the light and motion sensors of many units at once: one call
+    returns units x samples readings as NumPy arrays, in place of one
+    LightSensor/MotionSensor call per unit and second.
+
+    - Light follows a diurnal curve (dark at night, brightest at local noon),
+      scaled by a fixed per-unit brightness and Gaussian noise, clipped to
+      [min_lux, max_lux] and rounded like LightSensor.
+    - Motion events arrive as a Poisson process per unit, motion_rate events
+      per second; a sample detects motion if at least one event falls in it.
+      The default rate gives MotionSensor's odds (1 in 16 per sample).
+    - seed makes a run reproducible.
+
+    window() then averages and debounces a window of samples per unit the
+    way Device_connector.get_sen_data does, on the arrays.
+    """
+
+    def __init__(self, units, min_lux=0, max_lux=1000, motion_rate=-math.log(15 / 16), seed=None,
+                 sample_period=1.0, debounce=30):
+        if np is None:
+            raise ImportError("SensorFleet needs NumPy: pip install numpy")
+        self.units = list(units)
+        self.MIN_LIGHT = min_lux
+        self.MAX_LIGHT = max_lux
+        self.motion_rate = motion_rate
+        self.sample_period = sample_period
+        self.debounce = debounce
+        self.rng = np.random.default_rng(seed)
+        # How much daylight reaches each unit (windows, orientation), fixed for the run
+        self.brightness = self.rng.uniform(0.6, 1.1, len(self.units))
+        self.last_motion = np.full(len(self.units), -np.inf)  # time of each unit's last reported motion
+
+    def sample_times(self, start, samples):
+        return start + self.sample_period * np.arange(samples)
+
+    def light(self, times):
+        """Light readings (units x samples) at the given epoch times."""
+        local_hours = ((times + time.localtime(times[0]).tm_gmtoff) % 86400) / 3600
+        daylight = np.clip(np.sin(np.pi * (local_hours - 6) / 12), 0, 1)
+        span = self.MAX_LIGHT - self.MIN_LIGHT
+        level = self.brightness[:, None] * (0.05 + 0.9 * daylight)[None, :]
+        noise = self.rng.normal(0, 0.03, (len(self.units), len(times)))
+        return np.round(np.clip(self.MIN_LIGHT + span * (level + noise), self.MIN_LIGHT, self.MAX_LIGHT), 2)
+
+    def motion(self, samples):
+        """Motion readings (units x samples): True where at least one event fell in the sample."""
+        events = self.rng.poisson(self.motion_rate * self.sample_period, (len(self.units), samples))
+        return events > 0
+
+    def window(self, start, samples):
+        """
+        Simulates a window of samples for every unit and averages it.
+        Returns (average light, motion detected) arrays, one entry per unit.
+        A detection only counts if it is more than `debounce` seconds after
+        the unit's last counted one, as in get_sen_data.
+        """
+        times = self.sample_times(start, samples)
+        light = self.light(times)
+        motion = self.motion(samples)
+        detected = np.zeros(len(self.units), dtype=bool)
+        for k in range(samples):  # vectorized over units; a window is only a few samples
+            counted = motion[:, k] & (times[k] - self.last_motion > self.debounce)
+            self.last_motion[counted] = times[k]
+            detected |= counted
+        return light.mean(axis=1), detected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time SensorFleet windows for a simulated fleet.")
+    parser.add_argument("--units", type=int, default=100000)
+    parser.add_argument("--samples", type=int, default=10, help="samples per window (DATA_AVG_INTERVAL)")
+    parser.add_argument("--windows", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    fleet = SensorFleet(range(args.units), seed=args.seed)
+    now = time.time()
+    began = time.perf_counter()
+    for i in range(args.windows):
+        avg_light, detected = fleet.window(now + i * args.samples, args.samples)
+    elapsed = time.perf_counter() - began
+    readings = args.units * args.samples * args.windows * 2
+    print(f"{readings} readings in {elapsed:.3f}s ({readings / elapsed:,.0f}/s); "
+          f"last window: mean light {avg_light.mean():.1f} lux, motion in {detected.sum()} of {args.units} units")
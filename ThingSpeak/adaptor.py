@@ -1,8 +1,13 @@
 import requests
 import time
 import threading
+import os
+import sys
 from flask import Flask, jsonify
-from MyMQTT2 import MyMQTT
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from MyMQTT import MyMQTT
+from senml import readings
 
 class Adaptor:
     def __init__(self):
@@ -43,7 +48,8 @@ class Adaptor:
 
         self.lock = threading.Lock()
 
-        self.client = MyMQTT(self.clientID, self.broker, self.port, self)
+        # Durable session: the broker keeps the adaptor's readings while it is offline.
+        self.client = MyMQTT(self.clientID, self.broker, self.port, self, clean_session=False)
         self.client.start()
 
         for unit in self.unit_config:
@@ -76,13 +82,10 @@ class Adaptor:
     def notify(self, topic, payload):
         print(f"[MQTT] {topic} → {payload}")
         tokens = topic.split("/")
-        if len(tokens) < 6:
+        if len(tokens) < 5:
             return
 
         unit_key = f"{tokens[2]}-{tokens[3]}-{tokens[4]}"
-        sensor_type = tokens[5]
-        event = payload["e"][0]
-        value = event["v"]
         now = time.time()
 
         if unit_key not in self.unit_config:
@@ -100,16 +103,19 @@ class Adaptor:
         if unit_key not in self.latest_light_value:
             self.latest_light_value[unit_key] = 0
 
-        if sensor_type == "motion_sensor":
-            if value == "Detected":
-                self.last_motion_time[unit_key] = now
-                self.light_status[unit_key] = 1
-                self.last_update[unit_key] = time.strftime("%Y-%m-%d %H:%M:%S")
+        # One reading per message, or a pack with every sensor of the unit.
+        for sensor_type, event in readings(topic, payload):
+            value = event["v"]
+            if sensor_type == "motion_sensor":
+                if value == "Detected":
+                    self.last_motion_time[unit_key] = now
+                    self.light_status[unit_key] = 1
+                    self.last_update[unit_key] = time.strftime("%Y-%m-%d %H:%M:%S")
 
 
-        elif sensor_type == "light_sensor":
-            self.latest_light_value[unit_key] = float(value)
-            self.last_update[unit_key] = time.strftime("%Y-%m-%d %H:%M:%S")
+            elif sensor_type == "light_sensor":
+                self.latest_light_value[unit_key] = float(value)
+                self.last_update[unit_key] = time.strftime("%Y-%m-%d %H:%M:%S")
 
 
         time_since_motion = now - self.last_motion_time[unit_key]
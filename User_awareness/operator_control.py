@@ -5,6 +5,10 @@ import time
 import datetime
 import json
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from catalog_client import CatalogReplica, get_bootstrap
 
 class OperatorControl:
     exposed = True
@@ -16,6 +20,13 @@ class OperatorControl:
         self.PERIODIC_UPDATE_INTERVAL = 10  # Seconds between updates
         self.catalog_path = 'catalog.json'
         self.houses = None
+        self.catalog = CatalogReplica(catalog_address)
+        try:
+            bootstrap = get_bootstrap(self.catalog_address)
+            broker = bootstrap["broker"]
+            self.catalog.follow(broker["IP"], int(broker["port"]), bootstrap["topic"], on_change=self._on_catalog_change)
+        except requests.exceptions.RequestException as e:
+            print(f"Catalog change feed not available: {e}")
         self.real_time_houses = {}
         self.base_url_actuators = None
         self.channels_detail = None
@@ -235,16 +246,19 @@ class OperatorControl:
                 # Add the floor to the house structure
                 self.real_time_houses[house_id]["floors"].append(floor_data)
 
+    def _on_catalog_change(self):
+        """Called from the catalog change feed after the replica was updated"""
+        self.houses = self.catalog.houses
+
     def _load_houses(self):
         """Load house data either from catalog service or local file"""
         self.houses = []
         
-        # First try to load from catalog service
+        # First try to sync with the catalog service (only changes are downloaded)
         try:
-            response = requests.get(f"{self.catalog_address}/houses")
-            if response.status_code == 200:
-                self.houses = response.json()
-                return
+            self.catalog.sync()
+            self.houses = self.catalog.houses
+            return
         except requests.exceptions.RequestException as e:
             print(f"Error loading houses from catalog service: {e}")
             
@@ -0,0 +1,372 @@
+"""
+Load test for the catalog registry: generates a synthetic catalog
+(houses x floors x units x devices), starts the registry in-process on a
+free port and drives a weighted mix of requests against it.
+
+Reports p50/p95/p99 latency and throughput per request type, and the
+bytes the storage backend persisted per mutation. Results are written as
+JSON (--output); --compare prints the change against an earlier result.
+
+    python benchmarks/registry_bench.py --houses 20 --floors 5 --units 10 --devices 4 \\
+        --storage journal --server asyncio --requests 20000 --output journal-aio.json
+    python benchmarks/registry_bench.py ... --compare journal-aio.json
+"""
+import argparse
+import asyncio
+import copy
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from catalog_registry import WebCatalogThiefDetector
+
+DEFAULT_MIX = "get_devices=5,query_devices=15,get_device=50,put_device=25,delete_device=5"
+MUTATIONS = {"put_device", "delete_device"}
+
+
+def generate_catalog(houses, floors, units, devices):
+    """
+    A catalog document with houses x floors x units x devices devices,
+    cycling through the device types of catalog-base.json.
+    """
+    with open(os.path.join(ROOT, "catalog-base.json")) as fptr:
+        base = json.load(fptr)
+    templates = [
+        device
+        for house in base["housesList"]
+        for floor in house["floors"]
+        for unit in floor["units"]
+        for device in unit["devicesList"]
+    ]
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    topic = base["projectName"]
+    catalog = {k: v for k, v in base.items() if k != "housesList"}
+    catalog["housesList"] = []
+    deviceID = 0
+    for h in range(1, houses + 1):
+        house = {"houseID": str(h), "houseName": f"House {h}", "lastUpdate": now, "floors": []}
+        for f in range(1, floors + 1):
+            floor = {"floorID": str(f), "units": []}
+            for u in range(1, units + 1):
+                unit = {"unitID": str(u), "lastUpdate": now, "devicesList": []}
+                for d in range(devices):
+                    deviceID += 1
+                    device = copy.deepcopy(templates[d % len(templates)])
+                    device["deviceID"] = deviceID
+                    device["deviceLocation"] = {"houseID": str(h), "floorID": str(f), "unitID": str(u)}
+                    device["servicesDetails"] = [
+                        {"serviceType": "MQTT", "topic": [f"{topic}/{h}/{f}/{u}/{device['deviceName']}"]}
+                    ]
+                    device["lastUpdate"] = now
+                    unit["devicesList"].append(device)
+                floor["units"].append(unit)
+            house["floors"].append(floor)
+        catalog["housesList"].append(house)
+    return catalog
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}. Use {', '.join(OPERATIONS)}")
+    return weights
+
+
+class Workload():
+    """The catalog's devices as the load generator sees them; picks targets for each operation."""
+
+    def __init__(self, catalog, seed):
+        self.devices = {
+            device["deviceID"]: device
+            for house in catalog["housesList"]
+            for floor in house["floors"]
+            for unit in floor["units"]
+            for device in unit["devicesList"]
+        }
+        self.ids = list(self.devices)
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def pick(self, remove=False):
+        with self._lock:
+            if not self.ids:
+                return None
+            position = self.random.randrange(len(self.ids))
+            deviceID = self.ids[position]
+            if remove:
+                # Swap-remove, so later requests never target a deleted device.
+                self.ids[position] = self.ids[-1]
+                self.ids.pop()
+            return self.devices[deviceID]
+
+
+def op_get_devices(session, base, workload):
+    return session.get(f"{base}devices")
+
+
+def op_query_devices(session, base, workload):
+    location = workload.pick()["deviceLocation"]
+    return session.get(f"{base}devices", params=dict(location, fields="deviceID,deviceStatus"))
+
+
+def op_get_device(session, base, workload):
+    return session.get(f"{base}device/{workload.pick()['deviceID']}")
+
+
+def op_put_device(session, base, workload):
+    device = dict(workload.pick())
+    device["deviceStatus"] = workload.random.choice(device["availableStatuses"])
+    return session.put(f"{base}devices", json=device)
+
+
+def op_delete_device(session, base, workload):
+    device = workload.pick(remove=True)
+    return session.delete(f"{base}devices", params={"deviceID": device["deviceID"]})
+
+
+OPERATIONS = {
+    "get_devices": op_get_devices,
+    "query_devices": op_query_devices,
+    "get_device": op_get_device,
+    "put_device": op_put_device,
+    "delete_device": op_delete_device,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(catalog, server, port, threads):
+    """Serves catalog on port in this process. Returns a function that stops the server."""
+    if server == "asyncio":
+        from catalog_aio import AsyncCatalogServer
+        aio = AsyncCatalogServer(catalog, port=port)
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(aio.start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="bench-asyncio", daemon=True).start()
+        started.wait()
+
+        def stop():
+            asyncio.run_coroutine_threadsafe(aio.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+        return stop
+
+    import cherrypy
+    cherrypy.config.update({
+        'server.socket_host': '127.0.0.1', 'server.socket_port': port,
+        'server.thread_pool': threads, 'log.screen': False, 'engine.autoreload.on': False,
+    })
+    cherrypy.tree.mount(catalog, '/', {"/": {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}})
+    cherrypy.engine.start()
+    return cherrypy.engine.exit
+
+
+def drive(base, workload, weights, count, concurrency, seed):
+    """
+    Sends count requests from concurrency threads (one keep-alive session
+    each). Returns ({operation: [latency seconds]}, {operation: errors}, wall seconds).
+    """
+    names = list(weights)
+    schedule = random.Random(seed).choices(names, weights=[weights[n] for n in names], k=count)
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    position = iter(range(count))
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(position, None)
+            if i is None:
+                return
+            name = schedule[i]
+            start = time.perf_counter()
+            try:
+                response = OPERATIONS[name](session, base, workload)
+                ok = response.status_code == 200
+            except (requests.RequestException, TypeError):
+                ok = False  # TypeError: nothing left to delete
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[name].append(elapsed)
+                if not ok:
+                    errors[name] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def summarize(latencies, errors, wall):
+    summary = {}
+    for name, values in latencies.items():
+        values = sorted(values)
+        summary[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "throughput": len(values) / wall if wall else None,
+            "mean_ms": sum(values) / len(values) * 1000 if values else None,
+            "p50_ms": percentile(values, 50) * 1000 if values else None,
+            "p95_ms": percentile(values, 95) * 1000 if values else None,
+            "p99_ms": percentile(values, 99) * 1000 if values else None,
+        }
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result):
+    config = result["config"]
+    print(f"{result['catalog']['devices']} devices in {config['houses']} houses, storage={config['storage']}, "
+          f"server={config['server']}, {config['concurrency']} clients, startup {result['startup_s']:.2f}s")
+    print(f"{'operation':<15} {'count':>7} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, op in result["operations"].items():
+        if not op["count"]:
+            continue
+        print(f"{name:<15} {op['count']:>7} {op['errors']:>6} {op['throughput']:>9.1f} "
+              f"{op['p50_ms']:>8.2f} {op['p95_ms']:>8.2f} {op['p99_ms']:>8.2f}")
+    total = result["total"]
+    print(f"total: {total['requests']} requests in {total['wall_s']:.2f}s, {total['throughput']:.1f} req/s")
+    persisted = result["persisted"]
+    if persisted["bytes_per_mutation"] is not None:
+        print(f"persisted: {persisted['bytes']} bytes, {persisted['bytes_per_mutation']:.0f} bytes/mutation")
+
+
+def print_comparison(result, previous):
+    print(f"vs {previous.get('git') or '?'} ({previous.get('timestamp')}):")
+    for name, op in result["operations"].items():
+        old = previous.get("operations", {}).get(name)
+        if not old or not op["count"] or not old.get("count"):
+            continue
+        deltas = ", ".join(
+            f"{key} {old[key]:.2f} -> {op[key]:.2f} ({(op[key] / old[key] - 1) * 100:+.0f}%)"
+            for key in ("p50_ms", "p99_ms", "throughput") if old.get(key)
+        )
+        print(f"  {name:<15} {deltas}")
+    old, new = previous.get("persisted", {}).get("bytes_per_mutation"), result["persisted"]["bytes_per_mutation"]
+    if old and new is not None:
+        print(f"  bytes/mutation  {old:.0f} -> {new:.0f} ({(new / old - 1) * 100:+.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog registry load test")
+    parser.add_argument("--houses", type=int, default=10)
+    parser.add_argument("--floors", type=int, default=3)
+    parser.add_argument("--units", type=int, default=5)
+    parser.add_argument("--devices", type=int, default=4, help="devices per unit")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default="json")
+    parser.add_argument("--server", choices=["cherrypy", "asyncio"], default="cherrypy")
+    parser.add_argument("--threads", type=int, default=10, help="CherryPy worker threads")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation=weight,... (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="print the change against an earlier JSON result")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    document = generate_catalog(args.houses, args.floors, args.units, args.devices)
+    workload = Workload(document, args.seed)
+    data_dir = tempfile.mkdtemp(prefix="registry-bench-")
+    catalog_path = os.path.join(data_dir, "catalog.json")
+    with open(catalog_path, "w") as fptr:
+        json.dump(document, fptr)
+    catalog_bytes = os.path.getsize(catalog_path)
+
+    start = time.perf_counter()
+    catalog = WebCatalogThiefDetector(catalog_path, storage=args.storage, feed=False, data_dir=data_dir)
+    startup = time.perf_counter() - start
+    port = free_port()
+    stop_server = start_server(catalog, args.server, port, args.threads)
+    base = f"http://127.0.0.1:{port}/"
+
+    try:
+        if args.warmup:
+            reads = {name: weight for name, weight in weights.items() if name not in MUTATIONS} or {"get_device": 1}
+            drive(base, workload, reads, args.warmup, args.concurrency, args.seed)
+        bytes_before = catalog.storage.bytes_written
+        latencies, errors, wall = drive(base, workload, weights, args.requests, args.concurrency, args.seed)
+    finally:
+        stop_server()
+        # Stopping flushes write-behind storage, so its bytes count too.
+        catalog.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    mutations = sum(len(latencies.get(name, [])) - errors.get(name, 0) for name in MUTATIONS)
+    persisted = catalog.storage.bytes_written - bytes_before
+
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": dict(vars(args), mix=weights),
+        "catalog": {"devices": len(workload.devices), "bytes": catalog_bytes},
+        "startup_s": startup,
+        "operations": summarize(latencies, errors, wall),
+        "total": {"requests": args.requests, "wall_s": wall, "throughput": args.requests / wall},
+        "persisted": {
+            "bytes": persisted,
+            "mutations": mutations,
+            "bytes_per_mutation": persisted / mutations if mutations else None,
+        },
+        "response_cache": {"hits": catalog.responses.hits, "misses": catalog.responses.misses},
+    }
+    print_report(result)
+    if args.compare:
+        with open(args.compare) as fptr:
+            print_comparison(result, json.load(fptr))
+    if args.output:
+        with open(args.output, "w") as fptr:
+            json.dump(result, fptr, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares the compiled validators with the previous per-request schema walk
+(top-level fields only) and with an interpreted walk of the full nested
+schema, on a bulk of device and house payloads.
+
+    python benchmarks/validation_bench.py --devices 10000
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from catalog_registry import DEVICE_SCHEMA, HOUSE_SCHEMA, validate_device, validate_house
+from catalog_schema import explain
+
+
+def legacy_validate_payload(payload, schema):
+    """The validator the registry used before catalog_schema (top-level fields only)."""
+    errors = []
+    for field, rules in schema.items():
+        if rules.get("required") and field not in payload:
+            errors.append(f"Missing required field: '{field}'")
+            continue
+
+        if field in payload and not isinstance(payload[field], rules["type"]):
+            errors.append(f"Invalid type for field '{field}'. Expected {rules['type']}, got {type(payload[field])}")
+
+    return errors
+
+
+def make_devices(count):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "catalog-base.json")) as fptr:
+        catalog = json.load(fptr)
+    templates = [
+        device
+        for house in catalog["housesList"]
+        for floor in house["floors"]
+        for unit in floor["units"]
+        for device in unit["devicesList"]
+    ]
+    devices = []
+    for i in range(count):
+        device = copy.deepcopy(templates[i % len(templates)])
+        device["deviceID"] = 100000 + i
+        devices.append(device)
+    return catalog["housesList"], devices
+
+
+def bench(label, func, payloads, repeat):
+    best = min(timeit.repeat(lambda: [func(p) for p in payloads], number=1, repeat=repeat))
+    print(f"{label:<34} {best * 1000:9.2f} ms  {best / len(payloads) * 1e6:7.2f} us/payload")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema validation benchmark")
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=15)
+    args = parser.parse_args()
+
+    houses, devices = make_devices(args.devices)
+    invalid = [dict(d, deviceLocation={"houseID": "1"}) for d in devices[:max(1, len(devices) // 10)]]
+
+    print(f"{len(devices)} devices, {len(houses)} houses, best of {args.repeat}")
+    legacy = bench("legacy validate_payload (devices)", lambda p: legacy_validate_payload(p, DEVICE_SCHEMA), devices, args.repeat)
+    nested = bench("interpreted nested walk (devices)", lambda p: explain(DEVICE_SCHEMA, p), devices, args.repeat)
+    compiled = bench("compiled validate_device", validate_device, devices, args.repeat)
+    print(f"speed-up: {legacy / compiled:.2f}x vs legacy, {nested / compiled:.2f}x vs interpreted nested walk")
+    bench("compiled validate_device (invalid)", validate_device, invalid, args.repeat)
+    bench("legacy validate_payload (houses)", lambda p: legacy_validate_payload(p, HOUSE_SCHEMA), houses * 1000, args.repeat)
+    bench("compiled validate_house", validate_house, houses * 1000, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from catalog_changes import BadRequest, NotModified
+
+
+class AsyncCatalogServer():
+    """
+    Serves the catalog's REST routes from one asyncio event loop instead
+    of CherryPy's thread per request.
+
+    A stdlib HTTP/1.1 server, just enough for the catalog's clients:
+    keep-alive connections, Content-Length bodies, JSON in and out, no
+    sessions. Every connection is a coroutine rather than a thread, so
+    thousands of connectors can keep their connection open and heartbeat
+    through it.
+
+    Reads (GET, POST /heartbeat) only touch in-memory state and run on
+    the loop. Requests that commit a mutation may wait on the writer lock
+    and the storage backend (journal append, SQLite), so they run on a
+    single writer thread: the loop never blocks on disk, and since commits
+    are serialised anyway one thread is all they can use.
+    """
+
+    MAX_HEADER_SIZE = 16 * 1024
+    MAX_BODY_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, catalog, host="127.0.0.1", port=8080, backlog=4096, keep_alive_timeout=75):
+        self.catalog = catalog
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.keep_alive_timeout = keep_alive_timeout
+        self.connections = 0
+        self.requests = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-commit")
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, backlog=self.backlog,
+            limit=self.MAX_HEADER_SIZE
+        )
+        print(f"Catalog serving on http://{self.host}:{self.port}/ (asyncio)")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._writer.shutdown(wait=True)
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.keep_alive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except ValueError as e:
+                    writer.write(self.encode_response(400, str(e), {}, keep_alive=False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                method, target, headers, body, keep_alive = request
+                self.requests += 1
+                status, value, response_headers = await self.dispatch(method, target, headers, body)
+                writer.write(self.encode_response(status, value, response_headers, keep_alive, method == "HEAD"))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def read_request(self, reader):
+        """
+        Reads one request. Returns (method, target, headers, body, keep_alive),
+        or None if the client closed the connection between requests.
+        """
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise ValueError("Request headers too large")
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise ValueError("Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                # Title case, as CherryPy's header map: handlers look up "If-None-Match".
+                headers[name.strip().title()] = value.strip()
+
+        if headers.get("Transfer-Encoding", "").lower() == "chunked":
+            raise ValueError("Chunked request bodies are not supported, send Content-Length")
+        length = int(headers.get("Content-Length") or 0)
+        if length > self.MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+
+        connection = headers.get("Connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return method.upper(), target, headers, body, keep_alive
+
+    async def dispatch(self, method, target, headers, body):
+        """Routes one request to the catalog. Returns (status, value, response_headers)."""
+        url = urlsplit(target)
+        uri = tuple(unquote(part) for part in url.path.split("/") if part)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        response_headers = {}
+        try:
+            if method in ("GET", "HEAD"):
+                try:
+                    return 200, self.catalog.handle_get(uri, params, headers, response_headers), response_headers
+                except NotModified:
+                    return 304, None, response_headers
+
+            if method not in ("POST", "PUT", "DELETE"):
+                response_headers["Allow"] = "GET, HEAD, POST, PUT, DELETE"
+                return 405, f"Method {method} not allowed", response_headers
+            if uri[:1] == ("admin",):
+                if method != "POST":
+                    return 405, f"Method {method} not allowed", response_headers
+                return 200, await self.run_commit(self.catalog.admin.handle_post, uri[1:], params), response_headers
+
+            if method == "DELETE":
+                return 200, await self.run_commit(self.catalog.handle_delete, uri, params), response_headers
+            try:
+                payload = json.loads(body) if body else None
+            except ValueError:
+                return 400, "Invalid JSON document", response_headers
+            if method == "POST" and uri and uri[0].lower() == "heartbeat":
+                # Leases are in memory only: no commit, no disk, no write lock to wait on.
+                return 200, self.catalog.heartbeat(payload), response_headers
+            handler = self.catalog.handle_post if method == "POST" else self.catalog.handle_put
+            try:
+                return 200, await self.run_commit(handler, uri, params, payload), response_headers
+            except BadRequest as e:
+                return 400, {"errors": e.errors}, response_headers
+        except Exception as e:
+            print(f"Error serving {method} {target}: {e!r}")
+            return 500, "Internal server error", {}
+
+    async def run_commit(self, handler, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, handler, *args)
+
+    def encode_response(self, status, value, headers, keep_alive, head_only=False):
+        """
+        Encodes a response the way the CherryPy server's json_out does:
+        bytes pass through, anything else is JSON-encoded.
+        """
+        if status == 304:
+            body = b""
+        elif isinstance(value, bytes):
+            body = value
+        else:
+            body = json.dumps(value).encode('utf-8')
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        if status != 304:
+            lines.append("Content-Type: application/json")
+        lines.append(f"Content-Length: {len(body)}")
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        if not keep_alive:
+            lines.append("Connection: close")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+        return head if head_only else head + body
+
+
+def serve(catalog, host="127.0.0.1", port=8080):
+    """Runs the asyncio server until interrupted, then stops the catalog."""
+    server = AsyncCatalogServer(catalog, host, port)
+
+    async def main():
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        catalog.stop()
@@ -0,0 +1,46 @@
+import gzip
+import json
+import threading
+
+
+class ResponseCache():
+    """
+    Encoded JSON bodies of the hot GET routes, keyed by catalog revision.
+
+    A route is encoded once per revision and then served as the same bytes
+    to every poller; the gzip variant is compressed lazily, the first time
+    a client asks for it. The registry calls invalidate() on every mutation,
+    and a body cached under an older revision is never returned anyway.
+    """
+
+    def __init__(self, gzip_min_size=1024, gzip_level=6):
+        self.gzip_min_size = gzip_min_size
+        self.gzip_level = gzip_level
+        self.entries = {}  # route -> {"revision", "body", "gzip"}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, route, revision, build, accept_gzip=False):
+        """
+        Returns (body, content_encoding) for route at revision, calling
+        build() for the value to encode on a miss. content_encoding is
+        "gzip" or None.
+        """
+        with self._lock:
+            entry = self.entries.get(route)
+            if entry is None or entry["revision"] != revision:
+                self.misses += 1
+                entry = {"revision": revision, "body": json.dumps(build()).encode('utf-8'), "gzip": None}
+                self.entries[route] = entry
+            else:
+                self.hits += 1
+            if not accept_gzip or len(entry["body"]) < self.gzip_min_size:
+                return entry["body"], None
+            if entry["gzip"] is None:
+                entry["gzip"] = gzip.compress(entry["body"], self.gzip_level)
+            return entry["gzip"], "gzip"
+
+    def invalidate(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,75 @@
+import collections
+import threading
+import time
+
+
+class NotModified(Exception):
+    """Raised by a GET handler when the client's If-None-Match is the current ETag."""
+
+
+class BadRequest(Exception):
+    """Raised by a write handler for a payload it refuses; answered with 400 and {"errors": errors}."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+class ChangeLog():
+    """
+    Monotonically increasing catalog revision plus a bounded log of the
+    records changed by each revision.
+
+    The epoch changes on every registry start, so clients can tell that
+    their revision belongs to another run and reload everything. Clients
+    whose revision is older than the oldest retained change are told to
+    reload as well.
+    """
+
+    def __init__(self, capacity=10000):
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self.revision = 0
+        self.floor = 0  # clients at a revision below this must reload
+        self.entries = collections.deque()
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    @property
+    def etag(self):
+        return f'"{self.epoch}.{self.revision}"'
+
+    def record(self, changes):
+        """Bumps the revision and logs the changes made by it."""
+        with self._lock:
+            revision = self.revision + 1
+            for change in changes:
+                change["rev"] = revision
+                self.entries.append(change)
+            while len(self.entries) > self.capacity:
+                self.floor = self.entries.popleft()["rev"]
+            self.revision = revision
+        return revision
+
+    def reset(self):
+        """Bumps the revision for a change that cannot be described record by record."""
+        with self._lock:
+            self.revision += 1
+            self.entries.clear()
+            self.floor = self.revision
+            return self.revision
+
+    def since(self, revision, epoch=None):
+        """
+        Returns the changes made after revision, oldest first, or None if
+        the caller has to reload the full catalog instead.
+        """
+        with self._lock:
+            if epoch != self.epoch or revision < self.floor or revision > self.revision:
+                return None
+            changes = []
+            for change in reversed(self.entries):
+                if change["rev"] <= revision:
+                    break
+                changes.append(change)
+        changes.reverse()
+        return changes
@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Common"))
+from MyMQTT import new_paho_client
+
+
+class CatalogFeed():
+    """
+    Publishes the catalog's change log to MQTT so services can follow it
+    instead of polling.
+
+    Topic tree (all retained, so a new subscriber gets the current state):
+      <mainTopic>/catalog/revision             {"epoch", "revision"[, "reset"]}
+      <mainTopic>/catalog/changes/houses/<id>  the /changes entry of the house
+      <mainTopic>/catalog/changes/devices/<id> the /changes entry of the device
+
+    A deleted device is announced with its /changes entry (not retained)
+    followed by an empty retained payload, which clears the topic on the
+    broker. The revision message is published after the changes of that
+    revision, so a subscriber whose revision differs from it missed something.
+
+    The feed is best effort: if the broker cannot be reached, publishing
+    is a no-op and clients keep working from /changes.
+    """
+
+    def __init__(self, broker, port, mainTopic, clientID="ThiefDetector_CatalogFeed", qos=1):
+        self.broker = broker
+        self.port = port
+        self.root = f"{mainTopic}/catalog"
+        self.qos = qos
+        self.clientID = clientID
+        self.enabled = False
+        self.published = 0
+        self._paho_mqtt = None
+
+    def myOnConnect(self, paho_mqtt, userdata, flags, rc, properties=None):
+        print(f"Catalog feed connected to {self.broker} with result code: {rc}")
+
+    def start(self):
+        try:
+            self._paho_mqtt = new_paho_client(self.clientID, True)
+            self._paho_mqtt.on_connect = self.myOnConnect
+            # connect_async: the registry must not wait for the broker to start serving.
+            self._paho_mqtt.connect_async(self.broker, self.port)
+            self._paho_mqtt.loop_start()
+            self.enabled = True
+        except Exception as e:
+            print(f"Catalog feed disabled: {e}")
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._paho_mqtt.loop_stop()
+        self._paho_mqtt.disconnect()
+
+    def publish(self, changes, epoch, revision):
+        """Publishes the changes of one revision; changes=None announces a reset."""
+        if not self.enabled:
+            return
+        try:
+            for change in changes or []:
+                if change["kind"] == "house":
+                    topic = f"{self.root}/changes/houses/{change['houseID']}"
+                else:
+                    topic = f"{self.root}/changes/devices/{change['deviceID']}"
+                payload = json.dumps(dict(change, epoch=epoch), separators=(',', ':'))
+                if change.get("deleted"):
+                    self._publish(topic, payload, retain=False)
+                    self._publish(topic, b"", retain=True)
+                else:
+                    self._publish(topic, payload, retain=True)
+            status = {"epoch": epoch, "revision": revision}
+            if changes is None:
+                status["reset"] = True
+            self._publish(f"{self.root}/revision", json.dumps(status), retain=True)
+        except Exception as e:
+            print(f"Failed to publish catalog changes: {e}")
+
+    def _publish(self, topic, payload, retain):
+        self._paho_mqtt.publish(topic, payload, qos=self.qos, retain=retain)
+        self.published += 1
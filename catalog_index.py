@@ -0,0 +1,496 @@
+import bisect
+
+
+class SortedKeys():
+    """
+    Sorted collection of keys, stored as a list of sorted chunks of at most
+    2 * LOAD items. An insert or removal bisects the chunk maxima and then
+    shifts one chunk, so its cost depends on LOAD rather than on how many
+    keys there are (a chunk split also copies the chunk list, once every
+    LOAD inserts).
+
+    Readers iterate with iter_from() without locking: it works on a copy of
+    the chunk list and of each chunk, which does not race with the single
+    writer.
+    """
+    LOAD = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._chunks = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks, self._maxes = [[key]], [key]
+            self._len = 1
+            return
+        i = min(bisect.bisect_left(self._maxes, key), len(self._chunks) - 1)
+        chunk = self._chunks[i]
+        bisect.insort(chunk, key)
+        self._maxes[i] = chunk[-1]
+        self._len += 1
+        if len(chunk) > 2 * self.LOAD:
+            self._chunks[i:i + 1] = [chunk[:self.LOAD], chunk[self.LOAD:]]
+            self._maxes[i:i + 1] = [chunk[self.LOAD - 1], chunk[-1]]
+
+    def discard(self, key):
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._chunks):
+            return
+        chunk = self._chunks[i]
+        j = bisect.bisect_left(chunk, key)
+        if j == len(chunk) or chunk[j] != key:
+            return
+        self._len -= 1
+        if len(chunk) == 1:
+            del self._chunks[i]
+            del self._maxes[i]
+            return
+        del chunk[j]
+        self._maxes[i] = chunk[-1]
+
+    def iter_from(self, key=None, inclusive=True):
+        """Yields the keys from key on (after it if not inclusive), in order; all of them if key is None."""
+        for chunk in list(self._chunks):
+            chunk = list(chunk)
+            if key is not None:
+                if not chunk or (chunk[-1] < key if inclusive else chunk[-1] <= key):
+                    continue
+                chunk = chunk[(bisect.bisect_left if inclusive else bisect.bisect_right)(chunk, key):]
+                key = None
+            yield from chunk
+
+
+class CatalogIndex():
+    """
+    In-memory index over the catalog's house tree.
+
+    All IDs are normalised with str() once, when they enter the index, so
+    lookups are plain dict hits instead of list scans. The index is kept up
+    to date incrementally by the registry's mutation paths; rebuild() is only
+    needed when a whole housesList is loaded.
+
+    The house tree is copy-on-write: mutations never modify a house, floor,
+    unit or devicesList that readers may hold. They copy the path from the
+    house down to the changed unit and then swap the new house into the
+    houses map, so a reader that grabbed housesList (or any object below it)
+    keeps a consistent snapshot without locking. Mutations themselves must
+    be serialised by the caller.
+
+    A write copies only the floors and units lists on its path, so its cost
+    depends on the size of one house, not on the number of houses. The
+    housesList is built from the houses map when it is read and cached until
+    the next write, so a full-list copy is paid once per revision that is
+    actually read, not on every write.
+
+    Devices also have secondary indexes (by name, status, and lastUpdate
+    and ID in SortedKeys) so query() can filter and page without scanning
+    the whole catalog.
+    """
+
+    def __init__(self, housesList=None):
+        self.rebuild(housesList if housesList is not None else [])
+
+    def rebuild(self, housesList):
+        """Indexes a whole housesList. A houseID listed twice keeps its last house."""
+        self.houses = {}         # houseID -> house, in housesList order
+        self.floors = {}         # houseID -> {floorID: floor}
+        self.units = {}          # (houseID, floorID, unitID) -> unit
+        self.unit_paths = {}     # (houseID, floorID, unitID) -> positions of floor and unit in the house
+        self.unit_slots = {}     # (houseID, floorID, unitID) -> {deviceID: position in devicesList}
+        self.devices = {}        # deviceID -> device
+        self.device_units = {}   # deviceID -> {unit key: None}, insertion ordered
+        self.by_name = {}        # deviceName -> {deviceID: None}
+        self.by_status = {}      # deviceStatus -> {deviceID: None}
+        self.by_update = SortedKeys()    # (lastUpdate, deviceID)
+        self.ordered_ids = SortedKeys()  # deviceIDs, for cursor pagination
+        self._generation = 0     # bumped by every write to the houses map
+        self._snapshot = None    # (generation, housesList) last built by housesList
+        for house in housesList:
+            self._index_house(house)
+
+    @property
+    def housesList(self):
+        """
+        The houses as a list, built on read and cached until the next write.
+        The generation is read before the map is copied, so a snapshot that
+        raced with a write is cached under the older generation and rebuilt
+        by the next reader.
+        """
+        snapshot = self._snapshot
+        generation = self._generation
+        if snapshot is not None and snapshot[0] == generation:
+            return snapshot[1]
+        housesList = list(self.houses.values())
+        self._snapshot = (generation, housesList)
+        return housesList
+
+    # ---- keys --------------------------------------------------------------
+
+    @staticmethod
+    def unit_key(houseID, floorID, unitID):
+        return (str(houseID), str(floorID), str(unitID))
+
+    @staticmethod
+    def location_key(device):
+        """
+        Returns the unit key of a device from its deviceLocation.
+        Raises KeyError if the location is incomplete.
+        """
+        location = device["deviceLocation"]
+        return CatalogIndex.unit_key(location["houseID"], location["floorID"], location["unitID"])
+
+    # ---- lookups -----------------------------------------------------------
+
+    def get_house(self, houseID):
+        return self.houses.get(str(houseID))
+
+    def get_floors(self, houseID):
+        return self.floors.get(str(houseID), {})
+
+    def get_floor(self, houseID, floorID):
+        return self.get_floors(houseID).get(str(floorID))
+
+    def get_unit(self, houseID, floorID, unitID):
+        return self.units.get(self.unit_key(houseID, floorID, unitID))
+
+    def get_device(self, deviceID):
+        return self.devices.get(str(deviceID))
+
+    def locations_of(self, deviceID):
+        """Returns the unit keys holding a copy of the device."""
+        return list(self.device_units.get(str(deviceID), {}))
+
+    def conflicting_devices(self, house):
+        """
+        Returns the deviceIDs of a house (not yet indexed, or a new version
+        of an indexed one) that would break the one-copy-per-deviceID rule:
+        already stored in another house, or listed twice in this one.
+        """
+        houseID = str(house["houseID"])
+        seen, conflicts = set(), {}
+        for floor in house.get("floors", []):
+            for unit in floor.get("units", []):
+                for device in unit.get("devicesList", []):
+                    deviceID = str(device["deviceID"])
+                    if deviceID in seen or any(key[0] != houseID for key in self.device_units.get(deviceID, {})):
+                        conflicts[deviceID] = None
+                    seen.add(deviceID)
+        return list(conflicts)
+
+    def all_devices(self):
+        devices = []
+        for house in self.housesList:
+            for floor in house.get("floors", []):
+                for unit in floor.get("units", []):
+                    devices.extend(unit["devicesList"])
+        return devices
+
+    def query(self, houseID=None, floorID=None, unitID=None, deviceName=None, status=None,
+              updatedSince=None, after=None, limit=None):
+        """
+        Returns (devices, last deviceID) for the devices matching every given
+        filter, ordered by deviceID, starting after the deviceID `after` and
+        at most `limit` long. The last deviceID is None when there are no
+        more matches. Location filters narrow from houseID down to unitID.
+
+        Only the smallest candidate set is materialised; the other filters
+        are checked on its devices. Index containers are copied with list()
+        before use, which does not race with the single writer.
+        """
+        candidates = []
+        if houseID is not None:
+            candidates.append(self._ids_at(houseID, floorID, unitID))
+        if deviceName is not None:
+            candidates.append(list(self.by_name.get(str(deviceName), {})))
+        if status is not None:
+            candidates.append(list(self.by_status.get(str(status), {})))
+        if updatedSince is not None:
+            candidates.append([deviceID for _, deviceID in self.by_update.iter_from((updatedSince,))])
+
+        if candidates:
+            ids = sorted(min(candidates, key=len))
+            ids = ids[bisect.bisect_right(ids, str(after)):] if after is not None else ids
+        else:
+            ids = self.ordered_ids.iter_from(str(after) if after is not None else None, inclusive=False)
+
+        devices = []
+        for deviceID in ids:
+            device = self.devices.get(deviceID)
+            if device is None or not self._matches(device, deviceID, houseID, floorID, unitID,
+                                                   deviceName, status, updatedSince):
+                continue
+            if limit is not None and len(devices) == limit:
+                return devices, str(devices[-1]["deviceID"])
+            devices.append(device)
+        return devices, None
+
+    # ---- mutations ---------------------------------------------------------
+
+    def add_house(self, house):
+        self._index_house(house)
+
+    def replace_house(self, house):
+        """Swaps in a new version of an indexed house (same houseID) and re-indexes it."""
+        houseID = str(house["houseID"])
+        for key in [k for k in self.units if k[0] == houseID]:
+            self._drop_unit(key)
+        self.floors.pop(houseID, None)
+        self._index_house(house)
+
+    def upsert_device(self, key, device):
+        """
+        Inserts or replaces a device inside the unit identified by key.
+        Any other copy of the device, in this unit or elsewhere (e.g. the
+        device moved), is removed, so every deviceID is stored once.
+        Returns True if the device was new to that unit.
+        """
+        devicesList = list(self.units[key]["devicesList"])
+        slots = self.unit_slots[key]
+        deviceID = str(device["deviceID"])
+        position = slots.get(deviceID)
+        duplicated = False
+        if position is not None:
+            devicesList[position] = device
+            created = False
+            if sum(1 for d in devicesList if str(d["deviceID"]) == deviceID) > 1:
+                devicesList = [d for i, d in enumerate(devicesList) if i == position or str(d["deviceID"]) != deviceID]
+                duplicated = True
+        else:
+            devicesList.append(device)
+            created = True
+        self._publish_unit(key, devicesList)
+        if duplicated:
+            self._index_slots(key)
+        elif created:
+            slots[deviceID] = len(devicesList) - 1
+        for other in [k for k in self.device_units.get(deviceID, {}) if k != key]:
+            self._publish_unit(other, [d for d in self.units[other]["devicesList"] if str(d["deviceID"]) != deviceID])
+            self._index_slots(other)
+        self.device_units[deviceID] = {key: None}
+        self._set_device(deviceID, device)
+        return created
+
+    def remove_device(self, deviceID):
+        """
+        Removes every copy of a device from the units that hold it.
+        Returns the number of entries removed.
+        """
+        deviceID = str(deviceID)
+        removed = 0
+        for key in self.device_units.pop(deviceID, {}):
+            original = self.units[key]["devicesList"]
+            devicesList = [d for d in original if str(d["deviceID"]) != deviceID]
+            removed += len(original) - len(devicesList)
+            self._publish_unit(key, devicesList)
+            self._index_slots(key)
+        self._unset_device(deviceID)
+        return removed
+
+    def find_duplicates(self):
+        """
+        Returns {deviceID: (unit key, position)} of the copy to keep for every
+        device stored more than once: the one with the newest lastUpdate, the
+        first one on ties.
+        """
+        copies = {}
+        for deviceID, holders in self.device_units.items():
+            if len(holders) > 1 or any(
+                    self._count_in_unit(deviceID, key) > 1 for key in holders):
+                copies[deviceID] = None
+        keep = {}
+        for deviceID in copies:
+            newest = None
+            for key in self.device_units[deviceID]:
+                for position, device in enumerate(self.units[key]["devicesList"]):
+                    if str(device["deviceID"]) == deviceID:
+                        stamp = device.get("lastUpdate") or ""
+                        if newest is None or stamp > newest[0]:
+                            newest = (stamp, key, position)
+            keep[deviceID] = newest[1:]
+        return keep
+
+    def compact(self):
+        """
+        Merges duplicated devices in one pass, keeping the newest copy of each.
+        Returns [{"deviceID", "kept": [houseID, floorID, unitID], "removed": n}].
+        """
+        keep = self.find_duplicates()
+        if not keep:
+            return []
+        report = {deviceID: {"deviceID": deviceID, "kept": list(kept[0]), "removed": 0}
+                  for deviceID, kept in keep.items()}
+        touched = {key for deviceID in keep for key in self.device_units[deviceID]}
+        for key in touched:
+            devicesList = []
+            for position, device in enumerate(self.units[key]["devicesList"]):
+                deviceID = str(device["deviceID"])
+                if deviceID in keep and keep[deviceID] != (key, position):
+                    report[deviceID]["removed"] += 1
+                else:
+                    devicesList.append(device)
+            self.replace_devices(key, devicesList)
+        return list(report.values())
+
+    def replace_devices(self, key, devicesList):
+        """Replaces one unit's devicesList and re-indexes the unit."""
+        for deviceID in self.unit_slots.get(key, {}):
+            self._forget_device_in_unit(deviceID, key)
+        self._publish_unit(key, devicesList)
+        self._index_slots(key)
+        for deviceID in self.unit_slots[key]:
+            self.device_units.setdefault(deviceID, {})[key] = None
+            if deviceID not in self.devices:
+                self._set_device(deviceID, self._first_copy(deviceID))
+
+    # ---- internals ---------------------------------------------------------
+
+    def _publish_unit(self, key, devicesList):
+        """
+        Copies the path from the house down to the unit at key, with the new
+        devicesList, and swaps it in. The path is found through unit_paths,
+        and only the house's floors and the floor's units are copied.
+        """
+        unit = self.units[key]
+        houseID, floorID, _ = key
+        floor_position, unit_position = self.unit_paths[key]
+        house = self.houses[houseID]
+        floor = house["floors"][floor_position]
+        new_unit = dict(unit, devicesList=devicesList)
+        new_floor = dict(floor, units=self._replaced(floor["units"], unit_position, new_unit))
+        new_house = dict(house, floors=self._replaced(house["floors"], floor_position, new_floor))
+        self.units[key] = new_unit
+        if self.floors[houseID].get(floorID) is floor:
+            self.floors[houseID][floorID] = new_floor
+        self._set_house(houseID, new_house)
+
+    @staticmethod
+    def _replaced(items, position, new):
+        """Returns a copy of items with the item at position replaced by new."""
+        items = list(items)
+        items[position] = new
+        return items
+
+    def _set_house(self, houseID, house):
+        # The map first, then the generation: see housesList.
+        self.houses[houseID] = house
+        self._generation += 1
+
+    def _index_house(self, house):
+        houseID = str(house["houseID"])
+        self._set_house(houseID, house)
+        floors = self.floors.setdefault(houseID, {})
+        for floor_position, floor in enumerate(house.get("floors", [])):
+            floorID = str(floor["floorID"])
+            floors[floorID] = floor
+            for unit_position, unit in enumerate(floor.get("units", [])):
+                key = (houseID, floorID, str(unit["unitID"]))
+                unit.setdefault("devicesList", [])
+                self.units[key] = unit
+                self.unit_paths[key] = (floor_position, unit_position)
+                self._index_slots(key)
+                for deviceID in self.unit_slots[key]:
+                    self.device_units.setdefault(deviceID, {})[key] = None
+                    if deviceID not in self.devices:
+                        self._set_device(deviceID, self._first_copy(deviceID))
+
+    def _index_slots(self, key):
+        slots = {}
+        for position, device in enumerate(self.units[key]["devicesList"]):
+            slots.setdefault(str(device["deviceID"]), position)
+        self.unit_slots[key] = slots
+
+    def _drop_unit(self, key):
+        for deviceID in self.unit_slots.pop(key, {}):
+            self._forget_device_in_unit(deviceID, key)
+        self.units.pop(key, None)
+        self.unit_paths.pop(key, None)
+
+    def _forget_device_in_unit(self, deviceID, key):
+        holders = self.device_units.get(deviceID)
+        if holders is None:
+            return
+        holders.pop(key, None)
+        if holders:
+            self._set_device(deviceID, self._first_copy(deviceID))
+        else:
+            del self.device_units[deviceID]
+            self._unset_device(deviceID)
+
+    def _first_copy(self, deviceID):
+        key = next(iter(self.device_units[deviceID]))
+        return self.units[key]["devicesList"][self.unit_slots[key][deviceID]]
+
+    def _count_in_unit(self, deviceID, key):
+        # unit_slots only remembers the first position, so a repeat shows up as a length mismatch.
+        if len(self.unit_slots[key]) == len(self.units[key]["devicesList"]):
+            return 1
+        return sum(1 for d in self.units[key]["devicesList"] if str(d["deviceID"]) == deviceID)
+
+    def _set_device(self, deviceID, device):
+        old = self.devices.get(deviceID)
+        if old is device:
+            return
+        if old is None:
+            self.ordered_ids.add(deviceID)
+        else:
+            self._unindex_device(deviceID, old)
+        self.devices[deviceID] = device
+        self.by_name.setdefault(str(device.get("deviceName")), {})[deviceID] = None
+        self.by_status.setdefault(str(device.get("deviceStatus")), {})[deviceID] = None
+        self.by_update.add((device.get("lastUpdate") or "", deviceID))
+
+    def _unset_device(self, deviceID):
+        old = self.devices.pop(deviceID, None)
+        if old is None:
+            return
+        self._unindex_device(deviceID, old)
+        self.ordered_ids.discard(deviceID)
+
+    def _unindex_device(self, deviceID, device):
+        for index, value in ((self.by_name, device.get("deviceName")), (self.by_status, device.get("deviceStatus"))):
+            holders = index.get(str(value))
+            if holders is not None:
+                holders.pop(deviceID, None)
+                if not holders:
+                    del index[str(value)]
+        self.by_update.discard((device.get("lastUpdate") or "", deviceID))
+
+    def _ids_at(self, houseID, floorID=None, unitID=None):
+        """deviceIDs located in a house, optionally narrowed to a floor and unit."""
+        houseID = str(houseID)
+        if floorID is not None and unitID is not None:
+            keys = [self.unit_key(houseID, floorID, unitID)]
+        elif floorID is not None:
+            floor = self.get_floor(houseID, floorID) or {}
+            keys = [self.unit_key(houseID, floorID, unit["unitID"]) for unit in floor.get("units", [])]
+        else:
+            keys = [
+                self.unit_key(houseID, floor["floorID"], unit["unitID"])
+                for floor in list(self.get_floors(houseID).values())
+                for unit in floor.get("units", [])
+            ]
+        ids = {}
+        for key in keys:
+            ids.update(dict.fromkeys(list(self.unit_slots.get(key, {}))))
+        return list(ids)
+
+    def _matches(self, device, deviceID, houseID, floorID, unitID, deviceName, status, updatedSince):
+        if houseID is not None:
+            if not any(key[0] == str(houseID)
+                       and (floorID is None or key[1] == str(floorID))
+                       and (unitID is None or key[2] == str(unitID))
+                       for key in list(self.device_units.get(deviceID, {}))):
+                return False
+        if deviceName is not None and str(device.get("deviceName")) != str(deviceName):
+            return False
+        if status is not None and str(device.get("deviceStatus")) != str(status):
+            return False
+        if updatedSince is not None and (device.get("lastUpdate") or "") < updatedSince:
+            return False
+        return True
@@ -0,0 +1,119 @@
+import heapq
+import threading
+import time
+
+
+class LeaseTable():
+    """
+    In-memory liveness leases for catalog devices.
+
+    A lease is an expiry time (epoch seconds) per deviceID. Connectors renew
+    leases with a small heartbeat instead of re-sending whole device records;
+    nothing here is persisted, the table is rebuilt from the devices'
+    lastUpdate when the registry starts.
+
+    Deadlines are also kept in a min-heap. A background thread sleeps until
+    the earliest deadline, pops only the leases that actually ran out and
+    reports them to the listeners as one expiry event. Renewals push a new
+    heap entry and leave the old one behind; stale entries are recognised
+    (their deadline no longer matches the table) and skipped when popped.
+    """
+
+    def __init__(self, default_ttl=3600, max_ttl=86400):
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.expiry = {}  # deviceID -> epoch seconds
+        self.heap = []    # (deadline, deviceID), may hold stale entries
+        self.listeners = []
+        self.expired_total = 0
+
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def clamp_ttl(self, ttl):
+        if ttl is None:
+            return self.default_ttl
+        return min(max(float(ttl), 1), self.max_ttl)
+
+    def renew(self, deviceIDs, ttl=None, now=None):
+        ttl = self.clamp_ttl(ttl)
+        deadline = (now if now is not None else time.time()) + ttl
+        with self._cond:
+            for deviceID in deviceIDs:
+                self._set(str(deviceID), deadline)
+        return ttl
+
+    def seed(self, deviceID, deadline):
+        """Sets a lease only if the device has none yet (used on startup)."""
+        with self._cond:
+            if str(deviceID) not in self.expiry:
+                self._set(str(deviceID), deadline)
+
+    def drop(self, deviceIDs):
+        with self._cond:
+            for deviceID in deviceIDs:
+                self.expiry.pop(str(deviceID), None)
+
+    def expires_at(self, deviceID):
+        return self.expiry.get(str(deviceID))
+
+    def pop_expired(self, now=None):
+        """Removes and returns the deviceIDs whose lease has run out."""
+        now = now if now is not None else time.time()
+        expired = []
+        with self._cond:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, deviceID = heapq.heappop(self.heap)
+                if self.expiry.get(deviceID) == deadline:
+                    del self.expiry[deviceID]
+                    expired.append(deviceID)
+            if len(self.heap) > 2 * len(self.expiry) + 1024:
+                # Too many stale entries left behind by renewals: rebuild.
+                self.heap = [(deadline, deviceID) for deviceID, deadline in self.expiry.items()]
+                heapq.heapify(self.heap)
+        return expired
+
+    # ---- expiry thread ---------------------------------------------------
+
+    def subscribe(self, callback):
+        """callback(deviceIDs) is called from the expiry thread for every batch of expired leases."""
+        self.listeners.append(callback)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="lease-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+    def _set(self, deviceID, deadline):
+        self.expiry[deviceID] = deadline
+        wake = not self.heap or deadline < self.heap[0][0]
+        heapq.heappush(self.heap, (deadline, deviceID))
+        if wake:
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                timeout = self.heap[0][0] - time.time() if self.heap else None
+                if timeout is None or timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+            expired = self.pop_expired()
+            if not expired:
+                continue
+            self.expired_total += len(expired)
+            for callback in self.listeners:
+                try:
+                    callback(expired)
+                except Exception as e:
+                    print(f"Error handling expired leases: {e}")
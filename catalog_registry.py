@@ -2,76 +2,216 @@
 # - 2025-07-16: Added schema-based validation for new devices and houses.
 # - 2025-07-16: Integrated validation into POST and PUT methods.
 # - 2025-07-16: Enforced consistent string-based handling for IDs.
-
+# - 2026-10-18: Lookups and upserts go through an incrementally maintained CatalogIndex.
+# - 2026-10-18: catalog.json is persisted write-behind and replaced atomically.
+# - 2026-10-18: Mutations are applied as records; optional journal + snapshot storage.
+# - 2026-10-18: Optional SQLite storage with indexed device expiry.
+# - 2026-10-18: Added POST/PUT /devices/bulk for batched device upserts.
+# - 2026-10-18: Added POST /heartbeat; devices now expire from an in-memory lease table.
+# - 2026-10-18: Lease expiry runs on its own thread from a deadline heap (replaces sched).
+# - 2026-10-18: Catalog revision with ETags on /houses and /devices, GET /changes?since=<rev>.
+# - 2026-10-18: Changes are also pushed to retained MQTT topics under <mainTopic>/catalog/.
+# - 2026-10-18: /broker, /devices and /houses are served from a per-revision cache of encoded (and gzipped) bodies.
+# - 2026-10-18: Mutations serialise on one writer lock; readers use copy-on-write snapshots without locking.
+# - 2026-10-18: GET /devices filters, fields= projection and cursor pagination, served from secondary indexes.
+# - 2026-10-18: Schemas check nested fields and are compiled once into validators (catalog_schema).
+# - 2026-10-18: The index keeps one copy per deviceID; duplicates are merged on load and by POST /admin/compact.
+# - 2026-10-18: GET /bootstrap?units=h-f-u,... returns broker, topic, revision and unit assignments in one call.
+# - 2026-10-18: Routes are served by server-agnostic handle_* methods; --server asyncio (catalog_aio), sessions off.
+# - 2026-10-18: --data-dir, so several registries can run side by side as shards behind catalog_router.
+
+import argparse
 import cherrypy
 import json
 import datetime
-import sched
+import threading
 import time
 import os
 
+from catalog_cache import ResponseCache
+from catalog_changes import BadRequest, ChangeLog, NotModified
+from catalog_feed import CatalogFeed
+from catalog_index import CatalogIndex
+from catalog_leases import LeaseTable
+from catalog_schema import compile_schema
+from catalog_storage import CatalogWriter, CatalogJournal, CatalogSQLite, load_catalog
+
 # Schema for validating a new device
 DEVICE_SCHEMA = {
     "deviceID": {"type": (int, str), "required": True},
     "deviceName": {"type": str, "required": True},
     "deviceStatus": {"type": str, "required": True},
-    "availableStatuses": {"type": list, "required": True},
-    "deviceLocation": {"type": dict, "required": True},
-    "measureType": {"type": list, "required": True},
-    "availableServices": {"type": list, "required": True},
-    "servicesDetails": {"type": list, "required": True},
+    "availableStatuses": {"type": list, "required": True, "items": {"type": str}},
+    "deviceLocation": {"type": dict, "required": True, "schema": {
+        "houseID": {"type": (int, str), "required": True},
+        "floorID": {"type": (int, str), "required": True},
+        "unitID": {"type": (int, str), "required": True},
+    }},
+    "measureType": {"type": list, "required": True, "items": {"type": str}},
+    "availableServices": {"type": list, "required": True, "items": {"type": str}},
+    "servicesDetails": {"type": list, "required": True, "items": {"type": dict, "schema": {
+        "serviceType": {"type": str, "required": True},
+        "topic": {"type": list, "items": {"type": str}},
+    }}},
 }
 
 # Schema for validating a new house
 HOUSE_SCHEMA = {
     "houseID": {"type": str, "required": True},
     "houseName": {"type": str, "required": True},
-    "floors": {"type": list, "required": True},
+    "floors": {"type": list, "required": True, "items": {"type": dict, "schema": {
+        "floorID": {"type": (int, str), "required": True},
+        "units": {"type": list, "items": {"type": dict, "schema": {
+            "unitID": {"type": (int, str), "required": True},
+            "devicesList": {"type": list, "items": {"type": dict, "schema": DEVICE_SCHEMA}},
+        }}},
+    }}},
 }
 
+validate_device = compile_schema(DEVICE_SCHEMA)
+validate_house = compile_schema(HOUSE_SCHEMA)
+
+# Query parameters accepted by GET /devices
+DEVICE_QUERY_PARAMS = {"houseID", "floorID", "unitID", "deviceName", "status", "updatedSince", "fields", "limit", "cursor"}
+
+def json_body_handler(*args, **kwargs):
+    """
+    json_out handler that passes already encoded bodies (bytes) through
+    untouched and JSON-encodes everything else.
+    """
+    value = cherrypy.serving.request._json_inner_handler(*args, **kwargs)
+    if isinstance(value, bytes):
+        return value
+    return json.dumps(value).encode('utf-8')
+
+class CatalogAdmin():
+    """
+    Maintenance endpoints, mounted at /admin. Separate from the catalog's
+    POST so they can be called without a JSON body.
+    """
+    exposed = True
+    # A bodyless POST has no Content-Length, which CherryPy answers with 411 if it reads the body.
+    _cp_config = {'request.process_request_body': False}
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    @cherrypy.tools.json_out()
+    def POST(self, *uri, **params):
+        return self.handle_post(uri, params)
+
+    def handle_post(self, uri, params):
+        if len(uri) > 0 and uri[0].lower() == "compact":
+            return self.catalog.compact_catalog()
+        return "Use /admin/compact to merge duplicated devices."
+
 class WebCatalogThiefDetector():
     exposed = True
 
-    def __init__(self, address):
-        with open(address, 'r') as fptr:
-            self.catalog = json.load(fptr)
+    def __init__(self, address, storage="json", flush_interval=5, batch_size=100, compact_every=1000,
+                 lease_ttl=3600, feed=True, data_dir=None):
+        # Storage files (catalog.db, catalog.journal, snapshots) live next to this script by default.
+        data_dir = data_dir or os.path.dirname(__file__)
+        if storage == "sqlite":
+            self.storage = CatalogSQLite(os.path.join(data_dir, 'catalog.db'), lambda: self.catalog)
+            self.catalog = self.storage.load()
+            if self.catalog is None:
+                print(f"Importing {address} into {self.storage.db_path}")
+                self.catalog = self.load_catalog(address)
+                self.storage.import_catalog(self.catalog)
+        elif storage == "journal":
+            self.storage = CatalogJournal(
+                os.path.join(data_dir, 'catalog.json'),
+                os.path.join(data_dir, 'catalog.journal'),
+                lambda: self.catalog,
+                compact_every=compact_every
+            )
+            self.catalog = self.load_catalog(address)
+        elif storage == "json":
+            self.storage = CatalogWriter(
+                os.path.join(data_dir, 'catalog.json'),
+                lambda: self.catalog,
+                flush_interval=flush_interval,
+                batch_size=batch_size
+            )
+            self.catalog = self.load_catalog(address)
+        else:
+            raise ValueError(f"Unknown storage mode: {storage}")
 
         self.mainTopic = self.catalog["projectName"]
         self.broker = self.catalog["broker"]
-        self.housesList = self.catalog["housesList"]
 
+        self.index = CatalogIndex()
+        self._write_lock = threading.Lock()
         self.deviceGetter()
+        self.changes = ChangeLog()
+        self.responses = ResponseCache()
+        self.feed = CatalogFeed(self.broker["IP"], self.broker["port"], self.mainTopic)
+        if feed:
+            self.feed.start()
+        for record in self.storage.replay(self.catalog.get("journalSeq", 0)):
+            self.apply_mutation(record)
+        if self.index.find_duplicates():
+            self.compact_catalog()
+        self.admin = CatalogAdmin(self)
+
+        self.LEASE_STARTUP_GRACE = 120  # seconds connectors get to send a first heartbeat after a restart
+        self.BOOTSTRAP_TTL = 300  # seconds clients may cache /bootstrap
+        self.leases = LeaseTable(default_ttl=lease_ttl)
+        self.seed_leases()
+        self.leases.subscribe(self.expire_devices)
+        self.leases.start()
+
+    # The CherryPy methods only adapt the request; the handle_* methods hold
+    # the routes, so other servers (catalog_aio) can serve the same API.
+
+    @cherrypy.tools.json_out(handler=json_body_handler)
+    def GET(self, *uri, **params):
+        try:
+            return self.handle_get(uri, params, cherrypy.request.headers, cherrypy.response.headers)
+        except NotModified:
+            raise cherrypy.HTTPRedirect([], 304)
 
-        self.scheduler = sched.scheduler(time.time, time.sleep)
-        self.scheduler.enter(0, 1, self.periodic_cleanup, ())
-        self.scheduler.run(blocking=False)
-
-    def validate_payload(self, payload, schema):
-        """
-        Validates a payload against a given schema.
-        Returns a list of errors. If the list is empty, the payload is valid.
-        """
-        errors = []
-        for field, rules in schema.items():
-            if rules.get("required") and field not in payload:
-                errors.append(f"Missing required field: '{field}'")
-                continue
-
-            if field in payload and not isinstance(payload[field], rules["type"]):
-                errors.append(f"Invalid type for field '{field}'. Expected {rules['type']}, got {type(payload[field])}")
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    def POST(self, *uri, **params):
+        try:
+            return self.handle_post(uri, params, cherrypy.request.json)
+        except BadRequest as e:
+            cherrypy.response.status = 400
+            return {"errors": e.errors}
 
-        return errors
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.json_in()
+    def PUT(self, *uri, **params):
+        try:
+            return self.handle_put(uri, params, cherrypy.request.json)
+        except BadRequest as e:
+            cherrypy.response.status = 400
+            return {"errors": e.errors}
 
     @cherrypy.tools.json_out()
-    def GET(self, *uri, **params):
+    @cherrypy.tools.json_in()
+    def DELETE(self, *uri, **params):
+        return self.handle_delete(uri, params)
+
+    def handle_get(self, uri, params, headers, response_headers):
+        """
+        headers are the request headers (looked up as "If-None-Match",
+        "Accept-Encoding"); response headers are added to response_headers.
+        Returns encoded bytes or a JSON-serialisable value, raises NotModified.
+        """
         if len(uri) == 0:
-            return "No valid URL. Try /broker, /devices, /device/{id}, /houses, /house/{houseID}, /topic"
+            return "No valid URL. Try /bootstrap, /broker, /devices, /device/{id}, /houses, /house/{houseID}, /topic, /changes?since={rev}"
         path = uri[0].lower()
 
         if path == "broker":
-            return self.broker
+            return self.cached_response("broker", lambda: self.broker, headers, response_headers)
         elif path == "devices":
-            return self.devices
+            self.check_etag(headers, response_headers)
+            if params:
+                return self.query_devices(params)
+            return self.cached_response("devices", self.index.all_devices, headers, response_headers)
         elif path == "device":
             if len(uri) < 2:
                 return "No device ID provided. Try /device/{id}"
@@ -79,7 +219,12 @@ class WebCatalogThiefDetector():
             theDevice = self.get_device_by_id(deviceID)
             return theDevice if theDevice else f"No device found with ID {deviceID}"
         elif path == "houses":
-            return self.housesList
+            self.check_etag(headers, response_headers)
+            return self.cached_response("houses", lambda: self.housesList, headers, response_headers)
+        elif path == "changes":
+            return self.get_changes(params.get("since"), params.get("epoch"))
+        elif path == "bootstrap":
+            return self.bootstrap(params.get("units"))
         elif path == "house":
             if len(uri) < 2:
                 return "No house ID provided. Try /house/{houseID}"
@@ -89,85 +234,60 @@ class WebCatalogThiefDetector():
         elif path == "topic":
             return self.mainTopic
         elif path == "houseshow":
-            house = self.catalog["housesList"][0]
+            house = self.housesList[0]
             return house
         else:
-            return "Invalid URL. Try /broker, /devices, /device/{id}, /houses, /house/{houseID}, /topic"
+            return "Invalid URL. Try /bootstrap, /broker, /devices, /device/{id}, /houses, /house/{houseID}, /topic, /changes?since={rev}"
 
-    @cherrypy.tools.json_in()
-    @cherrypy.tools.json_out()
-    def POST(self, *uri, **params):
+    def handle_post(self, uri, params, body):
         if len(uri) == 0:
-            return "Use /houses or /devices to add new items."
+            return "Use /houses, /devices or /devices/bulk to add new items, /heartbeat to renew device leases."
         path = uri[0].lower()
 
+        if path == "heartbeat":
+            return self.heartbeat(body)
+
         if path == "houses":
-            newHouse = cherrypy.request.json
-            errors = self.validate_payload(newHouse, HOUSE_SCHEMA)
+            newHouse = body
+            errors = validate_house(newHouse)
             if errors:
                 return {"errors": errors}
+            if self.get_house_by_id(newHouse["houseID"]):
+                raise BadRequest([f"House {newHouse['houseID']} already exists, use PUT /houses to update it"])
+            self.check_house_devices(newHouse)
 
             newHouse["lastUpdate"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.housesList.append(newHouse)
-            self.catalog["lastUpdate"] = newHouse["lastUpdate"]
-            self.save_catalog()
-            self.deviceGetter()
+            self.commit({"op": "add_house", "time": newHouse["lastUpdate"], "house": newHouse})
             return "House added successfully", 201
 
+        elif path == "devices" and len(uri) > 1 and uri[1].lower() == "bulk":
+            return self.bulk_upsert_devices(body)
+
         elif path == "devices":
-            newDevice = cherrypy.request.json
-            errors = self.validate_payload(newDevice, DEVICE_SCHEMA)
+            newDevice = body
+            errors = validate_device(newDevice)
             if errors:
                 return {"errors": errors}
 
             theTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             newDevice["lastUpdate"] = theTime
-            try:
-                houseID = str(newDevice["deviceLocation"]["houseID"])
-                floorID = str(newDevice["deviceLocation"]["floorID"])
-                unitID  = str(newDevice["deviceLocation"]["unitID"])
-            except KeyError:
-                return "deviceLocation must contain houseID, floorID, unitID"
+            error = self.check_device_location(newDevice)
+            if error:
+                return error
 
-            house = self.get_house_by_id(houseID)
-            if not house:
-                return f"No house found with ID {houseID}"
-            floorObj = self.get_floor_by_id(house, floorID)
-            if not floorObj:
-                return f"No floor {floorID} found in house {houseID}"
-            unitObj = self.get_unit_by_id(floorObj, unitID)
-            if not unitObj:
-                return f"No unit {unitID} found on floor {floorID} of house {houseID}"
-
-            existing_index = None
-            for i, dev in enumerate(unitObj["devicesList"]):
-                if str(dev.get("deviceID")) == str(newDevice.get("deviceID")):
-                    existing_index = i
-                    break
-
-            if existing_index is not None:
-                unitObj["devicesList"][existing_index] = newDevice
-            else:
-                unitObj["devicesList"].append(newDevice)
-
-            self.catalog["lastUpdate"] = theTime
-            self.save_catalog()
-            self.deviceGetter()
+            self.commit({"op": "upsert_device", "time": theTime, "device": newDevice})
             return "Device added successfully", 201
 
         else:
             return "Invalid path. Use /houses or /devices to add new items."
 
-    @cherrypy.tools.json_out()
-    @cherrypy.tools.json_in()
-    def PUT(self, *uri, **params):
+    def handle_put(self, uri, params, body):
         if len(uri) == 0:
-            return "Use /houses or /devices to update existing items."
+            return "Use /houses, /devices or /devices/bulk to update existing items."
         path = uri[0].lower()
 
         if path == "houses":
-            body = cherrypy.request.json
-            errors = self.validate_payload(body, HOUSE_SCHEMA)
+            errors = validate_house(body)
             if errors:
                 return {"errors": errors}
 
@@ -177,62 +297,34 @@ class WebCatalogThiefDetector():
             house = self.get_house_by_id(houseID)
             if not house:
                 return f"No house found with ID {houseID}", 404
-            for k, v in body.items():
-                house[k] = v
-            house["lastUpdate"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.catalog["lastUpdate"] = house["lastUpdate"]
+            self.check_house_devices(dict(house, **body))
+            theTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.commit({"op": "update_house", "time": theTime, "houseID": houseID, "fields": body})
             print(f"Updated house {houseID} with data: {body}")
-            self.save_catalog()
-            self.deviceGetter()
             return "House updated successfully", 200
 
+        elif path == "devices" and len(uri) > 1 and uri[1].lower() == "bulk":
+            return self.bulk_upsert_devices(body)
+
         elif path == "devices":
-            updatedDevice = cherrypy.request.json
-            errors = self.validate_payload(updatedDevice, DEVICE_SCHEMA)
+            updatedDevice = body
+            errors = validate_device(updatedDevice)
             if errors:
                 return {"errors": errors}
 
             theTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             updatedDevice["lastUpdate"] = theTime
-            try:
-                houseID = str(updatedDevice["deviceLocation"]["houseID"])
-                floorID = str(updatedDevice["deviceLocation"]["floorID"])
-                unitID  = str(updatedDevice["deviceLocation"]["unitID"])
-            except KeyError:
-                return "deviceLocation must contain houseID, floorID, unitID"
-
-            house = self.get_house_by_id(houseID)
-            if not house:
-                return f"No house found with ID {houseID}", 404
-            floorObj = self.get_floor_by_id(house, floorID)
-            if not floorObj:
-                return f"No floor {floorID} found in house {houseID}", 404
-            unitObj = self.get_unit_by_id(floorObj, unitID)
-            if not unitObj:
-                return f"No unit {unitID} found on floor {floorID} of house {houseID}", 404
-
-            existing_index = None
-            for i, dev in enumerate(unitObj["devicesList"]):
-                if str(dev["deviceID"]) == str(updatedDevice["deviceID"]):
-                    existing_index = i
-                    break
-
-            if existing_index is not None:
-                unitObj["devicesList"][existing_index] = updatedDevice
-            else:
-                unitObj["devicesList"].append(updatedDevice)
+            error = self.check_device_location(updatedDevice)
+            if error:
+                return error, 404
 
-            self.catalog["lastUpdate"] = theTime
-            self.save_catalog()
-            self.deviceGetter()
+            self.commit({"op": "upsert_device", "time": theTime, "device": updatedDevice})
             return "Device updated successfully", 200
 
         else:
             return "Invalid path. Use /houses or /devices to update items."
 
-    @cherrypy.tools.json_out()
-    @cherrypy.tools.json_in()
-    def DELETE(self, *uri, **params):
+    def handle_delete(self, uri, params):
         if len(uri) == 0:
             return "To delete: /houses?houseID=... or /devices?deviceID=..."
         path = uri[0].lower()
@@ -241,97 +333,485 @@ class WebCatalogThiefDetector():
             deviceID = params.get("deviceID")
             if not deviceID:
                 return "Missing deviceID parameter."
-            removed = False
-            for house in self.housesList:
-                for floor in house.get("floors", []):
-                    for unit in floor.get("units", []):
-                        original = len(unit["devicesList"])
-                        unit["devicesList"] = [
-                            d for d in unit["devicesList"]
-                            if str(d["deviceID"]) != str(deviceID)
-                        ]
-                        if len(unit["devicesList"]) < original:
-                            removed = True
-            if removed:
-                self.catalog["lastUpdate"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.save_catalog()
-                self.deviceGetter()
+            if self.get_device_by_id(deviceID):
+                theTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.commit({"op": "delete_device", "time": theTime, "deviceID": str(deviceID)})
                 return f"Device {deviceID} removed successfully.", 200
             else:
                 return f"Device {deviceID} not found.", 404
 
-    def deviceGetter(self):
-        self.devices = []
-        for house in self.housesList:
-            for floorObj in house.get("floors", []):
-                for unitObj in floorObj.get("units", []):
-                    for device in unitObj["devicesList"]:
-                        self.devices.append(device)
+    def check_etag(self, headers, response_headers):
+        """
+        Tags the response with the current catalog revision and raises
+        NotModified if the client already has it.
+        """
+        etag = self.changes.etag
+        response_headers["ETag"] = etag
+        if headers.get("If-None-Match") == etag:
+            raise NotModified()
 
-    def get_house_by_id(self, houseID):
-        return next((h for h in self.housesList if str(h["houseID"]) == str(houseID)), None)
+    def cached_response(self, route, build, headers, response_headers):
+        """
+        Returns the encoded body of a route at the current revision, gzipped
+        if the client accepts it, encoding build() only on a cache miss.
+        """
+        accept_gzip = "gzip" in headers.get("Accept-Encoding", "")
+        body, encoding = self.responses.get(route, self.changes.revision, build, accept_gzip)
+        response_headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            response_headers["Content-Encoding"] = encoding
+        return body
+
+    def query_devices(self, params):
+        """
+        GET /devices?houseID=&floorID=&unitID=&deviceName=&status=&updatedSince=
+                    &fields=deviceID,deviceStatus&limit=&cursor=
+
+        Returns {"devices": [...], "nextCursor": ...}; pass nextCursor back as
+        cursor for the next page, it is null on the last one. deviceID is
+        always included in projected devices.
+        """
+        unknown = set(params) - DEVICE_QUERY_PARAMS
+        if unknown:
+            return f"Unknown query parameters: {', '.join(sorted(unknown))}. Use {', '.join(sorted(DEVICE_QUERY_PARAMS))}"
+        limit = params.get("limit")
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise ValueError
+            except ValueError:
+                return "Invalid limit, expected a positive integer"
+
+        devices, last = self.index.query(
+            houseID=params.get("houseID"),
+            floorID=params.get("floorID"),
+            unitID=params.get("unitID"),
+            deviceName=params.get("deviceName"),
+            status=params.get("status"),
+            updatedSince=params.get("updatedSince"),
+            after=params.get("cursor"),
+            limit=limit
+        )
+        if params.get("fields"):
+            fields = ["deviceID"] + [f for f in params["fields"].split(",") if f and f != "deviceID"]
+            devices = [{f: device[f] for f in fields if f in device} for device in devices]
+        return {"devices": devices, "nextCursor": last}
+
+    def bootstrap(self, units=None):
+        """
+        Everything a service needs to start, in one response: broker, main
+        topic, the catalog revision and, for each requested unit
+        ("houseID-floorID-unitID", comma separated), whether it exists and
+        which devices the catalog already holds there. Clients may cache it
+        for "ttl" seconds.
+        """
+        response = {
+            "broker": self.broker,
+            "topic": self.mainTopic,
+            "epoch": self.changes.epoch,
+            "revision": self.changes.revision,
+            "ttl": self.BOOTSTRAP_TTL,
+        }
+        if units:
+            assignments = {}
+            for unit in units.split(","):
+                try:
+                    key = CatalogIndex.unit_key(*unit.split("-"))
+                except TypeError:
+                    assignments[unit] = {"exists": False, "deviceIDs": []}
+                    continue
+                unitObj = self.index.get_unit(*key)
+                assignments[unit] = {
+                    "exists": unitObj is not None,
+                    "deviceIDs": [d["deviceID"] for d in unitObj["devicesList"]] if unitObj else [],
+                }
+            response["assignments"] = assignments
+        return response
+
+    def get_changes(self, since, epoch):
+        """
+        Returns the records changed after revision `since` of this registry
+        run (`epoch`), or asks the client to reload when they are not available.
+        """
+        try:
+            since = int(since)
+        except (TypeError, ValueError):
+            since = -1
+        changes = self.changes.since(since, epoch)
+        response = {"epoch": self.changes.epoch, "revision": self.changes.revision}
+        if changes is None:
+            response["reset"] = True
+        else:
+            response["revision"] = changes[-1]["rev"] if changes else since
+            response["changes"] = changes
+        return response
 
-    def get_floor_by_id(self, house, floorID):
-        for f in house.get("floors", []):
-            if str(f["floorID"]) == str(floorID):
-                return f
+    def describe_changes(self, record):
+        """
+        Lists the houses and devices a mutation record touches, for the
+        change log. Must be called before the record is applied, so that
+        deleted devices can still be located; house documents are filled in
+        by commit() once the record is applied. Returns None if the record
+        cannot be described record by record.
+        """
+        op = record["op"]
+        if op == "add_house":
+            return [{"kind": "house", "houseID": str(record["house"]["houseID"]), "house": record["house"]}]
+        elif op == "update_house":
+            houseID = str(record["houseID"])
+            return [{"kind": "house", "houseID": houseID, "house": None}]
+        elif op in ("upsert_device", "upsert_devices"):
+            devices = [record["device"]] if op == "upsert_device" else record["devices"]
+            changes = []
+            for device in devices:
+                location = CatalogIndex.location_key(device)
+                changes.append({
+                    "kind": "device", "deviceID": str(device["deviceID"]),
+                    "location": list(location), "device": device,
+                    # upserts drop copies held by other units (a device that moved)
+                    "removedFrom": [list(key) for key in self.index.locations_of(device["deviceID"]) if key != location]
+                })
+            return changes
+        elif op in ("delete_device", "delete_devices"):
+            deviceIDs = [record["deviceID"]] if op == "delete_device" else record["deviceIDs"]
+            return [
+                {"kind": "device", "deviceID": str(deviceID), "deleted": True,
+                 "locations": [list(key) for key in self.index.locations_of(deviceID)]}
+                for deviceID in deviceIDs
+            ]
+        elif op == "compact":
+            # The kept copy of every duplicated device, like an upsert that drops the other copies.
+            changes = []
+            for deviceID, (key, position) in self.index.find_duplicates().items():
+                changes.append({
+                    "kind": "device", "deviceID": deviceID,
+                    "location": list(key), "device": self.index.units[key]["devicesList"][position],
+                    "removedFrom": [list(other) for other in self.index.locations_of(deviceID) if other != key]
+                })
+            return changes
         return None
 
-    def get_unit_by_id(self, floorObj, unitID):
-        for u in floorObj.get("units", []):
-            if str(u["unitID"]) == str(unitID):
-                return u
+    def check_device_location(self, device):
+        """
+        Checks that the house, floor and unit of a device exist.
+        Returns an error message, or None if the location is valid.
+        """
+        try:
+            houseID = str(device["deviceLocation"]["houseID"])
+            floorID = str(device["deviceLocation"]["floorID"])
+            unitID  = str(device["deviceLocation"]["unitID"])
+        except (KeyError, TypeError):
+            return "deviceLocation must contain houseID, floorID, unitID"
+
+        if not self.get_house_by_id(houseID):
+            return f"No house found with ID {houseID}"
+        if not self.get_floor_by_id(houseID, floorID):
+            return f"No floor {floorID} found in house {houseID}"
+        if not self.get_unit_by_id(houseID, floorID, unitID):
+            return f"No unit {unitID} found on floor {floorID} of house {houseID}"
         return None
 
+    def check_house_devices(self, house):
+        """
+        Raises BadRequest if the house holds deviceIDs that are stored in
+        another house or twice in it: unlike a device upsert, a house write
+        does not move devices, so it must not create a second copy.
+        """
+        conflicts = self.index.conflicting_devices(house)
+        if conflicts:
+            raise BadRequest([f"Device {deviceID} is already stored elsewhere in the catalog" for deviceID in conflicts])
+
+    def bulk_upsert_devices(self, body):
+        """
+        Validates a list of devices (or an object with a devicesList), applies
+        every valid one in a single mutation and returns one result per item.
+        """
+        if isinstance(body, dict):
+            body = body.get("devicesList")
+        if not isinstance(body, list):
+            return {"errors": ["Expected a list of devices or an object with a devicesList"]}
+
+        theTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        results = []
+        accepted = []
+        for i, device in enumerate(body):
+            if not isinstance(device, dict):
+                results.append({"index": i, "errors": ["Device must be a JSON object"]})
+                continue
+            errors = validate_device(device)
+            if not errors:
+                error = self.check_device_location(device)
+                errors = [error] if error else []
+            if errors:
+                results.append({"index": i, "deviceID": device.get("deviceID"), "errors": errors})
+                continue
+            device["lastUpdate"] = theTime
+            results.append({"index": i, "deviceID": device["deviceID"]})
+            accepted.append(results[-1])
+
+        if accepted:
+            created = self.commit({
+                "op": "upsert_devices",
+                "time": theTime,
+                "devices": [body[result["index"]] for result in accepted]
+            })
+            for result, isNew in zip(accepted, created):
+                result["status"] = "created" if isNew else "updated"
+
+        return {"accepted": len(accepted), "rejected": len(body) - len(accepted), "results": results}
+
+    def deviceGetter(self):
+        """
+        Rebuilds the device index from scratch. Only needed when the whole
+        housesList is (re)loaded; mutations keep the index up to date.
+        """
+        self.index.rebuild(self.catalog["housesList"])
+
+    @property
+    def housesList(self):
+        """The current, immutable housesList snapshot (see CatalogIndex)."""
+        return self.index.housesList
+
+    def get_house_by_id(self, houseID):
+        return self.index.get_house(houseID)
+
+    def get_floor_by_id(self, houseID, floorID):
+        return self.index.get_floor(houseID, floorID)
+
+    def get_unit_by_id(self, houseID, floorID, unitID):
+        return self.index.get_unit(houseID, floorID, unitID)
+
     def get_device_by_id(self, deviceID):
-        for d in self.devices:
-            if str(d["deviceID"]) == str(deviceID):
-                return d
-        return None
+        return self.index.get_device(deviceID)
 
-    def periodic_cleanup(self):
-        THRESHOLD = 1
-        now = datetime.datetime.now()
-        cutoff = now - datetime.timedelta(hours=THRESHOLD)
-        for house in self.housesList:
-            for floorObj in house.get("floors", []):
-                for unitObj in floorObj.get("units", []):
-                    unitObj["devicesList"] = [
-                        dev for dev in unitObj["devicesList"]
-                        if datetime.datetime.strptime(
-                            dev.get('lastUpdate', '1970-01-01 00:00:00'),
-                            "%Y-%m-%d %H:%M:%S"
-                        ) >= cutoff
-                    ]
-        self.catalog["lastUpdate"] = now.strftime("%Y-%m-%d %H:%M:%S")
-        self.save_catalog()
-        self.deviceGetter()
-        self.scheduler.enter(600, 1, self.periodic_cleanup, ())
+    def expire_devices(self, deviceIDs):
+        """
+        Expiry event from the lease table: removes the devices whose lease
+        ran out. Called from the lease expiry thread.
 
-    def save_catalog(self):
+        A heartbeat or upsert may renew a lease between the table popping it
+        and this commit, so each lease's deadline is checked again under the
+        write lock; renewed devices are kept.
+        """
+        with self._write_lock:
+            now = time.time()
+            expired = [
+                deviceID for deviceID in deviceIDs
+                if (self.leases.expires_at(deviceID) or 0) <= now and self.get_device_by_id(deviceID)
+            ]
+            if not expired:
+                return
+            theTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._commit({"op": "delete_devices", "time": theTime, "deviceIDs": expired})
+        print(f"Expired {len(expired)} device(s) without a valid lease: {expired}")
+
+    def heartbeat(self, body):
+        """
+        Renews the leases of a set of devices. Nothing is validated against
+        the schema or written to disk; unknown IDs are reported back so the
+        caller can register them again.
+        """
+        deviceIDs = body.get("deviceIDs") if isinstance(body, dict) else None
+        if not isinstance(deviceIDs, list):
+            return {"errors": ["Expected an object with a deviceIDs list"]}
         try:
-            script_dir = os.path.dirname(__file__)
-            catalog_file_path = os.path.join(script_dir, 'catalog.json')
-            with open(catalog_file_path, 'w') as fptr:
-                print(f"Saving catalog to {catalog_file_path}")
-                json.dump(self.catalog, fptr, indent=4)
-        except Exception as e:
-            print(f"Error saving catalog: {e}")
+            ttl = self.leases.clamp_ttl(body.get("ttl"))
+        except (TypeError, ValueError):
+            return {"errors": ["ttl must be a number of seconds"]}
+        # No write lock: heartbeats must not wait behind a commit. The lease is
+        # renewed first and expire_devices re-checks it under the lock, so a
+        # renewed device is never expired; one expired before the renewal
+        # landed is reported back as unknown.
+        known = [deviceID for deviceID in deviceIDs if self.get_device_by_id(deviceID)]
+        self.leases.renew(known, ttl)
+        gone = {deviceID for deviceID in known if not self.get_device_by_id(deviceID)}
+        if gone:
+            self.leases.drop(gone)
+            known = [deviceID for deviceID in known if deviceID not in gone]
+        renewed = set(known)
+        unknown = [deviceID for deviceID in deviceIDs if deviceID not in renewed]
+        return {"renewed": len(known), "unknown": unknown, "ttl": ttl}
+
+    def seed_leases(self):
+        """
+        Gives every loaded device a lease based on its lastUpdate, but never
+        shorter than LEASE_STARTUP_GRACE, since heartbeats do not update lastUpdate.
+        """
+        now = time.time()
+        for deviceID, device in self.index.devices.items():
+            try:
+                last = datetime.datetime.strptime(device.get("lastUpdate"), "%Y-%m-%d %H:%M:%S").timestamp()
+            except (TypeError, ValueError):
+                last = 0
+            self.leases.seed(deviceID, max(last + self.leases.default_ttl, now + self.LEASE_STARTUP_GRACE))
+
+    def track_leases(self, record):
+        op = record["op"]
+        if op == "upsert_device":
+            self.leases.renew([record["device"]["deviceID"]])
+        elif op == "upsert_devices":
+            self.leases.renew([device["deviceID"] for device in record["devices"]])
+        elif op in ("add_house", "update_house"):
+            house = record.get("house") or self.get_house_by_id(record["houseID"])
+            self.leases.renew([
+                device["deviceID"]
+                for floor in house.get("floors", [])
+                for unit in floor.get("units", [])
+                for device in unit.get("devicesList", [])
+            ])
+        elif op == "delete_device":
+            self.leases.drop([record["deviceID"]])
+        elif op == "delete_devices":
+            self.leases.drop(record["deviceIDs"])
+
+    def compact_catalog(self):
+        """
+        Merges duplicated devices, keeping the copy with the newest lastUpdate,
+        and reports what was merged.
+        """
+        if not self.index.find_duplicates():
+            # Nothing to merge: no revision, no journal record, replicas keep their state.
+            return {"merged": 0, "removed": 0, "devices": []}
+        theTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        merged = self.commit({"op": "compact", "time": theTime})
+        removed = sum(entry["removed"] for entry in merged)
+        if merged:
+            print(f"Compacted catalog: removed {removed} duplicate entries of {len(merged)} devices")
+        return {"merged": len(merged), "removed": removed, "devices": merged}
+
+    def commit(self, record):
+        """
+        Applies a mutation record to the in-memory catalog and hands it to
+        the storage backend.
+
+        This is the only write path. Writers are serialised here, so the
+        revision, change feed and storage see records in the order they were
+        applied; readers never wait on it (see CatalogIndex).
+        """
+        with self._write_lock:
+            return self._commit(record)
+
+    def _commit(self, record):
+        # Callers hold _write_lock.
+        changes = self.describe_changes(record)
+        result = self.apply_mutation(record)
+        if changes is None:
+            revision = self.changes.reset()
+        else:
+            for change in changes:
+                if change["kind"] == "house":
+                    change["house"] = self.get_house_by_id(change["houseID"])
+            revision = self.changes.record(changes)
+        self.responses.invalidate()
+        self.feed.publish(changes, self.changes.epoch, revision)
+        self.track_leases(record)
+        self.storage.append(record)
+        return result
+
+    def apply_mutation(self, record):
+        """
+        Applies one mutation record. Used both for live requests and for
+        replaying the journal on startup, so it must not depend on anything
+        but the record itself. Returns the index's result, if any.
+        """
+        op = record["op"]
+        result = None
+        if op == "add_house":
+            self.index.add_house(record["house"])
+        elif op == "update_house":
+            house = dict(self.get_house_by_id(record["houseID"]))
+            house.update(record["fields"])
+            house["lastUpdate"] = record["time"]
+            self.index.replace_house(house)
+        elif op == "upsert_device":
+            device = record["device"]
+            result = self.index.upsert_device(CatalogIndex.location_key(device), device)
+        elif op == "upsert_devices":
+            result = [
+                self.index.upsert_device(CatalogIndex.location_key(device), device)
+                for device in record["devices"]
+            ]
+        elif op == "delete_device":
+            self.index.remove_device(record["deviceID"])
+        elif op == "delete_devices":
+            for deviceID in record["deviceIDs"]:
+                self.index.remove_device(deviceID)
+        elif op == "cleanup":
+            # Replay only: journals written before leases replaced the periodic cleanup still hold
+            # these records, and replaying them must drop the same devices. Nothing writes them now.
+            for key, unitObj in list(self.index.units.items()):
+                # "%Y-%m-%d %H:%M:%S" timestamps sort lexicographically, no need to parse them.
+                devicesList = [
+                    dev for dev in unitObj["devicesList"]
+                    if dev.get('lastUpdate', '1970-01-01 00:00:00') >= record["cutoff"]
+                ]
+                if len(devicesList) < len(unitObj["devicesList"]):
+                    self.index.replace_devices(key, devicesList)
+        elif op == "compact":
+            result = self.index.compact()
+        else:
+            raise ValueError(f"Unknown mutation: {op}")
+        self.catalog["housesList"] = self.index.housesList
+        self.catalog["lastUpdate"] = record["time"]
+        return result
+
+    def load_catalog(self, address):
+        """
+        Loads the catalog document, falling back to catalog-base.json if it
+        does not parse (see catalog_storage.load_catalog).
+        """
+        return load_catalog(address)
+
+    def stop(self):
+        self.leases.stop()
+        self.feed.stop()
+        self.storage.close()
 
 if __name__ == "__main__":
-    conf = {
-        "/": {
-            'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
-            'tools.sessions.on': True
+    parser = argparse.ArgumentParser(description="ThiefDetector catalog registry")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default="json",
+                        help="json: write-behind catalog.json, journal: append-only journal + snapshot, "
+                             "sqlite: catalog.db (imported from catalog.json on first start)")
+    parser.add_argument("--flush-interval", type=float, default=5,
+                        help="json storage: seconds between writes of catalog.json")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="json storage: write catalog.json as soon as this many changes are pending")
+    parser.add_argument("--compact-every", type=int, default=1000,
+                        help="journal storage: compact the journal into catalog.json every this many records")
+    parser.add_argument("--no-feed", action="store_true",
+                        help="do not publish catalog changes over MQTT")
+    parser.add_argument("--server", choices=["cherrypy", "asyncio"], default="cherrypy",
+                        help="asyncio: serve from one event loop (catalog_aio), for many concurrent connectors")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--data-dir",
+                        help="directory holding this registry's catalog.json and storage files (e.g. one per shard, see catalog_router)")
+    args = parser.parse_args()
+
+    address = os.path.join(args.data_dir, 'catalog.json') if args.data_dir else 'catalog.json'
+    webService = WebCatalogThiefDetector(
+        address, storage=args.storage, flush_interval=args.flush_interval, batch_size=args.batch_size,
+        compact_every=args.compact_every, feed=not args.no_feed, data_dir=args.data_dir
+    )
+    if args.server == "asyncio":
+        from catalog_aio import serve
+        serve(webService, args.host, args.port)
+    else:
+        conf = {
+            "/": {
+                'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
+                'tools.sessions.on': False
+            }
         }
-    }
-    webService = WebCatalogThiefDetector('catalog.json')
-    cherrypy.tree.mount(webService, '/', conf)
-    cherrypy.engine.start()
-    try:
-        cherrypy.engine.block()
-    except KeyboardInterrupt:
-        print("Shutting down...")
-        cherrypy.engine.stop()
-    finally:
-        cherrypy.engine.block()
\ No newline at end of file
+        cherrypy.config.update({'server.socket_host': args.host, 'server.socket_port': args.port})
+        cherrypy.tree.mount(webService, '/', conf)
+        cherrypy.engine.subscribe('stop', webService.stop)
+        cherrypy.engine.start()
+        try:
+            cherrypy.engine.block()
+        except KeyboardInterrupt:
+            print("Shutting down...")
+            cherrypy.engine.stop()
+        finally:
+            cherrypy.engine.block()
@@ -0,0 +1,465 @@
+"""
+Sharded catalog: houses are partitioned across several registry
+processes by consistent hashing of houseID, behind a thin router that
+speaks the registry's REST API.
+
+    python catalog_router.py --shards 3          # splits catalog.json, starts 3 registries + the router
+    python catalog_router.py --shard-urls http://10.0.0.2:8091/,http://10.0.0.3:8091/
+
+Requests about one house (its devices, /house/{id}, writes) go to the
+shard that owns it; only global listings (/houses, /devices, /bootstrap,
+/admin/compact) fan out to every shard.
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cherrypy
+import requests
+
+from catalog_registry import json_body_handler
+from catalog_storage import load_catalog
+
+
+class HashRing():
+    """
+    Consistent hash ring of shard names. Every shard owns `replicas`
+    points on the ring, a key belongs to the first point at or after its
+    hash, so adding a shard only moves the keys that land on its points.
+    """
+
+    def __init__(self, shards, replicas=64):
+        self.shards = list(shards)
+        self.points = []  # sorted (hash, shard)
+        for shard in self.shards:
+            for i in range(replicas):
+                self.points.append((self._hash(f"{shard}#{i}"), shard))
+        self.points.sort()
+        self._hashes = [point for point, _ in self.points]
+
+    def shard_for(self, key):
+        position = bisect.bisect(self._hashes, self._hash(str(key))) % len(self.points)
+        return self.points[position][1]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], "big")
+
+
+def split_catalog(catalog, ring):
+    """Returns {shard: catalog document holding only the houses the shard owns}."""
+    documents = {
+        shard: dict({k: v for k, v in catalog.items() if k != "housesList"}, housesList=[])
+        for shard in ring.shards
+    }
+    for house in catalog.get("housesList", []):
+        documents[ring.shard_for(house["houseID"])]["housesList"].append(house)
+    return documents
+
+
+def combine_etags(etags):
+    """
+    One ETag for the combined state of every shard, in the registry's
+    "epoch.revision" form: the epochs are hashed together and the
+    revisions summed, so any shard's change (or restart) changes it.
+    """
+    epochs, revision = [], 0
+    for etag in etags:
+        epoch, _, rev = (etag or '"."').strip('"').rpartition(".")
+        epochs.append(epoch)
+        revision += int(rev or 0)
+    return f'"{hashlib.md5("/".join(epochs).encode("utf-8")).hexdigest()[:12]}.{revision}"'
+
+
+def succeeded(result):
+    # The registry answers writes with [message, status] or a message/errors object.
+    return isinstance(result, list) and len(result) == 2 and result[1] in (200, 201)
+
+
+class RouterAdmin():
+    exposed = True
+
+    def __init__(self, router):
+        self.router = router
+
+    @cherrypy.tools.json_out()
+    def POST(self, *uri, **params):
+        if len(uri) > 0 and uri[0].lower() == "compact":
+            reports = [r.json() for r in self.router.fan_out("POST", "admin/compact")]
+            return {
+                "merged": sum(report["merged"] for report in reports),
+                "removed": sum(report["removed"] for report in reports),
+                "devices": [entry for report in reports for entry in report["devices"]],
+            }
+        return "Use /admin/compact to merge duplicated devices."
+
+
+class CatalogRouter():
+    """
+    Routes catalog requests to the registry shard owning the house.
+
+    Device requests that only carry a deviceID (GET /device/{id},
+    heartbeats, DELETE) are routed with a deviceID -> shard map, loaded
+    from the shards on start and kept up to date by the writes passing
+    through; a device that moves to a house on another shard is deleted
+    from its old shard. /changes always answers "reset", so replicas fall
+    back to conditional GETs of /houses, whose ETag combines the shards'.
+    The router keeps each shard's last /houses and /devices body and asks
+    the shards with their own ETags, so only changed shards send a body.
+    """
+    exposed = True
+
+    def __init__(self, shard_urls, timeout=10):
+        self.shard_urls = {f"shard-{i}": url.rstrip('/') + '/' for i, url in enumerate(shard_urls)}
+        self.ring = HashRing(self.shard_urls)
+        self.timeout = timeout
+        self.device_shards = {}
+        self.list_bodies = {}  # "houses"/"devices" -> {shard: (ETag, JSON array items as bytes)}
+        self.admin = RouterAdmin(self)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=4 * len(self.shard_urls), thread_name_prefix="router-fan-out")
+        self.load_device_shards()
+
+    # ---- forwarding ---------------------------------------------------------
+
+    def request(self, shard, method, path, **kwargs):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()  # keep-alive, one per CherryPy thread
+        return self._local.session.request(method, self.shard_urls[shard] + path, timeout=self.timeout, **kwargs)
+
+    def fan_out(self, method, path, **kwargs):
+        """Sends the same request to every shard (in parallel) and returns the responses in shard order."""
+        return list(self._pool.map(lambda shard: self.request(shard, method, path, **kwargs), self.shard_urls))
+
+    def fan_out_each(self, method, path, kwargs_by_shard):
+        """Like fan_out, with the request arguments given per shard."""
+        shards = list(kwargs_by_shard)
+        return list(self._pool.map(lambda shard: self.request(shard, method, path, **kwargs_by_shard[shard]), shards))
+
+    def passthrough(self, response):
+        cherrypy.response.status = response.status_code
+        if "ETag" in response.headers:
+            cherrypy.response.headers["ETag"] = response.headers["ETag"]
+        return response.content
+
+    def owner_of_device(self, device):
+        try:
+            return self.ring.shard_for(device["deviceLocation"]["houseID"])
+        except (KeyError, TypeError):
+            return next(iter(self.shard_urls))  # let a shard's validation report it
+
+    def load_device_shards(self):
+        for shard, response in zip(self.shard_urls, self.fan_out("GET", "devices", params={"fields": "deviceID"})):
+            for device in response.json()["devices"]:
+                self.device_shards[str(device["deviceID"])] = shard
+
+    def moved(self, deviceID, shard):
+        """Records the shard now holding deviceID; returns the shard it was on before, if another one."""
+        with self._lock:
+            previous = self.device_shards.get(str(deviceID))
+            self.device_shards[str(deviceID)] = shard
+        return previous if previous != shard else None
+
+    def combined_list(self, path):
+        """
+        GET /houses or /devices of every shard, as one list under the
+        combined ETag. Each shard gets a conditional GET with the ETag of its
+        cached body, so an unchanged shard answers 304 without a body; a
+        client whose ETag still matches gets a 304 without any shard body
+        being sent. The arrays are joined as bytes, without parsing them.
+        """
+        with self._lock:
+            cached = dict(self.list_bodies.get(path, {}))
+        responses = self.fan_out_each("GET", path, {
+            shard: {"headers": {"If-None-Match": cached[shard][0]}} if cached.get(shard, (None,))[0] else {}
+            for shard in self.shard_urls
+        })
+        bodies = {}
+        for shard, response in zip(self.shard_urls, responses):
+            if response.status_code == 304 and shard in cached:
+                bodies[shard] = cached[shard]
+            else:
+                response.raise_for_status()
+                bodies[shard] = (response.headers.get("ETag"), response.content.strip()[1:-1].strip())
+        with self._lock:
+            self.list_bodies[path] = bodies
+
+        etag = combine_etags(etag for etag, _ in bodies.values())
+        cherrypy.response.headers["ETag"] = etag
+        if cherrypy.request.headers.get("If-None-Match") == etag:
+            raise cherrypy.HTTPRedirect([], 304)
+        return b"[" + b",".join(items for _, items in bodies.values() if items) + b"]"
+
+    # ---- routes -------------------------------------------------------------
+
+    @cherrypy.tools.json_out(handler=json_body_handler)
+    def GET(self, *uri, **params):
+        if len(uri) == 0:
+            return "No valid URL. Try /bootstrap, /broker, /devices, /device/{id}, /houses, /house/{houseID}, /topic, /changes?since={rev}"
+        path = uri[0].lower()
+
+        if path in ("broker", "topic", "houseshow"):
+            return self.passthrough(self.request(next(iter(self.shard_urls)), "GET", path))
+        elif path == "house" and len(uri) > 1:
+            return self.passthrough(self.request(self.ring.shard_for(uri[1]), "GET", f"house/{uri[1]}"))
+        elif path == "device" and len(uri) > 1:
+            shard = self.device_shards.get(str(uri[1]))
+            if shard is not None:
+                return self.passthrough(self.request(shard, "GET", f"device/{uri[1]}"))
+            for response in self.fan_out("GET", f"device/{uri[1]}"):
+                if isinstance(response.json(), dict):
+                    return response.content
+            return f"No device found with ID {uri[1]}"
+        elif path == "devices" and params.get("houseID") is not None:
+            return self.passthrough(self.request(self.ring.shard_for(params["houseID"]), "GET", "devices", params=params))
+        elif path == "devices" and params:
+            return self.query_devices(params)
+        elif path in ("houses", "devices"):
+            return self.combined_list(path)
+        elif path == "changes":
+            # There is no combined change log: replicas reload /houses (conditionally).
+            answer = self.bootstrap()
+            return {"epoch": answer["epoch"], "revision": answer["revision"], "reset": True}
+        elif path == "bootstrap":
+            return self.bootstrap(params.get("units"))
+        return self.passthrough(self.request(next(iter(self.shard_urls)), "GET", "/".join(uri), params=params))
+
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out(handler=json_body_handler)
+    def POST(self, *uri, **params):
+        if len(uri) > 0 and uri[0].lower() == "heartbeat":
+            return self.heartbeat(cherrypy.request.json)
+        return self.write("POST", uri, params, cherrypy.request.json)
+
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out(handler=json_body_handler)
+    def PUT(self, *uri, **params):
+        return self.write("PUT", uri, params, cherrypy.request.json)
+
+    @cherrypy.tools.json_out(handler=json_body_handler)
+    def DELETE(self, *uri, **params):
+        if len(uri) == 0 or uri[0].lower() != "devices" or not params.get("deviceID"):
+            return self.passthrough(self.request(next(iter(self.shard_urls)), "DELETE", "/".join(uri), params=params))
+        deviceID = str(params["deviceID"])
+        shard = self.device_shards.get(deviceID)
+        responses = (
+            [self.request(shard, "DELETE", "devices", params=params)] if shard
+            else self.fan_out("DELETE", "devices", params=params)
+        )
+        for response in responses:
+            if succeeded(response.json()):
+                with self._lock:
+                    self.device_shards.pop(deviceID, None)
+                return response.content
+        return responses[0].content
+
+    def write(self, method, uri, params, body):
+        path = "/".join(uri)
+        if len(uri) > 1 and uri[0].lower() == "devices" and uri[1].lower() == "bulk":
+            return self.bulk_write(method, path, body)
+        if len(uri) > 0 and uri[0].lower() == "houses":
+            houseID = body.get("houseID") if isinstance(body, dict) else None
+            shard = self.ring.shard_for(houseID) if houseID is not None else next(iter(self.shard_urls))
+            return self.passthrough(self.request(shard, method, path, params=params, json=body))
+        if len(uri) > 0 and uri[0].lower() == "devices":
+            shard = self.owner_of_device(body)
+            response = self.request(shard, method, path, params=params, json=body)
+            if succeeded(response.json()):
+                self.drop_from_previous_shard(body["deviceID"], shard)
+            return self.passthrough(response)
+        return self.passthrough(self.request(next(iter(self.shard_urls)), method, path, params=params, json=body))
+
+    def bulk_write(self, method, path, body):
+        """Splits a bulk upsert by owning shard and merges the shards' results."""
+        devices = body.get("devicesList") if isinstance(body, dict) else body
+        if not isinstance(devices, list):
+            return self.passthrough(self.request(next(iter(self.shard_urls)), method, path, json=body))
+        groups = {}
+        for index, device in enumerate(devices):
+            groups.setdefault(self.owner_of_device(device), []).append(index)
+        responses = self.fan_out_each(method, path, {
+            shard: {"json": [devices[i] for i in indexes]} for shard, indexes in groups.items()
+        })
+        merged = {"accepted": 0, "rejected": 0, "results": []}
+        for shard, response in zip(groups, responses):
+            report = response.json()
+            merged["accepted"] += report["accepted"]
+            merged["rejected"] += report["rejected"]
+            for result in report["results"]:
+                result["index"] = groups[shard][result["index"]]
+                if "status" in result:
+                    self.drop_from_previous_shard(result["deviceID"], shard)
+                merged["results"].append(result)
+        merged["results"].sort(key=lambda result: result["index"])
+        return merged
+
+    def drop_from_previous_shard(self, deviceID, shard):
+        previous = self.moved(deviceID, shard)
+        if previous is not None:
+            self.request(previous, "DELETE", "devices", params={"deviceID": deviceID})
+
+    def heartbeat(self, body):
+        """Splits the deviceIDs by shard; IDs no shard is known to hold are reported unknown."""
+        deviceIDs = body.get("deviceIDs") if isinstance(body, dict) else None
+        if not isinstance(deviceIDs, list):
+            return {"errors": ["Expected an object with a deviceIDs list"]}
+        groups, unknown = {}, []
+        for deviceID in deviceIDs:
+            shard = self.device_shards.get(str(deviceID))
+            if shard is None:
+                unknown.append(deviceID)
+            else:
+                groups.setdefault(shard, []).append(deviceID)
+        responses = self.fan_out_each("POST", "heartbeat", {
+            shard: {"json": dict(body, deviceIDs=ids)} for shard, ids in groups.items()
+        })
+        renewed, ttl = 0, None
+        for response in responses:
+            report = response.json()
+            if "errors" in report:
+                return report
+            renewed += report["renewed"]
+            unknown.extend(report["unknown"])
+            ttl = report["ttl"]
+        return {"renewed": renewed, "unknown": unknown, "ttl": ttl}
+
+    def query_devices(self, params):
+        """
+        GET /devices with filters but no houseID: every shard answers the
+        page after the cursor, and the pages are merged by deviceID, the
+        order the registry paginates in.
+        """
+        pages = [response.json() for response in self.fan_out("GET", "devices", params=params)]
+        if any(not isinstance(page, dict) for page in pages):
+            return next(page for page in pages if not isinstance(page, dict))  # parameter error
+        devices = sorted((d for page in pages for d in page["devices"]), key=lambda d: str(d["deviceID"]))
+        limit = int(params["limit"]) if params.get("limit") else None
+        more = any(page["nextCursor"] is not None for page in pages)
+        if limit is not None and len(devices) > limit:
+            devices, more = devices[:limit], True
+        return {"devices": devices, "nextCursor": str(devices[-1]["deviceID"]) if more and devices else None}
+
+    def bootstrap(self, units=None):
+        """Asks every shard for the bootstrap of the units it owns and merges the answers."""
+        groups = {shard: [] for shard in self.shard_urls}
+        for unit in (units.split(",") if units else []):
+            groups[self.ring.shard_for(unit.split("-")[0])].append(unit)
+        responses = self.fan_out_each("GET", "bootstrap", {
+            shard: {"params": {"units": ",".join(owned)}} if owned else {} for shard, owned in groups.items()
+        })
+        answers = [response.json() for response in responses]
+        epoch, _, revision = combine_etags(f'"{a["epoch"]}.{a["revision"]}"' for a in answers).strip('"').rpartition(".")
+        merged = dict(answers[0], epoch=epoch, revision=int(revision), ttl=min(a["ttl"] for a in answers))
+        if units:
+            merged["assignments"] = {}
+            for answer in answers:
+                merged["assignments"].update(answer.get("assignments", {}))
+        return merged
+
+    def stop(self):
+        self._pool.shutdown(wait=False)
+
+
+def start_shards(catalog_path, count, data_dir, base_port, storage):
+    """
+    Starts count catalog_registry.py processes on base_port, base_port+1...
+    Each shard keeps its files in data_dir/shard-<i>; on the first start its
+    catalog.json is cut out of catalog_path with the router's hash ring.
+    """
+    ring = HashRing(f"shard-{i}" for i in range(count))
+    # Seed every shard before starting any, so a bad seed catalog leaves nothing running.
+    documents = None
+    shard_dirs = []
+    for shard in ring.shards:
+        shard_dir = os.path.join(data_dir, shard)
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_catalog = os.path.join(shard_dir, "catalog.json")
+        if not os.path.exists(shard_catalog):
+            if documents is None:
+                documents = split_catalog(load_catalog(catalog_path), ring)
+            with open(shard_catalog, "w") as fptr:
+                json.dump(documents[shard], fptr, indent=4)
+            print(f"{shard}: {len(documents[shard]['housesList'])} houses")
+        shard_dirs.append(shard_dir)
+
+    processes, urls = [], []
+    try:
+        for i, shard_dir in enumerate(shard_dirs):
+            port = base_port + i
+            processes.append(subprocess.Popen([
+                sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog_registry.py"),
+                "--data-dir", shard_dir, "--port", str(port), "--storage", storage,
+                # Each shard has its own revision; one feed per shard would interleave them.
+                "--no-feed",
+            ]))
+            urls.append(f"http://127.0.0.1:{port}/")
+        for url, process in zip(urls, processes):
+            wait_until_up(url, process)
+    except BaseException:
+        stop_shards(processes)
+        raise
+    return processes, urls
+
+
+def stop_shards(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Shard at {url} exited with code {process.returncode}")
+        try:
+            requests.get(f"{url}topic", timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Shard at {url} did not start within {timeout}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ThiefDetector sharded catalog router")
+    parser.add_argument("--shards", type=int, default=2, help="number of local registry processes to start")
+    parser.add_argument("--shard-urls", help="comma separated URLs of already running shards (nothing is started)")
+    parser.add_argument("--catalog", default="catalog.json", help="catalog split across the shards on their first start")
+    parser.add_argument("--data-dir", default="shards")
+    parser.add_argument("--base-port", type=int, default=8091)
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default="json")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    processes = []
+    if args.shard_urls:
+        urls = args.shard_urls.split(",")
+    else:
+        processes, urls = start_shards(args.catalog, args.shards, args.data_dir, args.base_port, args.storage)
+
+    try:
+        router = CatalogRouter(urls)
+        conf = {"/": {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}}
+        cherrypy.config.update({'server.socket_host': args.host, 'server.socket_port': args.port})
+        cherrypy.tree.mount(router, '/', conf)
+        cherrypy.engine.subscribe('stop', router.stop)
+        # SIGTERM/SIGHUP exit the engine instead of killing the process, so the shards are stopped below.
+        cherrypy.engine.signals.subscribe()
+        cherrypy.engine.start()
+        try:
+            cherrypy.engine.block()
+        except KeyboardInterrupt:
+            print("Shutting down...")
+            cherrypy.engine.stop()
+    finally:
+        stop_shards(processes)
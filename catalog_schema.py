@@ -0,0 +1,105 @@
+"""
+Compiled payload validators for the catalog schemas.
+
+A schema maps field names to rules:
+    {"type": <type or tuple of types>, "required": bool,
+     "schema": {...},    # nested schema, for dict fields
+     "items": {...}}     # rules every element must satisfy, for list fields
+"items" rules take "type" and "schema" as well, e.g. a list of dicts.
+
+compile_schema() turns a schema into a function once, at import time: the
+checks are generated as straight-line Python code (no schema lookups, no
+string formatting), so a valid payload costs one call. Only an invalid
+payload walks the schema again to build the error messages.
+"""
+
+_MISSING = object()
+
+
+def compile_schema(schema):
+    """
+    Returns validate(payload) -> list of errors, empty if the payload is valid.
+    """
+    namespace = {"MISSING": _MISSING}
+    lines = ["    if not isinstance(p, dict): return False", "    try:"]
+    _emit_schema(schema, "p", 2, lines, namespace)
+    lines += ["    except KeyError:", "        return False", "    return True"]
+    # Constants are bound as default arguments so the checks use fast local lookups.
+    constants = [name for name in namespace if name[0] in "TM"]
+    lines.insert(0, f"def check(p, {', '.join(f'{name}={name}' for name in constants)}):")
+    exec("\n".join(lines), namespace)
+    check = namespace["check"]
+
+    def validate(payload):
+        if check(payload):
+            return []
+        return explain(schema, payload)
+
+    validate.check = check
+    validate.source = "\n".join(lines)
+    return validate
+
+
+def explain(schema, payload, prefix=""):
+    """Lists every schema violation of payload, with dotted field names."""
+    if not isinstance(payload, dict):
+        return [f"Invalid payload{' for ' + repr(prefix.rstrip('.')) if prefix else ''}. Expected an object, got {type(payload)}"]
+    errors = []
+    for field, rules in schema.items():
+        label = prefix + field
+        if field not in payload:
+            if rules.get("required"):
+                errors.append(f"Missing required field: '{label}'")
+            continue
+        errors.extend(_explain_value(rules, payload[field], label))
+    return errors
+
+
+def _explain_value(rules, value, label):
+    if not isinstance(value, rules["type"]):
+        return [f"Invalid type for field '{label}'. Expected {rules['type']}, got {type(value)}"]
+    errors = []
+    if "schema" in rules:
+        errors.extend(explain(rules["schema"], value, label + "."))
+    if "items" in rules:
+        for position, item in enumerate(value):
+            errors.extend(_explain_value(rules["items"], item, f"{label}[{position}]"))
+    return errors
+
+
+def _emit_schema(schema, var, depth, lines, namespace):
+    indent = "    " * depth
+    for field, rules in schema.items():
+        value = _name("v", namespace)
+        if rules.get("required"):
+            # A missing required field raises KeyError, caught once in check().
+            lines.append(f"{indent}{value} = {var}[{field!r}]")
+            _emit_value(rules, value, depth, lines, namespace)
+        else:
+            lines.append(f"{indent}{value} = {var}.get({field!r}, MISSING)")
+            lines.append(f"{indent}if {value} is not MISSING:")
+            _emit_value(rules, value, depth + 1, lines, namespace)
+
+
+def _emit_value(rules, value, depth, lines, namespace):
+    indent = "    " * depth
+    type_name = _name("T", namespace, rules["type"])
+    lines.append(f"{indent}if not isinstance({value}, {type_name}): return False")
+    if "schema" in rules:
+        _emit_schema(rules["schema"], value, depth, lines, namespace)
+    if "items" in rules:
+        items = rules["items"]
+        if "schema" not in items and isinstance(items["type"], type):
+            # Plain list of one type: checked in C, without a Python-level loop.
+            instance_of = _name("T", namespace, items["type"].__instancecheck__)
+            lines.append(f"{indent}if not all(map({instance_of}, {value})): return False")
+        else:
+            item = _name("i", namespace)
+            lines.append(f"{indent}for {item} in {value}:")
+            _emit_value(items, item, depth + 1, lines, namespace)
+
+
+def _name(prefix, namespace, value=None):
+    name = f"{prefix}{len(namespace)}"
+    namespace[name] = value
+    return name
@@ -0,0 +1,405 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def atomic_write(path, data):
+    """
+    Writes bytes to path through a temporary file in the same directory and
+    an os.replace(), so readers (and a crash) only ever see the old or the
+    new document, never a half-written one.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as fptr:
+        fptr.write(data)
+        fptr.flush()
+        os.fsync(fptr.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_catalog(address):
+    """
+    Loads a catalog document. If it does not parse (e.g. a write was
+    interrupted), falls back to catalog-base.json next to this module.
+    """
+    try:
+        with open(address, 'r') as fptr:
+            return json.load(fptr)
+    except (OSError, json.JSONDecodeError) as e:
+        base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog-base.json')
+        print(f"Error loading catalog from {address}: {e}. Falling back to {base_path}")
+        with open(base_path, 'r') as fptr:
+            return json.load(fptr)
+
+
+class CatalogWriter():
+    """
+    Write-behind persistence for the catalog document.
+
+    Mutations only mark the catalog dirty. A background thread serializes it
+    once per flush_interval seconds, or as soon as batch_size mutations are
+    pending, so a burst of device updates costs a single compact write.
+    """
+
+    def __init__(self, path, get_catalog, flush_interval=5, batch_size=100):
+        self.path = path
+        self.get_catalog = get_catalog
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self.dirty = False
+        self.pending = 0
+        self.last_flush = time.time()
+        self.bytes_written = 0
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="catalog-writer", daemon=True)
+        self._thread.start()
+
+    def replay(self, snapshot_seq):
+        # The document is always written whole, there is nothing to replay.
+        return []
+
+    def append(self, record):
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        with self._lock:
+            self.dirty = True
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        """Writes the catalog now if anything changed since the last flush."""
+        with self._lock:
+            if not self.dirty:
+                return False
+            self.dirty = False
+            pending, self.pending = self.pending, 0
+        try:
+            data = json.dumps(self.get_catalog(), separators=(',', ':')).encode('utf-8')
+            atomic_write(self.path, data)
+        except Exception as e:
+            # Keep the changes queued; the next flush will retry them.
+            with self._lock:
+                self.dirty = True
+                self.pending += pending
+            print(f"Error saving catalog: {e}")
+            return False
+        self.last_flush = time.time()
+        self.bytes_written += len(data)
+        return True
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._running:
+                self.flush()
+
+
+class CatalogJournal():
+    """
+    Append-only journal plus snapshot storage for the catalog.
+
+    Every mutation is appended to a line-delimited JSON journal, so its cost
+    is proportional to the record rather than to the catalog. Every
+    compact_every records the catalog is written as a snapshot and the
+    journal is truncated. On startup the snapshot is loaded and the journal
+    tail is replayed; a partially written last line is dropped.
+    """
+
+    def __init__(self, snapshot_path, journal_path, get_catalog, compact_every=1000, fsync=False):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.get_catalog = get_catalog
+        self.compact_every = compact_every
+        self.fsync = fsync
+
+        self.seq = 0
+        self.records_since_compaction = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._journal = None
+
+    def replay(self, snapshot_seq):
+        """
+        Returns the journal records newer than the snapshot, in order, and
+        opens the journal for appending after the last complete record.
+        """
+        self.seq = snapshot_seq
+        records = []
+        valid_bytes = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as fptr:
+                for line in fptr:
+                    if not line.endswith(b'\n'):
+                        print(f"Dropping partial journal record at byte {valid_bytes}")
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        print(f"Dropping corrupt journal record at byte {valid_bytes}")
+                        break
+                    valid_bytes += len(line)
+                    self.records_since_compaction += 1
+                    if record["seq"] > snapshot_seq:
+                        self.seq = record["seq"]
+                        records.append(record)
+        self._journal = open(self.journal_path, 'ab')
+        self._journal.truncate(valid_bytes)
+        return records
+
+    def append(self, record):
+        with self._lock:
+            self.seq += 1
+            record["seq"] = self.seq
+            line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+            self._journal.write(line)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self.bytes_written += len(line)
+            self.records_since_compaction += 1
+            if self.records_since_compaction >= self.compact_every:
+                self._compact()
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def close(self):
+        self.compact()
+        self._journal.close()
+
+    def _compact(self):
+        catalog = self.get_catalog()
+        catalog["journalSeq"] = self.seq
+        try:
+            data = json.dumps(catalog, separators=(',', ':')).encode('utf-8')
+            atomic_write(self.snapshot_path, data)
+        except Exception as e:
+            print(f"Error compacting catalog journal: {e}")
+            return
+        self.bytes_written += len(data)
+        self._journal.truncate(0)
+        self._journal.seek(0)
+        self.records_since_compaction = 0
+
+
+class CatalogSQLite():
+    """
+    SQLite storage for the catalog (WAL mode).
+
+    Houses, floors, units and devices live in their own tables; everything
+    that is not a key is kept as a JSON document. Devices are indexed by
+    deviceID, by (houseID, floorID, unitID) and by lastUpdate.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS houses (
+            houseID TEXT PRIMARY KEY,
+            doc TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS floors (
+            houseID TEXT NOT NULL,
+            floorID TEXT NOT NULL,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (houseID, floorID)
+        );
+        CREATE TABLE IF NOT EXISTS units (
+            houseID TEXT NOT NULL,
+            floorID TEXT NOT NULL,
+            unitID TEXT NOT NULL,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (houseID, floorID, unitID)
+        );
+        CREATE TABLE IF NOT EXISTS devices (
+            deviceID TEXT NOT NULL,
+            houseID TEXT NOT NULL,
+            floorID TEXT NOT NULL,
+            unitID TEXT NOT NULL,
+            lastUpdate TEXT NOT NULL,
+            doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_devices_id ON devices (deviceID);
+        CREATE INDEX IF NOT EXISTS idx_devices_unit ON devices (houseID, floorID, unitID);
+        CREATE INDEX IF NOT EXISTS idx_devices_last_update ON devices (lastUpdate);
+    """
+
+    def __init__(self, db_path, get_catalog):
+        self.db_path = db_path
+        self.get_catalog = get_catalog
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def load(self):
+        """
+        Rebuilds the catalog document from the database.
+        Returns None if the database is empty and needs an import.
+        """
+        with self._lock:
+            meta = self.conn.execute("SELECT key, value FROM meta").fetchall()
+            if not meta:
+                return None
+            catalog = {key: json.loads(value) for key, value in meta}
+            houses = {}
+            catalog["housesList"] = []
+            for houseID, doc in self.conn.execute("SELECT houseID, doc FROM houses ORDER BY rowid"):
+                house = json.loads(doc)
+                house["floors"] = []
+                houses[houseID] = house
+                catalog["housesList"].append(house)
+            floors = {}
+            for houseID, floorID, doc in self.conn.execute("SELECT houseID, floorID, doc FROM floors ORDER BY rowid"):
+                floor = json.loads(doc)
+                floor["units"] = []
+                floors[(houseID, floorID)] = floor
+                houses[houseID]["floors"].append(floor)
+            units = {}
+            for houseID, floorID, unitID, doc in self.conn.execute(
+                    "SELECT houseID, floorID, unitID, doc FROM units ORDER BY rowid"):
+                unit = json.loads(doc)
+                unit["devicesList"] = []
+                units[(houseID, floorID, unitID)] = unit
+                floors[(houseID, floorID)]["units"].append(unit)
+            for houseID, floorID, unitID, doc in self.conn.execute(
+                    "SELECT houseID, floorID, unitID, doc FROM devices ORDER BY rowid"):
+                units[(houseID, floorID, unitID)]["devicesList"].append(json.loads(doc))
+        return catalog
+
+    def import_catalog(self, catalog):
+        """Replaces the database content with a catalog document."""
+        with self._lock, self.conn:
+            for table in ("meta", "houses", "floors", "units", "devices"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self._write_meta(catalog)
+            for house in catalog.get("housesList", []):
+                self._insert_house(house)
+
+    def replay(self, snapshot_seq):
+        # Every record is committed to the database as it happens.
+        return []
+
+    def append(self, record):
+        op = record["op"]
+        with self._lock, self.conn:
+            if op == "add_house":
+                self._insert_house(record["house"])
+            elif op == "update_house":
+                houseID = str(record["houseID"])
+                house = next(h for h in self.get_catalog()["housesList"] if str(h["houseID"]) == houseID)
+                self._replace_house(house)
+            elif op == "upsert_device":
+                self._upsert_device(record["device"])
+            elif op == "upsert_devices":
+                for device in record["devices"]:
+                    self._upsert_device(device)
+            elif op == "delete_device":
+                self.conn.execute("DELETE FROM devices WHERE deviceID = ?", (str(record["deviceID"]),))
+            elif op == "delete_devices":
+                self.conn.executemany("DELETE FROM devices WHERE deviceID = ?",
+                                      [(str(deviceID),) for deviceID in record["deviceIDs"]])
+            elif op == "compact":
+                self._rewrite_devices()
+            self._set_meta("lastUpdate", record["time"])
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _write_meta(self, catalog):
+        for key, value in catalog.items():
+            if key not in ("housesList", "journalSeq"):
+                self._set_meta(key, value)
+
+    def _set_meta(self, key, value):
+        value = json.dumps(value)
+        self.bytes_written += len(value)
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _insert_house(self, house):
+        houseID = str(house["houseID"])
+        self._insert("INSERT INTO houses (houseID, doc) VALUES (?, ?)",
+                     (houseID,), {k: v for k, v in house.items() if k != "floors"})
+        self._insert_floors(houseID, house)
+
+    def _replace_house(self, house):
+        # The house row is updated in place so the house keeps its position.
+        houseID = str(house["houseID"])
+        doc = json.dumps({k: v for k, v in house.items() if k != "floors"}, separators=(',', ':'))
+        self.bytes_written += len(doc)
+        self.conn.execute("UPDATE houses SET doc = ? WHERE houseID = ?", (doc, houseID))
+        for table in ("floors", "units", "devices"):
+            self.conn.execute(f"DELETE FROM {table} WHERE houseID = ?", (houseID,))
+        self._insert_floors(houseID, house)
+
+    def _insert_floors(self, houseID, house):
+        for floor in house.get("floors", []):
+            floorID = str(floor["floorID"])
+            self._insert("INSERT INTO floors (houseID, floorID, doc) VALUES (?, ?, ?)",
+                         (houseID, floorID), {k: v for k, v in floor.items() if k != "units"})
+            for unit in floor.get("units", []):
+                unitID = str(unit["unitID"])
+                self._insert("INSERT INTO units (houseID, floorID, unitID, doc) VALUES (?, ?, ?, ?)",
+                             (houseID, floorID, unitID), {k: v for k, v in unit.items() if k != "devicesList"})
+                for device in unit.get("devicesList", []):
+                    self._insert_device((houseID, floorID, unitID), device)
+
+    def _upsert_device(self, device):
+        location = device["deviceLocation"]
+        key = (str(location["houseID"]), str(location["floorID"]), str(location["unitID"]))
+        deviceID = str(device["deviceID"])
+        # Like the index, keep a single row per device: the first one in its unit.
+        rows = [rowid for (rowid,) in self.conn.execute(
+            "SELECT rowid FROM devices WHERE deviceID = ? AND houseID = ? AND floorID = ? AND unitID = ? ORDER BY rowid",
+            (deviceID,) + key
+        )]
+        self.conn.execute(
+            "DELETE FROM devices WHERE deviceID = ? AND rowid != ?", (deviceID, rows[0] if rows else -1)
+        )
+        if not rows:
+            self._insert_device(key, device)
+            return
+        doc = json.dumps(device, separators=(',', ':'))
+        self.bytes_written += len(doc)
+        self.conn.execute("UPDATE devices SET lastUpdate = ?, doc = ? WHERE rowid = ?",
+                          (device.get("lastUpdate", ""), doc, rows[0]))
+
+    def _rewrite_devices(self):
+        """Replaces every device row with the in-memory catalog's devices, in order."""
+        self.conn.execute("DELETE FROM devices")
+        for house in self.get_catalog()["housesList"]:
+            for floor in house.get("floors", []):
+                for unit in floor.get("units", []):
+                    key = (str(house["houseID"]), str(floor["floorID"]), str(unit["unitID"]))
+                    for device in unit.get("devicesList", []):
+                        self._insert_device(key, device)
+
+    def _insert_device(self, key, device):
+        self._insert("INSERT INTO devices (deviceID, houseID, floorID, unitID, lastUpdate, doc) VALUES (?, ?, ?, ?, ?, ?)",
+                     (str(device["deviceID"]),) + key + (device.get("lastUpdate", ""),), device)
+
+    def _insert(self, sql, keys, doc):
+        doc = json.dumps(doc, separators=(',', ':'))
+        self.bytes_written += len(doc)
+        self.conn.execute(sql, keys + (doc,))
@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Common"))
+
+from catalog_registry import WebCatalogThiefDetector  # noqa: E402
+
+BASE_CATALOG = os.path.join(ROOT, "catalog-base.json")
+
+
+@pytest.fixture
+def make_registry(tmp_path):
+    """
+    Returns make(storage="json", **kwargs) -> a registry with its data
+    in tmp_path, starting from a copy of catalog-base.json, with the MQTT
+    feed off. Calling it again reopens the same data. Registries are
+    stopped after the test unless the test took them down itself (see
+    shut_down() and crash()).
+    """
+    address = tmp_path / "catalog.json"
+    shutil.copy(BASE_CATALOG, address)
+    registries = []
+
+    def make(storage="json", **kwargs):
+        registry = WebCatalogThiefDetector(str(address), storage=storage, feed=False, data_dir=str(tmp_path), **kwargs)
+        registries.append(registry)
+        return registry
+
+    yield make
+    for registry in registries:
+        if not getattr(registry, "stopped", False):
+            registry.stop()
+
+
+def shut_down(registry):
+    registry.stop()
+    registry.stopped = True
+
+
+def crash(registry):
+    """Stops a journal registry the way a killed process would: no compaction on the way out."""
+    registry.leases.stop()
+    registry.storage._journal.close()
+    registry.stopped = True
+
+
+def device(registry, deviceID, **fields):
+    """A copy of a device of the base catalog, with fields replaced."""
+    return dict(registry.get_device_by_id(deviceID), **fields)
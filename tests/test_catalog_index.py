@@ -0,0 +1,123 @@
+import copy
+import json
+import random
+
+import pytest
+
+from catalog_index import CatalogIndex, SortedKeys
+from tests.conftest import BASE_CATALOG
+
+
+@pytest.fixture
+def index():
+    with open(BASE_CATALOG) as fptr:
+        return CatalogIndex(json.load(fptr)["housesList"])
+
+
+def moved(index, deviceID, houseID, floorID, unitID, **fields):
+    device = dict(index.get_device(deviceID), **fields)
+    device["deviceLocation"] = {"houseID": houseID, "floorID": floorID, "unitID": unitID}
+    return device
+
+
+def copies_in_tree(index, deviceID):
+    return [
+        (house["houseID"], floor["floorID"], unit["unitID"])
+        for house in index.housesList
+        for floor in house["floors"]
+        for unit in floor["units"]
+        for device in unit["devicesList"]
+        if str(device["deviceID"]) == str(deviceID)
+    ]
+
+
+def test_move_across_units_keeps_one_copy(index):
+    device = moved(index, 10101, "1", "1", "2")
+    assert index.upsert_device(CatalogIndex.location_key(device), device) is True
+    assert copies_in_tree(index, 10101) == [("1", "1", "2")]
+    assert index.locations_of(10101) == [("1", "1", "2")]
+    assert index.get_device("10101") is device
+    assert index.find_duplicates() == {}
+
+
+def test_move_across_houses_keeps_one_copy(index):
+    device = moved(index, 10101, "2", "2", "1")
+    index.upsert_device(CatalogIndex.location_key(device), device)
+    assert copies_in_tree(index, 10101) == [("2", "2", "1")]
+    assert index.locations_of(10101) == [("2", "2", "1")]
+    assert index.get_unit("1", "1", "1")["devicesList"] == []
+    assert [d["deviceID"] for d in index.query(houseID="2")[0]] == [10101, 20101, 20102, 20103]
+    assert index.query(houseID="1", floorID="1", unitID="1") == ([], None)
+
+
+def test_upsert_in_place_replaces_the_copy(index):
+    device = moved(index, 10102, "1", "1", "2", deviceStatus="ON")
+    assert index.upsert_device(CatalogIndex.location_key(device), device) is False
+    assert copies_in_tree(index, 10102) == [("1", "1", "2")]
+    assert [d["deviceID"] for d in index.query(status="ON")[0]] == [10102]
+
+
+def test_compact_keeps_the_newest_copy_across_houses():
+    with open(BASE_CATALOG) as fptr:
+        housesList = json.load(fptr)["housesList"]
+    older = copy.deepcopy(housesList[0]["floors"][0]["units"][0]["devicesList"][0])
+    newer = dict(older, lastUpdate="2030-01-01 00:00:00", deviceStatus="ON")
+    housesList[0]["floors"][0]["units"][0]["devicesList"].append(older)
+    housesList[1]["floors"][1]["units"][0]["devicesList"].append(newer)
+    index = CatalogIndex(housesList)
+
+    assert index.find_duplicates() == {"10101": (("2", "2", "1"), 1)}
+    assert index.compact() == [{"deviceID": "10101", "kept": ["2", "2", "1"], "removed": 2}]
+    assert copies_in_tree(index, 10101) == [("2", "2", "1")]
+    assert index.get_device(10101)["deviceStatus"] == "ON"
+    assert index.find_duplicates() == {}
+
+
+def test_conflicting_devices(index):
+    house = copy.deepcopy(index.get_house("2"))
+    units = house["floors"][0]["units"]
+    units[0]["devicesList"].append(dict(index.get_device(10101)))
+    units[1]["devicesList"].append(dict(units[0]["devicesList"][0]))
+    assert index.conflicting_devices(house) == ["10101", "20101"]
+    assert index.conflicting_devices(index.get_house("1")) == []
+
+
+def test_houses_list_snapshot_is_not_modified_by_writes(index):
+    snapshot = index.housesList
+    before = copy.deepcopy(snapshot)
+    device = moved(index, 10101, "2", "1", "1")
+    index.upsert_device(CatalogIndex.location_key(device), device)
+    index.remove_device(20102)
+    assert snapshot == before
+    assert index.housesList is not snapshot
+    assert index.housesList is index.housesList
+
+
+def test_query_pages_by_device_id(index):
+    pages, after = [], None
+    while True:
+        devices, after = index.query(limit=4, after=after)
+        pages.append([d["deviceID"] for d in devices])
+        if after is None:
+            break
+    assert pages == [[10101, 10102, 10103, 20101], [20102, 20103]]
+
+
+def test_sorted_keys_match_sorted(monkeypatch):
+    monkeypatch.setattr(SortedKeys, "LOAD", 4)
+    rng = random.Random(7)
+    keys, expected = SortedKeys(), set()
+    for _ in range(2000):
+        key = rng.randrange(200)
+        if rng.random() < 0.6:
+            if key not in expected:
+                keys.add(key)
+                expected.add(key)
+        else:
+            keys.discard(key)
+            expected.discard(key)
+    ordered = sorted(expected)
+    assert list(keys.iter_from()) == ordered
+    assert len(keys) == len(ordered)
+    assert list(keys.iter_from(100)) == [k for k in ordered if k >= 100]
+    assert list(keys.iter_from(100, inclusive=False)) == [k for k in ordered if k > 100]
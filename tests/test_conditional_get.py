@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+import pytest
+
+from catalog_aio import AsyncCatalogServer
+from catalog_changes import NotModified
+from tests.conftest import device
+
+
+@pytest.mark.parametrize("route", ["houses", "devices"])
+def test_matching_etag_raises_not_modified(make_registry, route):
+    registry = make_registry()
+    response_headers = {}
+    body = registry.handle_get((route,), {}, {}, response_headers)
+    etag = response_headers["ETag"]
+    assert json.loads(body)
+
+    response_headers = {}
+    with pytest.raises(NotModified):
+        registry.handle_get((route,), {}, {"If-None-Match": etag}, response_headers)
+    assert response_headers["ETag"] == etag
+
+
+def test_write_changes_the_etag(make_registry):
+    registry = make_registry()
+    response_headers = {}
+    registry.handle_get(("devices",), {}, {}, response_headers)
+    etag = response_headers["ETag"]
+
+    registry.handle_put(("devices",), {}, device(registry, 10101, deviceStatus="ON"))
+    response_headers = {}
+    body = registry.handle_get(("devices",), {}, {"If-None-Match": etag}, response_headers)
+    assert response_headers["ETag"] != etag
+    assert {d["deviceID"]: d["deviceStatus"] for d in json.loads(body)}[10101] == "ON"
+
+
+def test_asyncio_server_answers_304(make_registry):
+    registry = make_registry()
+    server = AsyncCatalogServer(registry)
+
+    async def requests():
+        status, _, headers = await server.dispatch("GET", "/houses", {}, b"")
+        assert status == 200
+        status, value, not_modified = await server.dispatch("GET", "/houses", {"If-None-Match": headers["ETag"]}, b"")
+        assert (status, value, not_modified["ETag"]) == (304, None, headers["ETag"])
+        body = json.dumps({"deviceIDs": ["10101"]}).encode()
+        status, _, _ = await server.dispatch("POST", "/heartbeat", {}, body)
+        assert status == 200
+        # A heartbeat is not a catalog change: the tag still matches.
+        status, _, _ = await server.dispatch("GET", "/houses", {"If-None-Match": headers["ETag"]}, b"")
+        assert status == 304
+
+    asyncio.run(requests())
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from catalog_leases import LeaseTable
+
+
+def test_pop_expired_skips_renewed_leases():
+    leases = LeaseTable(default_ttl=10)
+    leases.renew(["a", "b"], now=0)
+    leases.renew(["a"], now=5)
+    assert leases.pop_expired(now=10) == ["b"]
+    assert leases.expires_at("a") == 15
+    assert leases.pop_expired(now=14) == []
+    assert leases.pop_expired(now=15) == ["a"]
+    assert leases.expiry == {}
+
+
+def test_dropped_lease_does_not_expire():
+    leases = LeaseTable(default_ttl=10)
+    leases.renew([1, 2], now=0)
+    leases.drop(["1"])
+    assert leases.pop_expired(now=10) == ["2"]
+
+
+def test_heartbeat_between_pop_and_expiry_keeps_the_device(make_registry):
+    registry = make_registry()
+    registry.leases.renew(["10101"], ttl=1, now=time.time() - 10)
+    expired = registry.leases.pop_expired()
+    assert expired == ["10101"]
+
+    # The heartbeat lands after the expiry thread popped the lease but before it committed.
+    assert registry.heartbeat({"deviceIDs": ["10101"]})["renewed"] == 1
+    registry.expire_devices(expired)
+    assert registry.get_device_by_id(10101) is not None
+    assert registry.leases.expires_at(10101) > time.time()
+
+
+def test_heartbeat_after_expiry_reports_the_device_unknown(make_registry):
+    registry = make_registry()
+    registry.leases.renew(["10101"], ttl=1, now=time.time() - 10)
+    registry.expire_devices(registry.leases.pop_expired())
+    assert registry.get_device_by_id(10101) is None
+
+    assert registry.heartbeat({"deviceIDs": ["10101", "10102"]}) == {"renewed": 1, "unknown": ["10101"], "ttl": 3600}
+    assert registry.leases.expires_at(10101) is None
+
+
+def test_heartbeat_does_not_wait_for_the_writer(make_registry):
+    registry = make_registry()
+    result = {}
+    with registry._write_lock:
+        worker = threading.Thread(target=lambda: result.update(registry.heartbeat({"deviceIDs": ["10101"]})))
+        worker.start()
+        worker.join(5)
+        assert not worker.is_alive()
+    assert result["renewed"] == 1
+
+
+def test_expiry_thread_removes_devices_and_spares_renewed_ones(make_registry):
+    registry = make_registry()
+    expired = threading.Event()
+    registry.leases.subscribe(lambda deviceIDs: expired.set())
+    registry.leases.renew(["10101", "10102"], ttl=1)
+    registry.heartbeat({"deviceIDs": ["10102"], "ttl": 60})
+    assert expired.wait(5)
+    # Listeners run in subscription order: expire_devices has committed by now.
+    assert registry.get_device_by_id(10101) is None
+    assert registry.get_device_by_id(10102) is not None
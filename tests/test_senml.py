@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from MyMQTT import JSONCodec, get_codec
+from senml import BinarySenMLCodec, readings
+
+PACK = {
+    "bn": "ThiefDetector/sensors/1/1/1/",
+    "bt": 1760000000.5,
+    "e": [
+        {"n": "light_sensor", "u": "lux", "t": 0, "v": 312.5},
+        {"n": "motion_sensor", "u": "status", "t": 1, "v": "Detected"},
+        {"n": "door_sensor", "t": 2, "v": 3},
+        {"n": "tamper", "v": True},
+        {"n": "battery", "v": None},
+    ],
+}
+
+
+@pytest.mark.parametrize("name", ["json", "senml-binary"])
+def test_round_trip(name):
+    codec = get_codec(name)
+    assert codec.decode(codec.encode(PACK)) == PACK
+
+
+def test_binary_is_smaller_and_tagged():
+    binary = BinarySenMLCodec().encode(PACK)
+    assert binary[:1] == BinarySenMLCodec.magic
+    assert len(binary) < len(JSONCodec().encode(PACK))
+
+
+def test_binary_timestamps_decode_as_floats():
+    decoded = BinarySenMLCodec().decode(BinarySenMLCodec().encode(PACK))
+    assert [type(record.get("t")) for record in decoded["e"]] == [float, float, float, type(None), type(None)]
+    assert list(readings("ThiefDetector/sensors/1/1/1", decoded))[1] == (
+        "motion_sensor", {"n": "motion_sensor", "u": "status", "t": 1760000001.5, "v": "Detected"})
+
+
+def test_binary_codec_reads_json():
+    codec = BinarySenMLCodec()
+    assert codec.decode(JSONCodec().encode(PACK)) == PACK
+
+
+@pytest.mark.parametrize("msg", [
+    {"deviceIDs": ["10101"]},
+    {"bn": "x", "e": [{"n": "light", "v": {"nested": 1}}]},
+    {"bn": "x", "e": [{"n": "light", "t": "yesterday", "v": 1}]},
+])
+def test_non_packs_fall_back_to_json(msg):
+    payload = BinarySenMLCodec().encode(msg)
+    assert json.loads(payload) == msg
+    assert BinarySenMLCodec().decode(payload) == msg
+
+
+def test_truncated_binary_payload_raises_value_error():
+    codec = BinarySenMLCodec()
+    payload = codec.encode(PACK)
+    for end in range(1, len(payload)):
+        with pytest.raises(ValueError):
+            codec.decode(payload[:end])
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        get_codec("xml")
@@ -0,0 +1,56 @@
+import os
+
+from tests.conftest import crash, device, shut_down
+
+
+def test_journal_replays_after_a_truncated_last_line(make_registry, tmp_path):
+    registry = make_registry("journal")
+    registry.handle_put(("devices",), {}, device(registry, 10101, deviceStatus="ON"))
+    registry.handle_delete(("devices",), {"deviceID": "20103"})
+    crash(registry)
+
+    journal = tmp_path / "catalog.journal"
+    complete = journal.read_bytes()
+    assert complete.count(b"\n") == 2
+    with open(journal, "ab") as fptr:
+        fptr.write(b'{"op":"delete_device","time":"2030-01-01 00:00:00","deviceID":"10102","se')
+
+    registry = make_registry("journal")
+    assert registry.get_device_by_id(10101)["deviceStatus"] == "ON"
+    assert registry.get_device_by_id(20103) is None
+    assert registry.get_device_by_id(10102) is not None
+    # The partial record is cut off, so the next append starts on a clean line.
+    assert journal.read_bytes() == complete
+    assert registry.storage.seq == 2
+
+    registry.handle_put(("devices",), {}, device(registry, 10102, deviceStatus="ON"))
+    crash(registry)
+    registry = make_registry("journal")
+    assert registry.get_device_by_id(10102)["deviceStatus"] == "ON"
+    assert registry.get_device_by_id(10101)["deviceStatus"] == "ON"
+
+
+def test_journal_close_compacts_into_the_snapshot(make_registry, tmp_path):
+    registry = make_registry("journal")
+    registry.handle_put(("devices",), {}, device(registry, 10101, deviceStatus="ON"))
+    shut_down(registry)
+
+    assert os.path.getsize(tmp_path / "catalog.journal") == 0
+    registry = make_registry("journal")
+    assert registry.get_device_by_id(10101)["deviceStatus"] == "ON"
+
+
+def test_sqlite_reopen_keeps_the_changes(make_registry, tmp_path):
+    registry = make_registry("sqlite")
+    moved = device(registry, 10101, deviceStatus="ON", deviceLocation={"houseID": "2", "floorID": "1", "unitID": "2"})
+    registry.handle_put(("devices",), {}, moved)
+    registry.handle_delete(("devices",), {"deviceID": "20103"})
+    shut_down(registry)
+    # Reopening must read the database, not import the JSON catalog again.
+    os.remove(tmp_path / "catalog.json")
+
+    registry = make_registry("sqlite")
+    assert registry.get_device_by_id(10101)["deviceStatus"] == "ON"
+    assert registry.index.locations_of(10101) == [("2", "1", "2")]
+    assert registry.get_device_by_id(20103) is None
+    assert sorted(registry.index.devices) == ["10101", "10102", "10103", "20101", "20102"]